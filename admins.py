@@ -0,0 +1,171 @@
+"""
+Admin roles.
+
+Admins live in the admin_roles table (created by database.init_db), one
+row per (user, role), managed with /grant, /revoke and /admins. ADMIN_IDS
+from the environment are permanent super-admins so a deployment can never
+lock itself out; they can't be revoked from the bot. In multi-tenant mode
+each tenant's admin_ids play that part instead (tenancy.py).
+
+- super: every admin command, and the only role that can change roles
+- booking: booking approvals, daily lists, /calendar
+- registration: approvals, removals, exports, /find, /import_roster
+
+Role checks run on every restricted update, so the whole table is cached
+in memory while the change listener runs (invalidation.py) and reloaded
+after any grant or revoke, in this process or another.
+"""
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+import invalidation
+import queries
+import tenancy
+from database import DatabaseUnavailable, read_transaction, run_query, write_transaction
+
+# ---------------- Config ----------------
+# Bootstrap super-admins, comma-separated
+ADMIN_IDS = frozenset(int(x.strip()) for x in os.getenv("ADMIN_IDS", "1779704544").split(",") if x.strip())
+
+SUPER = "super"
+BOOKING = "booking"
+REGISTRATION = "registration"
+ROLES = (SUPER, BOOKING, REGISTRATION)
+
+# ---------------- Statements ----------------
+queries.register("admin_roles.all", "SELECT user_id, role FROM admin_roles")
+queries.register(
+    "admin_roles.grant",
+    """
+    INSERT INTO admin_roles (user_id, role, granted_by, created_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id, role) DO NOTHING
+    RETURNING user_id;
+    """,
+)
+queries.register("admin_roles.revoke", "DELETE FROM admin_roles WHERE user_id=? AND role=? RETURNING user_id")
+queries.register("admin_roles.revoke_all", "DELETE FROM admin_roles WHERE user_id=? RETURNING user_id")
+
+
+def bootstrap_ids() -> FrozenSet[int]:
+    """Permanent super-admins of the bound tenant."""
+    tenant = tenancy.current()
+    return tenant.admin_ids if tenant is not None else ADMIN_IDS
+
+
+# ---------------- Role cache ----------------
+# tenant id -> user_id -> roles
+_cache: Dict[str, Dict[int, FrozenSet[str]]] = {}
+_version = 0
+_lock = threading.Lock()
+
+
+def _evict(change: invalidation.Change):
+    global _version
+    with _lock:
+        _version += 1
+        if change.tenant is None:
+            _cache.clear()
+        else:
+            _cache.pop(change.tenant, None)
+
+
+invalidation.subscribe("admin_roles", _evict)
+
+
+# tenant id -> roles as last loaded, for while the database is unavailable
+_last_loaded: Dict[str, Dict[int, FrozenSet[str]]] = {}
+
+
+def _load() -> Dict[int, FrozenSet[str]]:
+    rows = read_transaction(
+        lambda conn: run_query(conn, "admin_roles.all").fetchall(), "load_admin_roles", replica=False
+    )
+    roles: Dict[int, Set[str]] = {uid: {SUPER} for uid in bootstrap_ids()}
+    for user_id, role in rows:
+        roles.setdefault(int(user_id), set()).add(role)
+    loaded = _last_loaded[tenancy.current_id()] = {uid: frozenset(r) for uid, r in roles.items()}
+    return loaded
+
+
+def _degraded() -> Dict[int, FrozenSet[str]]:
+    """The last roles we saw, or at least the permanent super-admins."""
+    last = _last_loaded.get(tenancy.current_id())
+    return last if last is not None else {uid: frozenset({SUPER}) for uid in bootstrap_ids()}
+
+
+def _all_roles() -> Dict[int, FrozenSet[str]]:
+    """user_id -> roles for every admin (cached while the change listener runs)."""
+    caching = invalidation.running()
+    tenant_id = tenancy.current_id()
+    if caching:
+        cached = _cache.get(tenant_id)
+        if cached is not None:
+            return cached
+    version = _version
+    try:
+        loaded = _load()
+    except DatabaseUnavailable:
+        return _degraded()
+    if caching:
+        with _lock:
+            # Skip the store if a grant/revoke raced with the read
+            if version == _version:
+                _cache[tenant_id] = loaded
+    return loaded
+
+
+def roles_of(user_id: int) -> FrozenSet[str]:
+    return _all_roles().get(user_id, frozenset())
+
+
+def has_role(user_id: int, *roles: str) -> bool:
+    """True for super-admins and holders of any of `roles` (any role at all when none are given)."""
+    held = roles_of(user_id)
+    if not held:
+        return False
+    return not roles or SUPER in held or not held.isdisjoint(roles)
+
+
+def recipients(*roles: str) -> List[int]:
+    """
+    Admins who hold one of `roles` (super-admins only when they hold it
+    explicitly). If nobody does, the super-admins, so no alert goes unread.
+    """
+    everyone = _all_roles()
+    wanted = set(roles)
+    chosen = [uid for uid, held in everyone.items() if not held.isdisjoint(wanted)]
+    if not chosen:
+        chosen = [uid for uid, held in everyone.items() if SUPER in held]
+    return chosen
+
+
+def list_admins() -> Dict[int, FrozenSet[str]]:
+    return dict(_all_roles())
+
+
+def _published(user_id: int, changed: bool, op: str) -> bool:
+    if changed:
+        invalidation.publish_local(invalidation.Change("admin_roles", op, user_id, user_id))
+    return changed
+
+
+def grant(user_id: int, role: str, granted_by: int) -> bool:
+    """False if the user already had the role."""
+    if role not in ROLES:
+        raise ValueError(f"Unknown role {role!r}")
+    changed = write_transaction(
+        lambda conn: bool(run_query(conn, "admin_roles.grant", (user_id, role, granted_by)).fetchall()), "grant"
+    )
+    return _published(user_id, changed, "INSERT")
+
+
+def revoke(user_id: int, roles: Optional[Iterable[str]] = None) -> bool:
+    """Remove the given roles (all of them when None). False if nothing was removed."""
+    def work(conn) -> bool:
+        if roles is None:
+            return bool(run_query(conn, "admin_roles.revoke_all", (user_id,)).fetchall())
+        return any([bool(run_query(conn, "admin_roles.revoke", (user_id, role)).fetchall()) for role in roles])
+
+    return _published(user_id, write_transaction(work, "revoke"), "DELETE")
@@ -0,0 +1,337 @@
+"""
+Online backups for the SQLite deployment.
+
+A snapshot copies the live database with SQLite's online backup API,
+BACKUP_PAGES_PER_STEP pages at a time, pausing BACKUP_STEP_PAUSE seconds
+between steps, so the bot's writers only ever wait for one short step.
+If the database keeps changing under the copy (each write by another
+connection restarts it), the last attempt copies in a single step.
+
+Each copy is integrity-checked, gzip-compressed into BACKUP_DIR as
+<name>-YYYYmmdd-HHMMSS.db.gz with a .json manifest (SHA-256 of the
+database, row counts), and the newest BACKUP_KEEP are kept. Snapshots run
+every BACKUP_INTERVAL seconds (JobQueue) and on /backup. A lock file in
+BACKUP_DIR (.<name>.lock) serializes snapshots across processes, so of the
+cluster workers that all run the scheduled job, one takes the snapshot and
+the others see it's recent and skip.
+
+Restoring (with the bot stopped) verifies the snapshot first:
+
+    python backup.py verify backups/hall5-20250101-030000.db.gz
+    python backup.py restore backups/hall5-20250101-030000.db.gz [--db PATH]
+
+restore decompresses to a temp file, checks the SHA-256 and row counts
+against the manifest and runs PRAGMA integrity_check. Only then does it
+move the current database (and its -wal/-shm) aside as
+<db>.pre-restore-<stamp> and put the snapshot in its place.
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import secrets
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots are only serialized within the process
+    fcntl = None
+
+from dotenv import load_dotenv
+from telegram.ext import Application, ContextTypes
+
+# For the CLI: before database, which reads DB_PATH at import time
+load_dotenv()
+
+import database
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", str(6 * 3600)))  # 0 disables scheduled snapshots
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.02"))
+# Attempts in small steps before copying in one step
+BACKUP_MAX_RESTARTS = 5
+# Tables whose row counts go into the manifest and are checked on restore
+COUNTED_TABLES = ("registered_users", "pending_users", "bookings", "reminders", "admin_roles")
+
+_lock = threading.Lock()
+_stats = {"snapshots": 0, "failed": 0, "restarts": 0, "last_at": None, "last_file": None, "last_bytes": 0}
+
+
+class BackupError(Exception):
+    pass
+
+
+@dataclass
+class Snapshot:
+    path: str
+    created_at: str
+    size: int
+    sha256: str
+    counts: Dict[str, int]
+    seconds: float
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _name(db_path: Optional[str] = None) -> str:
+    """File name prefix: the tenant id, or the database file's name."""
+    tenant = tenancy.current()
+    if tenant is not None and db_path is None:
+        return tenant.id
+    return os.path.splitext(os.path.basename(db_path or database.DB_PATH))[0]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _check(path: str) -> Dict[str, int]:
+    """integrity_check a database file and return its row counts; raises BackupError."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise BackupError(f"integrity_check failed: {result}")
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in COUNTED_TABLES if t in tables}
+    finally:
+        conn.close()
+
+
+def _copy(source_path: str, dest_path: str):
+    """Online backup in small steps; one step if the source keeps changing under us."""
+    source = sqlite3.connect(source_path, timeout=database.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    try:
+        for attempt in range(BACKUP_MAX_RESTARTS + 1):
+            last_remaining = [None]
+
+            def progress(status, remaining, total):
+                # remaining jumps back up when a write by another connection restarts the copy
+                if last_remaining[0] is not None and remaining > last_remaining[0]:
+                    raise _Restarted()
+                last_remaining[0] = remaining
+                if BACKUP_STEP_PAUSE > 0:
+                    time.sleep(BACKUP_STEP_PAUSE)  # let writers in between steps
+
+            dest = sqlite3.connect(dest_path)
+            try:
+                if attempt == BACKUP_MAX_RESTARTS:
+                    source.backup(dest)
+                else:
+                    source.backup(dest, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+                return
+            except _Restarted:
+                _stats["restarts"] += 1
+            finally:
+                dest.close()
+            os.remove(dest_path)
+    finally:
+        source.close()
+
+
+def _rotate(name: str):
+    snapshots = list_snapshots(name)
+    for old in snapshots[BACKUP_KEEP:]:
+        for path in (old, _manifest_path(old)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _manifest_path(snapshot_path: str) -> str:
+    return snapshot_path[: -len(".db.gz")] + ".json"
+
+
+@contextlib.contextmanager
+def _exclusive(name: str, wait: bool) -> Iterator[bool]:
+    """Hold BACKUP_DIR/.<name>.lock across processes; yields False if not wait and another holds it."""
+    with _lock:
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(BACKUP_DIR, f".{name}.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def snapshot(db_path: Optional[str] = None, skip_if_newer_than: float = 0) -> Optional[Snapshot]:
+    """
+    Take, verify, compress and rotate one snapshot of db_path (default: the bound tenant's database).
+    With skip_if_newer_than, returns None instead when another process is taking
+    one or the newest snapshot is less than that many seconds old.
+    """
+    if database.USE_POSTGRES and db_path is None:
+        raise BackupError("Backups here are for SQLite; use your Postgres provider's backups (or pg_dump).")
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = _name(db_path)
+    with _exclusive(name, wait=not skip_if_newer_than) as held:
+        if not held:
+            return None
+        latest = list_snapshots(name)
+        if skip_if_newer_than and latest and time.time() - os.path.getmtime(latest[0]) < skip_if_newer_than:
+            return None
+        started = time.monotonic()
+        source = db_path or database.db_path()
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        # Unique temp names, in case a process without the lock (no fcntl) snapshots too
+        unique = f"{os.getpid()}-{secrets.token_hex(4)}"
+        raw = os.path.join(BACKUP_DIR, f".{name}-{stamp}-{unique}.db.tmp")
+        final = os.path.join(BACKUP_DIR, f"{name}-{stamp}.db.gz")
+        packed = os.path.join(BACKUP_DIR, f".{name}-{stamp}-{unique}.db.gz.tmp")
+        try:
+            _copy(source, raw)
+            counts = _check(raw)
+            sha = _sha256(raw)
+            with open(raw, "rb") as src, gzip.open(packed, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.replace(packed, final)
+            with open(_manifest_path(final), "w", encoding="utf-8") as f:
+                json.dump({"database": source, "created_at": stamp, "sha256": sha, "counts": counts}, f)
+        except Exception:
+            _stats["failed"] += 1
+            for path in (raw, packed):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        os.remove(raw)
+        _rotate(name)
+
+    result = Snapshot(
+        path=final,
+        created_at=stamp,
+        size=os.path.getsize(final),
+        sha256=sha,
+        counts=counts,
+        seconds=time.monotonic() - started,
+    )
+    _stats.update(snapshots=_stats["snapshots"] + 1, last_at=stamp, last_file=final, last_bytes=result.size)
+    logger.info("Backup %s written (%s bytes, %.1fs)", final, result.size, result.seconds)
+    return result
+
+
+def list_snapshots(name: Optional[str] = None) -> List[str]:
+    """Snapshot files for `name` (the bound tenant's by default), newest first."""
+    name = name or _name()
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    files = [f for f in os.listdir(BACKUP_DIR) if f.startswith(name + "-") and f.endswith(".db.gz")]
+    return [os.path.join(BACKUP_DIR, f) for f in sorted(files, reverse=True)]
+
+
+# ---------------- Restore ----------------
+def verify(snapshot_path: str, dest_path: Optional[str] = None) -> Dict[str, int]:
+    """
+    Decompress a snapshot (to dest_path, or a temp file that is removed) and
+    check it against its manifest; returns the row counts or raises BackupError.
+    """
+    manifest_path = _manifest_path(snapshot_path)
+    if not os.path.exists(manifest_path):
+        raise BackupError(f"No manifest next to {snapshot_path}")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    target = dest_path or snapshot_path + ".verify.tmp"
+    ok = False
+    try:
+        try:
+            with gzip.open(snapshot_path, "rb") as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        except (OSError, EOFError) as e:
+            raise BackupError(f"Can't decompress {snapshot_path}: {e}")
+        if _sha256(target) != manifest["sha256"]:
+            raise BackupError("SHA-256 doesn't match the manifest")
+        counts = _check(target)
+        if counts != manifest["counts"]:
+            raise BackupError(f"Row counts {counts} don't match the manifest {manifest['counts']}")
+        ok = True
+        return counts
+    finally:
+        # Keep the decompressed file only when the caller asked for it and it checked out
+        if (dest_path is None or not ok) and os.path.exists(target):
+            os.remove(target)
+
+
+def restore(snapshot_path: str, db_path: str) -> str:
+    """Verify a snapshot and swap it in for db_path (bot stopped); returns where the old database went."""
+    staged = db_path + ".restore.tmp"
+    verify(snapshot_path, staged)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    aside = f"{db_path}.pre-restore-{stamp}"
+    # The -wal holds committed pages too, so it moves with the file
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.replace(db_path + suffix, aside + suffix)
+    os.replace(staged, db_path)
+    return aside
+
+
+# ---------------- Schedule ----------------
+async def scheduled_snapshot(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        # Cluster workers all run this job; the others skip while one takes it, and after
+        await asyncio.to_thread(snapshot, None, BACKUP_INTERVAL / 2)
+    except Exception:
+        logger.exception("Scheduled backup failed")
+
+
+def install(app: Application):
+    """Schedule snapshots (SQLite only)."""
+    if database.USE_POSTGRES or BACKUP_INTERVAL <= 0:
+        return
+    app.job_queue.run_repeating(scheduled_snapshot, interval=BACKUP_INTERVAL, first=60, name="backup.snapshot")
+
+
+def stats() -> Dict[str, object]:
+    return dict(_stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite snapshots: take, verify or restore.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("snapshot", "list", "verify", "restore"):
+        p = sub.add_parser(command)
+        if command in ("verify", "restore"):
+            p.add_argument("snapshot")
+        if command != "verify":
+            p.add_argument("--db", default=database.DB_PATH)
+    args = parser.parse_args()
+    try:
+        if args.command == "snapshot":
+            print(snapshot(args.db).path)
+        elif args.command == "list":
+            print("\n".join(list_snapshots(_name(args.db))))
+        elif args.command == "verify":
+            print(f"OK {verify(args.snapshot)}")
+        else:
+            aside = restore(args.snapshot, args.db)
+            print(f"Restored {args.snapshot} to {args.db}; previous database moved to {aside}")
+    except BackupError as e:
+        sys.exit(f"❌ {e}")
@@ -1,12 +1,156 @@
-from datetime import date as dt_date
-from typing import Optional
+from datetime import date as dt_date, timedelta
+from typing import List, Optional, Tuple
 
-from database import USE_POSTGRES, get_db_connection
+import invalidation
+import queries
+import reminders
+from database import (
+    USE_POSTGRES,
+    add_column,
+    bump_table_version,
+    install_change_notifications,
+    raw_connection,
+    read_transaction,
+    run_query,
+    write_transaction,
+)
+
+# ---------------- Statements ----------------
+# request_key makes the insert idempotent: a booking already written under the
+# same key (e.g. committed just before the connection dropped, then replayed
+# from the spool) inserts nothing, and bookings.by_request_key finds it.
+queries.register(
+    "bookings.insert",
+    """
+    INSERT INTO bookings (user_id, name, equipment, date, duration, status, created_at, request_key)
+    VALUES (?, ?, ?, ?, ?, 'pending', CURRENT_TIMESTAMP, ?)
+    ON CONFLICT (request_key) DO NOTHING
+    RETURNING id;
+    """,
+    postgres="""
+    INSERT INTO bookings (user_id, name, equipment, date, duration, status, created_at, request_key)
+    VALUES (?, ?, ?, ?::date, ?, 'pending', NOW(), ?)
+    ON CONFLICT (request_key) DO NOTHING
+    RETURNING id;
+    """,
+)
+queries.register("bookings.by_request_key", "SELECT id FROM bookings WHERE request_key = ?;")
+queries.register(
+    "bookings.pending",
+    """
+    SELECT id, user_id, name, equipment, date, duration, status, created_at
+    FROM bookings
+    WHERE status = 'pending'
+    ORDER BY created_at ASC;
+    """,
+    postgres="""
+    SELECT id, user_id, name, equipment, date::text, duration, status, created_at::text
+    FROM bookings
+    WHERE status = 'pending'
+    ORDER BY created_at ASC;
+    """,
+)
+# Conditional transition: only a still-pending booking changes, in one round trip
+queries.register(
+    "bookings.transition",
+    "UPDATE bookings SET status=? WHERE id=? AND status='pending' RETURNING user_id, date, equipment;",
+    postgres="UPDATE bookings SET status=? WHERE id=? AND status='pending' RETURNING user_id, date::text, equipment;",
+)
+queries.register(
+    "bookings.approved_on",
+    """
+    SELECT id, user_id, name, equipment, duration, date
+    FROM bookings
+    WHERE date = ? AND status='approved'
+    ORDER BY created_at ASC;
+    """,
+    postgres="""
+    SELECT id, user_id, name, equipment, duration, date::text
+    FROM bookings
+    WHERE date = ?::date AND status='approved'
+    ORDER BY created_at ASC;
+    """,
+)
+queries.register(
+    "bookings.all_on",
+    """
+    SELECT id, user_id, name, equipment, duration, status, date
+    FROM bookings
+    WHERE date = ?
+    ORDER BY created_at ASC;
+    """,
+    postgres="""
+    SELECT id, user_id, name, equipment, duration, status, date::text
+    FROM bookings
+    WHERE date = ?::date
+    ORDER BY created_at ASC;
+    """,
+)
+
+# Date ranges are half-open [start, end) and served by bookings_date_idx
+queries.register(
+    "bookings.range",
+    """
+    SELECT id, user_id, name, equipment, date, duration, status
+    FROM bookings
+    WHERE date >= ? AND date < ?
+    ORDER BY date, created_at;
+    """,
+    postgres="""
+    SELECT id, user_id, name, equipment, date::text, duration, status
+    FROM bookings
+    WHERE date >= ?::date AND date < ?::date
+    ORDER BY date, created_at;
+    """,
+)
+queries.register(
+    "bookings.range_status",
+    """
+    SELECT id, user_id, name, equipment, date, duration, status
+    FROM bookings
+    WHERE date >= ? AND date < ? AND status = ?
+    ORDER BY date, created_at;
+    """,
+    postgres="""
+    SELECT id, user_id, name, equipment, date::text, duration, status
+    FROM bookings
+    WHERE date >= ?::date AND date < ?::date AND status = ?
+    ORDER BY date, created_at;
+    """,
+)
+
+# Past-date requests nobody acted on, oldest first, one batch per call. The
+# outer status check (and SKIP LOCKED on Postgres) means concurrent runs in
+# several workers never claim the same booking twice.
+queries.register(
+    "bookings.expire_past",
+    """
+    UPDATE bookings SET status='expired'
+    WHERE status='pending' AND id IN (
+        SELECT id FROM bookings
+        WHERE status='pending' AND date < ?
+        ORDER BY date, id
+        LIMIT ?
+    )
+    RETURNING id, user_id, equipment, date;
+    """,
+    postgres="""
+    UPDATE bookings SET status='expired'
+    WHERE status='pending' AND id IN (
+        SELECT id FROM bookings
+        WHERE status='pending' AND date < ?::date
+        ORDER BY date, id
+        LIMIT ?
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, user_id, equipment, date::text;
+    """,
+)
 
 
 def init_booking_db():
-    """Create bookings table if it doesn't exist."""
-    with get_db_connection() as conn:
+    """Create the bookings and reminders tables if they don't exist."""
+    with raw_connection() as conn:
         c = conn.cursor()
         if USE_POSTGRES:
             c.execute(
@@ -19,7 +163,8 @@ def init_booking_db():
                     date DATE NOT NULL,
                     duration TEXT NOT NULL,
                     status TEXT NOT NULL DEFAULT 'pending',
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    request_key TEXT
                 );
                 """
             )
@@ -34,206 +179,141 @@ def init_booking_db():
                     date TEXT NOT NULL,
                     duration TEXT NOT NULL,
                     status TEXT NOT NULL DEFAULT 'pending',
-                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    request_key TEXT
                 );
                 """
             )
+        add_column(c, "bookings", "request_key", "TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS bookings_date_idx ON bookings (date, status);")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS bookings_request_key_idx ON bookings (request_key);")
+        install_change_notifications(conn, "bookings", "id", date_column="date")
         conn.commit()
+    reminders.init_reminders_db()
 
 
-def add_booking(user_id: int, name: str, equipment: str, date: str, duration: str) -> int:
+def add_booking(
+    user_id: int, name: str, equipment: str, date: str, duration: str, request_key: Optional[str] = None
+) -> int:
     """
     date: 'YYYY-MM-DD' string
+    request_key: client-generated idempotency key; a second call with the same
+    key inserts nothing and returns the first call's booking id
     returns booking id
     """
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute(
-                """
-                INSERT INTO bookings (user_id, name, equipment, date, duration, status, created_at)
-                VALUES (%s, %s, %s, %s::date, %s, 'pending', NOW())
-                RETURNING id;
-                """,
-                (user_id, name, equipment, date, duration),
-            )
-            booking_id = c.fetchone()[0]
-        else:
-            c.execute(
-                """
-                INSERT INTO bookings (user_id, name, equipment, date, duration, status, created_at)
-                VALUES (?, ?, ?, ?, ?, 'pending', CURRENT_TIMESTAMP);
-                """,
-                (user_id, name, equipment, date, duration),
-            )
-            booking_id = c.lastrowid
-        conn.commit()
-        return int(booking_id)
+    params = (user_id, name, equipment, date, duration, request_key)
 
+    def work(conn) -> Tuple[int, bool]:
+        row = run_query(conn, "bookings.insert", params).fetchone()
+        if row is not None:
+            return int(row[0]), True
+        return int(run_query(conn, "bookings.by_request_key", (request_key,)).fetchone()[0]), False
 
-def get_pending_bookings():
+    booking_id, inserted = write_transaction(work, "add_booking")
+    if not inserted:
+        return booking_id
+    bump_table_version("bookings")
+    invalidation.publish_local(invalidation.Change("bookings", "INSERT", booking_id, user_id, date))
+    return booking_id
+
+
+def get_pending_bookings(replica: bool = True):
     """
     Returns list of tuples matching your previous ordering:
     (id, user_id, name, equipment, date, duration, status, created_at)
     """
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute(
-                """
-                SELECT id, user_id, name, equipment, date::text, duration, status, created_at::text
-                FROM bookings
-                WHERE status = 'pending'
-                ORDER BY created_at ASC;
-                """
-            )
-        else:
-            c.execute(
-                """
-                SELECT id, user_id, name, equipment, date, duration, status, created_at
-                FROM bookings
-                WHERE status = 'pending'
-                ORDER BY created_at ASC;
-                """
-            )
-        return c.fetchall()
+    return read_transaction(
+        lambda conn: run_query(conn, "bookings.pending").fetchall(), "get_pending_bookings", replica=replica
+    )
+
+
+def _set_pending_booking_status(booking_id: int, status: str) -> Optional[int]:
+    def work(conn):
+        rows = run_query(conn, "bookings.transition", (status, booking_id)).fetchall()
+        if rows and status == "approved":
+            user_id, day, equipment = rows[0]
+            reminders.schedule_booking(conn, booking_id, int(user_id), equipment, str(day))
+        return rows
+
+    rows = write_transaction(work, "_set_pending_booking_status")
+    if not rows:
+        return None
+    bump_table_version("bookings")
+    user_id, day = int(rows[0][0]), str(rows[0][1])
+    invalidation.publish_local(invalidation.Change("bookings", "UPDATE", booking_id, user_id, day))
+    return user_id
 
 
 def approve_booking_db(booking_id: int) -> Optional[int]:
     """
     Approves only if pending. Returns user_id if success, else None.
     """
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute(
-                "SELECT user_id, status FROM bookings WHERE id=%s FOR UPDATE;",
-                (booking_id,),
-            )
-        else:
-            c.execute(
-                "SELECT user_id, status FROM bookings WHERE id=?;",
-                (booking_id,),
-            )
-        row = c.fetchone()
-        if not row:
-            return None
-
-        user_id, status = row
-        if status != "pending":
-            return None
-
-        if USE_POSTGRES:
-            c.execute(
-                "UPDATE bookings SET status='approved' WHERE id=%s;",
-                (booking_id,),
-            )
-        else:
-            c.execute(
-                "UPDATE bookings SET status='approved' WHERE id=?;",
-                (booking_id,),
-            )
-        conn.commit()
-        return int(user_id)
+    return _set_pending_booking_status(booking_id, "approved")
 
 
 def reject_booking_db(booking_id: int) -> Optional[int]:
     """
     Rejects only if pending. Returns user_id if success, else None.
     """
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute(
-                "SELECT user_id, status FROM bookings WHERE id=%s FOR UPDATE;",
-                (booking_id,),
-            )
-        else:
-            c.execute(
-                "SELECT user_id, status FROM bookings WHERE id=?;",
-                (booking_id,),
-            )
-        row = c.fetchone()
-        if not row:
-            return None
+    return _set_pending_booking_status(booking_id, "rejected")
 
-        user_id, status = row
-        if status != "pending":
-            return None
 
-        if USE_POSTGRES:
-            c.execute(
-                "UPDATE bookings SET status='rejected' WHERE id=%s;",
-                (booking_id,),
-            )
-        else:
-            c.execute(
-                "UPDATE bookings SET status='rejected' WHERE id=?;",
-                (booking_id,),
-            )
-        conn.commit()
-        return int(user_id)
-
-
-def get_daily_bookings():
+def get_daily_bookings(replica: bool = True):
     """
     Your old function returned:
     SELECT id, user_id, name, equipment, duration, date
     for today and approved.
     """
     today = dt_date.today().isoformat()
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute(
-                """
-                SELECT id, user_id, name, equipment, duration, date::text
-                FROM bookings
-                WHERE date = %s::date AND status='approved'
-                ORDER BY created_at ASC;
-                """,
-                (today,),
-            )
-        else:
-            c.execute(
-                """
-                SELECT id, user_id, name, equipment, duration, date
-                FROM bookings
-                WHERE date = ? AND status='approved'
-                ORDER BY created_at ASC;
-                """,
-                (today,),
-            )
-        return c.fetchall()
+    return read_transaction(
+        lambda conn: run_query(conn, "bookings.approved_on", (today,)).fetchall(), "get_daily_bookings", replica=replica
+    )
 
 
-def get_all_daily_bookings():
+def get_all_daily_bookings(replica: bool = True):
     """
     Your old function returned:
     SELECT id, user_id, name, equipment, duration, status, date
     for today (all statuses)
     """
     today = dt_date.today().isoformat()
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute(
-                """
-                SELECT id, user_id, name, equipment, duration, status, date::text
-                FROM bookings
-                WHERE date = %s::date
-                ORDER BY created_at ASC;
-                """,
-                (today,),
-            )
-        else:
-            c.execute(
-                """
-                SELECT id, user_id, name, equipment, duration, status, date
-                FROM bookings
-                WHERE date = ?
-                ORDER BY created_at ASC;
-                """,
-                (today,),
-            )
-        return c.fetchall()
+    return read_transaction(
+        lambda conn: run_query(conn, "bookings.all_on", (today,)).fetchall(), "get_all_daily_bookings", replica=replica
+    )
+
+
+def get_bookings_between(start: str, end: str, status: Optional[str] = None, replica: bool = True) -> List[tuple]:
+    """
+    Bookings with start <= date < end ('YYYY-MM-DD'), optionally one status only,
+    as (id, user_id, name, equipment, date, duration, status) ordered by date.
+    Pass replica=False when the result is cached against change notifications.
+    """
+    if status is None:
+        name, params = "bookings.range", (start, end)
+    else:
+        name, params = "bookings.range_status", (start, end, status)
+    return read_transaction(
+        lambda conn: run_query(conn, name, params).fetchall(), "get_bookings_between", replica=replica
+    )
+
+
+def get_bookings_on(day: str, status: Optional[str] = None) -> List[tuple]:
+    """Same rows as get_bookings_between() for a single 'YYYY-MM-DD' day."""
+    end = (dt_date.fromisoformat(day) + timedelta(days=1)).isoformat()
+    return get_bookings_between(day, end, status)
+
+
+def expire_past_pending_bookings(before: str, limit: int) -> List[Tuple[int, int, str, str]]:
+    """
+    Mark up to `limit` pending bookings dated before `before` ('YYYY-MM-DD')
+    as 'expired'. Returns the (id, user_id, equipment, date) rows it claimed.
+    """
+    rows = write_transaction(
+        lambda conn: run_query(conn, "bookings.expire_past", (before, limit)).fetchall(), "expire_past_pending_bookings"
+    )
+    expired = [(int(r[0]), int(r[1]), r[2], str(r[3])) for r in rows]
+    if expired:
+        bump_table_version("bookings")
+    for booking_id, user_id, _, day in expired:
+        invalidation.publish_local(invalidation.Change("bookings", "UPDATE", booking_id, user_id, day))
+    return expired
@@ -0,0 +1,134 @@
+"""
+Weekly equipment calendar for /calendar.
+
+Each week is rendered from one range scan over bookings (Mon..Sun) and the
+text is cached per week. A week's entry is evicted only when a booking dated
+in that week changes (see invalidation.py), so repeated views and paging
+between weeks don't touch the database. Entries are keyed by tenant too.
+"""
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import invalidation
+import tenancy
+from booking import get_bookings_between
+
+DAY_NAMES = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+EQUIPMENT_WIDTH = 12
+CELL_WIDTH = 3
+# Weeks kept rendered; the cache is cleared when it fills up
+CACHE_WEEKS = 64
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def render_week(monday: date, rows: List[tuple]) -> str:
+    """
+    rows: (id, user_id, name, equipment, date, duration, status) from
+    get_bookings_between(). Cells show approved bookings per equipment and
+    day; a trailing "+" marks pending requests.
+    """
+    days = [monday + timedelta(days=i) for i in range(7)]
+    index = {d.isoformat(): i for i, d in enumerate(days)}
+    approved: Dict[str, List[int]] = {}
+    pending: Dict[str, List[int]] = {}
+    for _, _, _, equipment, day, _, status in rows:
+        i = index.get(str(day))
+        if i is None or status not in ("approved", "pending"):
+            continue
+        approved.setdefault(equipment, [0] * 7)
+        pending.setdefault(equipment, [0] * 7)
+        (approved if status == "approved" else pending)[equipment][i] += 1
+
+    sunday = days[-1]
+    header = f"📅 *Week of {monday:%d %b}* – {sunday:%d %b %Y}\n\n"
+    if not approved:
+        return header + "No approved or pending bookings this week."
+
+    lines = [" " * EQUIPMENT_WIDTH + "".join(name.rjust(CELL_WIDTH) for name in DAY_NAMES)]
+    lines.append(" " * EQUIPMENT_WIDTH + "".join(f"{d.day:>{CELL_WIDTH}}" for d in days))
+    for equipment in sorted(approved):
+        cells = []
+        for a, p in zip(approved[equipment], pending[equipment]):
+            cell = (str(a) if a else "·") + ("+" if p else "")
+            cells.append(cell.rjust(CELL_WIDTH))
+        lines.append(equipment[:EQUIPMENT_WIDTH - 1].ljust(EQUIPMENT_WIDTH) + "".join(cells))
+    grid = "\n".join(lines)
+    return header + f"```\n{grid}\n```\n_Approved bookings per day; + = pending requests._"
+
+
+# ---------------- Cache ----------------
+# (tenant id, monday) -> rendered week
+_cache: Dict[Tuple[str, date], str] = {}
+_version = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _evict(change: invalidation.Change):
+    global _version
+    with _lock:
+        _version += 1
+        if change.tenant is None:
+            _cache.clear()
+        elif change.op == invalidation.RESET or change.date is None:
+            for key in [k for k in _cache if k[0] == change.tenant]:
+                del _cache[key]
+        else:
+            _cache.pop((change.tenant, week_start(date.fromisoformat(change.date[:10]))), None)
+
+
+invalidation.subscribe("bookings", _evict)
+
+
+def week_calendar(monday: date) -> str:
+    """Rendered calendar for the week starting `monday` (cached while the change listener runs)."""
+    caching = invalidation.running()
+    key = (tenancy.current_id(), monday)
+    if caching:
+        cached = _cache.get(key)
+        if cached is not None:
+            _stats["hits"] += 1
+            return cached
+    _stats["misses"] += 1
+    version = _version
+    # From the primary: a lagging replica could re-cache a week that was just evicted
+    rows = get_bookings_between(monday.isoformat(), (monday + timedelta(days=7)).isoformat(), replica=False)
+    text = render_week(monday, rows)
+    if caching:
+        with _lock:
+            if version == _version:
+                if len(_cache) >= CACHE_WEEKS:
+                    _cache.clear()
+                _cache[key] = text
+    return text
+
+
+def parse_week(arg: Optional[str], today: date) -> Optional[date]:
+    """
+    Monday of the requested week: none -> this week, 'next'/'last', a signed
+    week offset ('+2', '-1') or any 'YYYY-MM-DD' inside the week.
+    """
+    this_week = week_start(today)
+    if not arg:
+        return this_week
+    arg = arg.strip().lower()
+    if arg == "next":
+        return this_week + timedelta(weeks=1)
+    if arg in ("last", "prev"):
+        return this_week - timedelta(weeks=1)
+    try:
+        return this_week + timedelta(weeks=int(arg))
+    except ValueError:
+        pass
+    try:
+        return week_start(date.fromisoformat(arg))
+    except ValueError:
+        return None
+
+
+def cache_stats() -> dict:
+    return {"weeks": len(_cache), **_stats}
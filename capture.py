@@ -0,0 +1,201 @@
+"""
+Opt-in capture of incoming updates, for replay.py.
+
+With CAPTURE_FILE set, every update is appended to that file as one JSON
+line before any handler runs:
+
+    {"ts": 1736500000.123, "tenant": "default", "status": "registered",
+     "roles": ["booking"], "update": {...}}
+
+ts is the wall-clock time the update reached the bot; status and roles are
+the sender's registration status and admin roles at that moment, so the
+replayer can recreate them in its scratch database.
+
+Updates are anonymized before they are written:
+- user and chat ids (and id-like numbers of 5+ digits in text, e.g. the
+  argument of /approve) are replaced by pseudonyms of the same length,
+  a keyed hash under CAPTURE_SALT, so the same person stays the same
+  pseudonym throughout a trace;
+- names, usernames, titles and phone numbers are replaced;
+- free text keeps its commands, numbers, punctuation and the tenant's
+  block and equipment names (the words that steer the conversations);
+  every other letter becomes "x", keeping the length;
+- media, contacts and locations are dropped.
+
+Without CAPTURE_SALT each process picks a random one, so pseudonyms only
+hold for one run; set it (the same for all cluster workers) to capture
+across restarts. Keep the salt secret: with it, pseudonyms of known ids
+can be recomputed.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+import admins
+import database
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "")  # e.g. traces/updates.jsonl; empty disables capture
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "") or secrets.token_hex(16)
+
+# Keys whose values are Telegram user/chat ids
+ID_KEYS = frozenset({"id", "user_id", "chat_id", "sender_chat_id", "migrate_to_chat_id", "migrate_from_chat_id"})
+# Replacements for personal fields (None drops the field)
+NAME_KEYS = {"first_name": "User", "last_name": None, "username": None, "title": "Chat", "phone_number": None}
+DROPPED_KEYS = frozenset({
+    "photo", "document", "video", "voice", "audio", "sticker", "animation", "video_note",
+    "contact", "location", "venue", "poll", "dice", "game", "new_chat_photo", "bio",
+})
+TEXT_KEYS = frozenset({"text", "caption", "query"})
+
+_ID_LIKE = re.compile(r"\b\d{5,}\b")
+_WORD = re.compile(r"[^\W\d_]+")
+
+_lock = threading.Lock()
+_file = None
+_stats = {"captured": 0, "failed": 0}
+
+
+# ---------------- Anonymization ----------------
+def pseudonym(value: Any) -> Any:
+    """Keyed hash of an id, keeping its type, sign and (for ints) digit count."""
+    digest = hmac.new(CAPTURE_SALT.encode(), str(value).encode(), hashlib.sha256).hexdigest()
+    if isinstance(value, int) and not isinstance(value, bool):
+        digits = len(str(abs(value)))
+        low = 10 ** (digits - 1) if digits > 1 else 1
+        mapped = low + int(digest, 16) % (10 ** digits - low)
+        return -mapped if value < 0 else mapped
+    return digest[: max(8, len(str(value)))]
+
+
+def mask_text(text: str, keep: FrozenSet[str]) -> str:
+    """Commands, numbers (id-like ones pseudonymized) and `keep` words survive; other letters become x."""
+    command, rest = "", text
+    if text.startswith("/"):
+        command, space, rest = text.partition(" ")
+        command += space
+    rest = _WORD.sub(lambda m: m.group(0) if m.group(0).lower() in keep else "x" * len(m.group(0)), rest)
+    rest = _ID_LIKE.sub(lambda m: str(pseudonym(int(m.group(0)))), rest)
+    return command + rest
+
+
+def anonymize(data: Any, keep: FrozenSet[str] = frozenset()) -> Any:
+    """A copy of an update's dict with ids, names, free text and media anonymized (see module docstring)."""
+    if isinstance(data, list):
+        return [anonymize(item, keep) for item in data]
+    if not isinstance(data, dict):
+        return data
+    out: Dict[str, Any] = {}
+    for key, value in data.items():
+        if key in DROPPED_KEYS:
+            continue
+        if key in NAME_KEYS:
+            if NAME_KEYS[key] is not None:
+                out[key] = NAME_KEYS[key]
+        elif key in ID_KEYS and isinstance(value, (int, str)) and not isinstance(value, bool):
+            out[key] = pseudonym(value)
+        elif key in TEXT_KEYS and isinstance(value, str):
+            out[key] = mask_text(value, keep)
+        else:
+            out[key] = anonymize(value, keep)
+    return out
+
+
+# () -> phrases whose words are kept in free text, set by install()
+_keep_phrases: Callable[[], Iterable[str]] = lambda: ()
+
+
+def _vocabulary() -> FrozenSet[str]:
+    words = set()
+    for phrase in _keep_phrases():
+        words.update(w.lower() for w in _WORD.findall(str(phrase)))
+    return frozenset(words)
+
+
+def update_kind(data: Dict[str, Any]) -> str:
+    """Handler-ish label of a raw update dict: the command, the callback prefix or "message"."""
+    callback = data.get("callback_query")
+    if callback is not None:
+        return "callback " + (callback.get("data") or "").split(":", 1)[0]
+    message = data.get("message") or data.get("edited_message")
+    if message is None:
+        return "update"
+    text = message.get("text") or ""
+    if text.startswith("/"):
+        return text.split()[0].split("@", 1)[0]
+    return "message"
+
+
+# ---------------- Recorder ----------------
+def _sender_state(user_id: Optional[int]) -> Dict[str, Any]:
+    if user_id is None:
+        return {"status": None, "roles": []}
+    try:
+        status = database.user_status(user_id)
+    except database.DatabaseUnavailable:
+        status = None
+    return {"status": status, "roles": sorted(admins.roles_of(user_id))}
+
+
+def _write(line: bytes):
+    global _file
+    with _lock:
+        if _file is None:
+            directory = os.path.dirname(CAPTURE_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Unbuffered append: each line is one write(), so cluster workers can share the file
+            _file = open(CAPTURE_FILE, "ab", buffering=0)
+        _file.write(line)
+
+
+async def record(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    received = time.time()
+    try:
+        user = update.effective_user
+        entry = {
+            "ts": round(received, 3),
+            "tenant": tenancy.current_id(),
+            **_sender_state(user.id if user is not None else None),
+            "update": anonymize(update.to_dict(), _vocabulary()),
+        }
+        _write((json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n").encode())
+        _stats["captured"] += 1
+    except Exception:
+        # Capture must never get in the way of the update itself
+        _stats["failed"] += 1
+        logger.exception("Capturing update %s failed", update.update_id)
+
+
+def install(app: Application, keep_phrases: Callable[[], Iterable[str]] = lambda: ()):
+    """
+    Record every update (before any other handler) when CAPTURE_FILE is set.
+    keep_phrases returns the bound tenant's words to keep in free text.
+    """
+    global _keep_phrases
+    if not CAPTURE_FILE:
+        return
+    _keep_phrases = keep_phrases
+    app.add_handler(TypeHandler(Update, record), group=-2)
+    logger.warning("Capturing anonymized updates to %s", CAPTURE_FILE)
+
+
+def enabled() -> bool:
+    return bool(CAPTURE_FILE)
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
@@ -0,0 +1,117 @@
+"""
+Circuit breaker for the data layer.
+
+database.py reports every connect and statement outcome here. After
+DB_BREAKER_FAILURES consecutive outage errors (connection refused or lost,
+connect/statement deadline exceeded, SQLite busy) the breaker opens and
+database calls fail at once with DatabaseUnavailable instead of each
+handler blocking on a dead server. After DB_BREAKER_COOLDOWN seconds one
+call at a time is let through as a probe (half-open): allow() hands it a
+token, and only success() with that token closes the breaker (a statement
+that was already in flight, or a connection that never asked allow(),
+proves nothing about recovery); failure re-opens it. A probe that reports
+neither within another cooldown is given up on and the next call probes
+instead. spool.py also probes on a timer, so the breaker closes again even
+when no traffic arrives.
+
+While it's open the bot runs degraded: static content still works,
+registration checks use the last known status, and new bookings and
+registrations are spooled locally (spool.py) and replayed once it closes.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+DB_BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", "15"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class DatabaseUnavailable(Exception):
+    """The database can't be used right now (breaker open, or the call just failed with an outage)."""
+
+
+class Breaker:
+    def __init__(self, failures: int = DB_BREAKER_FAILURES, cooldown: float = DB_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_at = 0.0
+        self._probe = 0  # token of the current (or last) probe
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    def allow(self) -> Optional[int]:
+        """
+        Raise DatabaseUnavailable unless a call may go to the database now.
+        Returns the probe token when this call is the half-open probe, else None.
+        """
+        if self.state == CLOSED:
+            return None
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and (not self._probing or now - self._probe_at >= self.cooldown):
+                # This caller is the probe (taking over from one that never reported back)
+                self._probing = True
+                self._probe_at = now
+                self._probe += 1
+                self._stats["probes"] += 1
+                return self._probe
+            self._stats["rejected"] += 1
+        raise DatabaseUnavailable("Database circuit breaker is open.")
+
+    def success(self, probe: Optional[int] = None):
+        """A call succeeded; probe is allow()'s token, needed to close a half-open breaker."""
+        if self.state == CLOSED and not self._consecutive:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                self._consecutive = 0
+            elif self.state == HALF_OPEN and self._probing and probe == self._probe:
+                self._consecutive = 0
+                self._probing = False
+                self.state = CLOSED
+                logger.warning("Database reachable again; circuit breaker closed")
+
+    def failure(self, error: BaseException):
+        with self._lock:
+            self._consecutive += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive >= self.failures):
+                if self.state == CLOSED:
+                    self._stats["opened"] += 1
+                    logger.error("Database unavailable (%s); circuit breaker open", error)
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release_probe(self, probe: Optional[int]):
+        """The probe ended without an outage verdict (e.g. a constraint error): let another try."""
+        if self._probing and probe is not None:
+            with self._lock:
+                if probe == self._probe:
+                    self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self._consecutive, **self._stats}
+
+
+db = Breaker()
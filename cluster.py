@@ -0,0 +1,194 @@
+"""
+Multi-process deployment: one polling ingress process, N handler workers.
+
+The ingress only long-polls getUpdates and forwards each update (as JSON)
+to worker `user_id % N`, so every update from a given user lands on the
+same worker in arrival order. That keeps per-user state that PTB holds in
+process memory (ConversationHandler state, context.user_data) consistent,
+while anything shared between users lives in the database.
+
+Inside a worker, updates from different users run concurrently (up to
+CONCURRENT_UPDATES at once) and updates from the same user run strictly one
+after another.
+
+Enable with WORKER_PROCESSES=N (main.py delegates here), or run
+`python cluster.py N` directly.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+from typing import Dict, List, Optional
+
+from telegram import Bot, Update
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = int(os.getenv("INGRESS_POLL_TIMEOUT", "30"))
+# Bounded hand-off so a stuck worker applies back-pressure instead of growing memory
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+
+_STOP = None
+
+
+def shard_key(update: Update) -> int:
+    """Per-user ordering key: the user, else the chat, else the update itself."""
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return update.update_id
+
+
+def shard_for(update: Update, workers: int) -> int:
+    return shard_key(update) % workers
+
+
+# ---------------- Worker ----------------
+class _Lanes:
+    """One FIFO lane per shard key; lanes run concurrently, bounded by a semaphore."""
+
+    def __init__(self, app, concurrency: int):
+        self._app = app
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+
+    def submit(self, update: Update):
+        key = shard_key(update)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue()
+            self._tasks[key] = asyncio.create_task(self._drain(key, queue))
+        queue.put_nowait(update)
+
+    async def _drain(self, key: int, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                update = queue.get_nowait()
+                async with self._slots:
+                    try:
+                        await self._app.process_update(update)
+                    except Exception:
+                        logger.exception("Worker failed processing update %s", update.update_id)
+        finally:
+            # Lane is idle: drop it so memory tracks active users only
+            self._queues.pop(key, None)
+            self._tasks.pop(key, None)
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+
+async def _worker_loop(index: int, inbox):
+    import main
+
+    main.invalidation.start()
+    app = main.build_application(with_updater=False)
+    lanes = _Lanes(app, main.CONCURRENT_UPDATES)
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.start()
+        logger.info("Worker %s ready", index)
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is _STOP:
+                break
+            lanes.submit(Update.de_json(data, app.bot))
+        await lanes.join()
+        await app.stop()
+
+
+def _worker_main(index: int, inbox):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s worker-{index} %(name)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(_worker_loop(index, inbox))
+    except KeyboardInterrupt:
+        pass
+
+
+# ---------------- Ingress ----------------
+class Ingress:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._inboxes: List = [self._ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._procs: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def _spawn(self, index: int):
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._inboxes[index]),
+            name=f"hall5-worker-{index}",
+            daemon=True,
+        )
+        proc.start()
+        self._procs[index] = proc
+
+    def _ensure_workers(self):
+        for i, proc in enumerate(self._procs):
+            if proc is None or not proc.is_alive():
+                if proc is not None:
+                    logger.warning("Worker %s exited (%s); restarting", i, proc.exitcode)
+                # Same index -> same shard, so users keep their worker
+                self._spawn(i)
+
+    async def _dispatch(self, update: Update):
+        inbox = self._inboxes[shard_for(update, self.workers)]
+        # Blocking put (bounded queue) runs off the loop
+        await asyncio.get_running_loop().run_in_executor(None, inbox.put, update.to_dict())
+
+    async def run(self, token: str):
+        import main
+
+        self._ensure_workers()
+        bot = Bot(token)
+        async with bot:
+            await bot.set_my_commands(main.BOT_COMMANDS)
+            offset = None
+            while True:
+                self._ensure_workers()
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset,
+                        timeout=POLL_TIMEOUT,
+                        allowed_updates=Update.ALL_TYPES,
+                    )
+                except Exception:
+                    logger.exception("getUpdates failed; retrying")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    await self._dispatch(update)
+                    # Acknowledge (advance the offset) only after the hand-off
+                    offset = update.update_id + 1
+
+    def stop(self):
+        for inbox in self._inboxes:
+            inbox.put(_STOP)
+        for proc in self._procs:
+            if proc is not None:
+                proc.join(timeout=10)
+
+
+def run(workers: int):
+    import main
+
+    main.init_db()
+    main.init_booking_db()
+    main.content.current()  # fail fast on a broken content file
+
+    ingress = Ingress(workers)
+    try:
+        asyncio.run(ingress.run(main.BOT_TOKEN))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingress.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s ingress %(name)s %(levelname)s %(message)s")
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 2)
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+CONTENT_PATH = os.getenv("CONTENT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "content.json"))
+# How often (seconds) a lookup may stat() the file to pick up edits
+CONTENT_RELOAD_INTERVAL = float(os.getenv("CONTENT_RELOAD_INTERVAL", "5"))
+
+
+# ---------------- Compiled content ----------------
+@dataclass(frozen=True)
+class Reply:
+    """A pre-rendered text message (optionally with an inline keyboard)."""
+    text: str
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    public: bool = False
+
+
+@dataclass(frozen=True)
+class CommitteeCard:
+    caption: str
+    photo_path: Optional[str]
+    photo_url: Optional[str]
+    public: bool = True
+
+
+@dataclass(frozen=True)
+class Route:
+    """Callback route: kind is "page" (edit message in place) or "committee" (send photo)."""
+    kind: str
+    payload: Any
+
+    @property
+    def public(self) -> bool:
+        return self.payload.public
+
+
+@dataclass(frozen=True)
+class Content:
+    commands: Mapping[str, Reply]
+    routes: Mapping[str, Route]
+    mtime: float
+
+
+def _keyboard(rows) -> Optional[InlineKeyboardMarkup]:
+    if not rows:
+        return None
+    return InlineKeyboardMarkup(
+        tuple(tuple(InlineKeyboardButton(b["text"], callback_data=b["callback"]) for b in row) for row in rows)
+    )
+
+
+def _reply(spec: Dict[str, Any]) -> Reply:
+    return Reply(
+        text=spec["text"],
+        parse_mode=spec.get("parse_mode"),
+        reply_markup=_keyboard(spec.get("keyboard")),
+        public=bool(spec.get("public", False)),
+    )
+
+
+def _canteen_page(canteen: Dict[str, Any]) -> Reply:
+    food_list = "\n".join(f"• {food}" for food in canteen["food"])
+    return Reply(
+        text=f"{canteen['name']}\n\n📋 *Food Options:*\n{food_list}",
+        parse_mode="Markdown",
+        public=bool(canteen.get("public", True)),
+    )
+
+
+def compile_content(data: Dict[str, Any], mtime: float = 0.0, base_dir: Optional[str] = None) -> Content:
+    """Turn the raw content file into immutable replies and an O(1) callback route table."""
+    base_dir = base_dir or os.path.dirname(os.path.abspath(CONTENT_PATH))
+    commands = {name: _reply(spec) for name, spec in data.get("commands", {}).items()}
+
+    routes: Dict[str, Route] = {}
+
+    def add(callback: str, route: Route):
+        if callback in routes:
+            raise ValueError(f"Duplicate callback {callback!r} in content file.")
+        routes[callback] = route
+
+    for callback, spec in data.get("pages", {}).items():
+        add(callback, Route("page", _reply(spec)))
+    for callback, canteen in data.get("canteens", {}).items():
+        add(callback, Route("page", _canteen_page(canteen)))
+    for callback, committee in data.get("committees", {}).items():
+        photo = committee.get("photo")
+        add(callback, Route("committee", CommitteeCard(
+            caption=committee["description"],
+            photo_path=os.path.join(base_dir, photo) if photo else None,
+            photo_url=committee.get("photo_url"),
+            public=bool(committee.get("public", True)),
+        )))
+
+    # Every keyboard button must lead somewhere
+    replies = list(commands.values()) + [r.payload for r in routes.values() if isinstance(r.payload, Reply)]
+    for reply in replies:
+        if reply.reply_markup is None:
+            continue
+        for row in reply.reply_markup.inline_keyboard:
+            for button in row:
+                if button.callback_data not in routes:
+                    raise ValueError(f"Button {button.text!r} points to unknown callback {button.callback_data!r}.")
+
+    return Content(commands=MappingProxyType(commands), routes=MappingProxyType(routes), mtime=mtime)
+
+
+def load_content(path: str = CONTENT_PATH) -> Content:
+    mtime = os.path.getmtime(path)
+    with open(path, encoding="utf-8") as f:
+        return compile_content(json.load(f), mtime=mtime, base_dir=os.path.dirname(os.path.abspath(path)))
+
+
+# ---------------- Hot reload ----------------
+class _Source:
+    """Hot-reload state of one content file (each tenant may have its own)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.current: Optional[Content] = None
+        self.last_check = 0.0
+        self.failed_mtime: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def get(self) -> Content:
+        now = time.monotonic()
+        if self.current is not None and now - self.last_check < CONTENT_RELOAD_INTERVAL:
+            return self.current
+        with self.lock:
+            if self.current is not None and now - self.last_check < CONTENT_RELOAD_INTERVAL:
+                return self.current
+            self.last_check = now
+            mtime = None
+            try:
+                mtime = os.path.getmtime(self.path)
+                if self.current is None or (mtime != self.current.mtime and mtime != self.failed_mtime):
+                    self.current = load_content(self.path)
+                    logger.info("Loaded content from %s", self.path)
+            except Exception:
+                if self.current is None:
+                    raise
+                self.failed_mtime = mtime
+                logger.exception("Content reload failed; keeping previous version")
+            return self.current
+
+
+_sources: Dict[str, _Source] = {}
+_sources_lock = threading.Lock()
+
+
+def current() -> Content:
+    """
+    The bound tenant's compiled content (CONTENT_PATH unless the tenant has
+    its own file), recompiled when the file's mtime changes (checked at most
+    every CONTENT_RELOAD_INTERVAL seconds). A broken edit is logged and the
+    previous content keeps being served.
+    """
+    tenant = tenancy.current()
+    path = tenant.content_path if tenant is not None and tenant.content_path else CONTENT_PATH
+    source = _sources.get(path)
+    if source is None:
+        with _sources_lock:
+            source = _sources.setdefault(path, _Source(path))
+    return source.get()
+
+
+def command(name: str) -> Reply:
+    return current().commands[name]
+
+
+def route(callback_data: Optional[str]) -> Optional[Route]:
+    if callback_data is None:
+        return None
+    return current().routes.get(callback_data)
+
+
+# Telegram file_ids of photos already uploaded, keyed by (tenant, path, mtime),
+# so each photo file is uploaded once per bot (file_ids are per bot) and
+# re-sent by id afterwards
+_photo_file_ids: Dict[tuple, str] = {}
+
+
+def _photo_key(path: str) -> tuple:
+    return (tenancy.current_id(), path, os.path.getmtime(path))
+
+
+def cached_photo_id(path: str) -> Optional[str]:
+    return _photo_file_ids.get(_photo_key(path))
+
+
+def remember_photo_id(path: str, file_id: str):
+    _photo_file_ids[_photo_key(path)] = file_id
@@ -1,7 +1,23 @@
+import atexit
+import csv
+import io
 import os
+import re
 import sqlite3
-from datetime import datetime
-from typing import Any, List, Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
+
+import circuit
+import queries
+import tenancy
+import tracing
+from circuit import DatabaseUnavailable
+from sqlite_writer import GroupCommitWriter
 
 try:
     import psycopg2
@@ -11,33 +27,1166 @@ except ImportError:
 # ---------------- Config ----------------
 DATABASE_URL = os.getenv("DATABASE_URL")  # set on Railway
 USE_POSTGRES = bool(DATABASE_URL)
+DIALECT = queries.POSTGRES if USE_POSTGRES else queries.SQLITE
 
 # IMPORTANT: keep DB_PATH ALWAYS as a string so imports don't break
 DB_PATH = os.getenv("DB_PATH", "/tmp/hall5.db")
 
+# Optional streaming replica for query-only functions (Postgres only)
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL") if USE_POSTGRES else None
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+
+# Server-side prepared statements (disable behind a transaction-pooling proxy like pgbouncer)
+PG_PREPARED_STATEMENTS = os.getenv("PG_PREPARED_STATEMENTS", "1") != "0"
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+# SQLITE_MODE=tuned -> WAL, tuned pragmas and a single group-commit writer thread
+SQLITE_MODE = os.getenv("SQLITE_MODE", "default").lower()
+SQLITE_TUNED = not USE_POSTGRES and SQLITE_MODE == "tuned"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "16384"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(64 * 1024 * 1024)))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "256"))
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+
+# Deadlines, so a slow or unreachable Postgres trips the circuit breaker (circuit.py)
+# instead of hanging handlers; SQLite lock waits are bounded by SQLITE_BUSY_TIMEOUT_MS
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_QUERY_TIMEOUT_MS = int(os.getenv("DB_QUERY_TIMEOUT_MS", "5000"))
+
+# Per-update unit of work (see "Unit of work" below). Opt-in on SQLite, and never with the
+# group-commit writer: SQLite has one write lock, and a unit holding it across an await stalls
+# every other update that writes from the event loop.
+UNIT_OF_WORK = os.getenv("UNIT_OF_WORK", "1" if USE_POSTGRES else "0") != "0" and not SQLITE_TUNED
+UNIT_POOL_SIZE = int(os.getenv("UNIT_POOL_SIZE", "8"))  # idle connections kept per database
+
+# Entries kept by the registration status cache (see user_status())
+USER_STATUS_CACHE_SIZE = int(os.getenv("USER_STATUS_CACHE_SIZE", "10000"))
+
+T = TypeVar("T")
+
+# One persistent connection per thread (per database file on SQLite), so
+# statements stay parsed/prepared between calls. On Postgres all tenants
+# share it, each switching search_path to its own schema.
+_local = threading.local()
+
+
+def db_path() -> str:
+    """SQLite file of the bound tenant (DB_PATH in single-bot mode)."""
+    tenant = tenancy.current()
+    return tenant.db_path if tenant is not None else DB_PATH
+
+
+def _connect():
+    if USE_POSTGRES:
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required when DATABASE_URL is set.")
+        # Railway hosted Postgres typically requires ssl
+        return psycopg2.connect(
+            DATABASE_URL,
+            sslmode="require",
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            options=f"-c statement_timeout={DB_QUERY_TIMEOUT_MS}",
+        )
+    conn = sqlite3.connect(
+        db_path(),
+        cached_statements=SQLITE_STATEMENT_CACHE,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+    )
+    _register_sqlite_functions(conn)
+    if SQLITE_TUNED:
+        _apply_sqlite_pragmas(conn, synchronous="NORMAL")
+    return conn
+
+
+def _digits(text: Any) -> Optional[str]:
+    return None if text is None else re.sub(r"\D", "", str(text))
+
+
+def _register_sqlite_functions(conn):
+    """SQL functions the schema relies on (the resident search triggers call digits())."""
+    conn.create_function("digits", 1, _digits, deterministic=True)
+
+
+def _apply_sqlite_pragmas(conn, synchronous: str):
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+
+
+def _connect_writer(path: str):
+    """
+    The group-commit writer's own connection: autocommit at the driver level
+    (the writer issues BEGIN/COMMIT itself), WAL, and synchronous=FULL so every
+    acknowledged batch has been fsync'd.
+    """
+    conn = sqlite3.connect(
+        path,
+        cached_statements=SQLITE_STATEMENT_CACHE,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    _register_sqlite_functions(conn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    _apply_sqlite_pragmas(conn, synchronous="FULL")
+    return conn
+
+
+def _is_closed(conn) -> bool:
+    if USE_POSTGRES:
+        return bool(conn.closed)
+    try:
+        conn.total_changes
+        return False
+    except sqlite3.ProgrammingError:
+        return True
+
 
 def get_db_connection():
     """
-    Returns a connection object:
+    Returns this thread's persistent connection object:
     - PostgreSQL if DATABASE_URL is set (Railway)
     - SQLite otherwise (local)
+    Use it as `with get_db_connection() as conn:` -> commits on success,
+    rolls back on error, and keeps the connection open for reuse.
     """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = "" if USE_POSTGRES else db_path()
+    conn = conns.get(key)
+    if conn is None or _is_closed(conn):
+        _allow()
+        try:
+            conn = _connect()
+        except Exception as e:
+            _db_failed(e)
+            raise
+        conns[key] = conn
+        _track_prepared(conn)
+    else:
+        _allow()
     if USE_POSTGRES:
-        if psycopg2 is None:
-            raise RuntimeError("psycopg2 is required when DATABASE_URL is set.")
-        # Railway hosted Postgres typically requires ssl
-        return psycopg2.connect(DATABASE_URL, sslmode="require")
-    return sqlite3.connect(DB_PATH)
+        _use_tenant_schema(conn)
+    return conn
+
+
+@contextmanager
+def raw_connection():
+    """
+    `with get_db_connection() as conn:` that also reports the outcome
+    (including the COMMIT) to the breaker, for work that may run SQL itself
+    rather than through run_query (schema setup): a half-open probe taken by
+    get_db_connection() is always settled.
+    """
+    conn = get_db_connection()
+    try:
+        with conn:
+            yield conn
+    except Exception as e:
+        _db_failed(e)
+        raise
+    _succeeded()
+
+
+def _track_prepared(conn):
+    """Start tracking PREPAREd statements for a new persistent conn (they're per session)."""
+    sets = getattr(_local, "prepared", None)
+    if sets is None:
+        sets = _local.prepared = {}
+    sets[id(conn)] = set()
+
+
+def _prepared_set(conn) -> Optional[set]:
+    # Pooled unit-of-work connections move between threads, so they're tracked globally
+    pooled = _unit_prepared.get(id(conn))
+    if pooled is not None:
+        return pooled
+    sets = getattr(_local, "prepared", None)
+    return sets.get(id(conn)) if sets else None
+
+
+def _use_tenant_schema(conn):
+    """
+    Point a shared Postgres connection at the bound tenant's schema (or back
+    to the default). Done between transactions and committed, so it sticks
+    for the session until another tenant needs the connection; Postgres
+    re-plans prepared statements when search_path changes.
+    """
+    tenant = tenancy.current()
+    schema = tenant.schema if tenant is not None else None
+    paths = getattr(_local, "search_paths", None)
+    if paths is None:
+        paths = _local.search_paths = {}
+    if paths.get(id(conn)) == schema:
+        return
+    with conn.cursor() as c:
+        # Only the tenant's schema: a missing table must fail, not fall through to public
+        c.execute(f"SET search_path TO {schema}" if schema else "SET search_path TO DEFAULT")
+    conn.commit()
+    paths[id(conn)] = schema
+
+
+def new_connection():
+    """
+    A dedicated connection outside the per-thread pool (for long-lived
+    listeners), for the bound tenant's SQLite file. Caller closes it. It
+    doesn't go through the circuit breaker, so run_query on it takes
+    breaker=False: a listener's reads succeeding say nothing about writes.
+    """
+    return _connect()
+
+
+# ---------------- Circuit breaker ----------------
+_SQLITE_OUTAGES = ("locked", "busy", "unable to open", "disk i/o")
+
+
+def _is_outage(error: BaseException) -> bool:
+    """Connection-level trouble (as opposed to a bad statement or a constraint violation)."""
+    if USE_POSTGRES:
+        # QueryCanceled (statement_timeout) is an OperationalError too
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    return isinstance(error, sqlite3.OperationalError) and any(s in str(error).lower() for s in _SQLITE_OUTAGES)
+
+
+def _allow():
+    """circuit.db.allow(), keeping the probe token (if this call is the probe) for this thread's report."""
+    _local.probe = circuit.db.allow()
+
+
+def _succeeded():
+    circuit.db.success(getattr(_local, "probe", None))
+
+
+def _db_failed(error: BaseException):
+    """Report a failed primary-database call to the breaker; outages are re-raised as DatabaseUnavailable."""
+    if isinstance(error, DatabaseUnavailable):
+        return
+    if _is_outage(error):
+        circuit.db.failure(error)
+        raise DatabaseUnavailable(str(error).strip()[:200]) from error
+    circuit.db.release_probe(getattr(_local, "probe", None))
+
+
+def run_query(conn, name: str, params: Tuple[Any, ...] = (), breaker: bool = True):
+    """
+    Execute a registered statement (see queries.py) on conn and return the cursor.
+    On Postgres the statement is PREPAREd once per session and then EXECUTEd;
+    on SQLite the rendered SQL hits the connection's statement cache.
+    Outages on the primary raise DatabaseUnavailable (see circuit.py).
+    breaker=False keeps the outcome from the breaker, for connections that
+    don't go through it (new_connection() listeners).
+    """
+    # The replica has its own fallback (read_transaction) and doesn't count
+    primary = breaker and conn is not getattr(_local, "replica_conn", None)
+    try:
+        if tracing.active():
+            with tracing.span("db " + name):
+                cur = _execute(conn, name, params)
+        else:
+            cur = _execute(conn, name, params)
+    except Exception as e:
+        if primary:
+            _db_failed(e)
+        raise
+    if primary:
+        _succeeded()
+    return cur
+
+
+def _execute(conn, name: str, params: Tuple[Any, ...]):
+    stmt = queries.get(name)
+    cur = conn.cursor()
+    params = tuple(params)
+    prepared = _prepared_set(conn) if USE_POSTGRES and PG_PREPARED_STATEMENTS else None
+    if prepared is not None:
+        if stmt.name not in prepared:
+            cur.execute(stmt.prepare_sql())
+            prepared.add(stmt.name)
+        cur.execute(stmt.execute_sql(), params or None)
+    else:
+        cur.execute(stmt.render(DIALECT), params)
+    queries.record_execution(name)
+    return cur
+
+
+# One group-commit writer per SQLite file (i.e. per tenant)
+_writers: Dict[str, GroupCommitWriter] = {}
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> Optional[GroupCommitWriter]:
+    if not SQLITE_TUNED:
+        return None
+    path = db_path()
+    with _writer_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = GroupCommitWriter(
+                lambda: _connect_writer(path),
+                max_batch=GROUP_COMMIT_MAX_BATCH,
+                window=GROUP_COMMIT_WINDOW_MS / 1000,
+            )
+            atexit.register(writer.stop)
+        return writer
+
+
+def write_transaction(work: Callable[[Any], T], name: str) -> T:
+    """
+    Run work(conn) as one write transaction and return its result.
+    In tuned SQLite mode the work is handed to the single writer thread and
+    grouped with concurrent writes into one durable commit; the call returns
+    once that commit is done. Otherwise it runs on this thread's connection.
+    name labels the trace span, by convention the calling DB function
+    (add_booking, approve_user, ...).
+    """
+    if tracing.active():
+        with tracing.span("db.write " + name):
+            return _write_transaction(work)
+    return _write_transaction(work)
+
+
+def _write_transaction(work: Callable[[Any], T]) -> T:
+    unit = current_unit()
+    if unit is not None:
+        return unit.run(work, write=True)
+    writer = _get_writer()
+    if writer is not None:
+        if writer.in_writer_thread():
+            raise RuntimeError("write_transaction() cannot be nested inside writer work.")
+        _allow()
+        try:
+            result = writer.submit(work).result()
+        except Exception as e:
+            # e.g. the batch's COMMIT failed after work's statements succeeded
+            _db_failed(e)
+            raise
+        _succeeded()
+        return result
+    if REPLICA_DATABASE_URL:
+        # A one-off unit: its COMMIT reports the WAL position in the same round trip
+        unit = UnitOfWork()
+        try:
+            result = unit.run(work, write=True)
+        except BaseException:
+            unit.rollback()
+            raise
+        unit.commit()
+        return result
+    # Reports a failed COMMIT too (e.g. the connection dropped at COMMIT)
+    with raw_connection() as conn:
+        return work(conn)
+
+
+# ---------------- Read replica ----------------
+# Query-only functions go through read_transaction(). It uses the replica
+# only while it is reachable, lags less than REPLICA_MAX_LAG_SECONDS and has
+# replayed past this process's last committed write (compared by WAL LSN),
+# so a user never reads around their own change. Anything else, including
+# a replica error mid-query, runs on the primary.
+# Health and lag come from a background thread that checks the replica
+# every REPLICA_CHECK_INTERVAL; reads only look at its last result, so an
+# unreachable replica never holds up a caller (or the event loop). Each
+# commit's LSN comes back with the COMMIT itself (UnitOfWork._end).
+_replica_lock = threading.Lock()
+_replica = {"healthy": False, "lag": None, "replay_lsn": 0, "checked_at": float("-inf"), "error": None}
+# A check can take the replica's connect_timeout (3s); older results mean the monitor is stuck
+_REPLICA_STALE_AFTER = 2 * REPLICA_CHECK_INTERVAL + 3
+_replica_monitor: Optional[threading.Thread] = None
+_last_write_lsn = 0
+_read_stats = {"replica": 0, "primary": 0, "fallbacks": 0}
+# Sent as one batch on an autocommit connection: commits and reports where the commit ended
+_COMMIT_RETURNING_LSN = "COMMIT; SELECT pg_current_wal_lsn()::text"
+
+
+def _lsn(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    hi, lo = text.split("/")
+    return (int(hi, 16) << 32) + int(lo, 16)
+
+
+def _note_commit_lsn(text: Optional[str]):
+    global _last_write_lsn
+    lsn = _lsn(text)
+    with _replica_lock:
+        _last_write_lsn = max(_last_write_lsn, lsn)
+
+
+def _replica_connection():
+    conn = getattr(_local, "replica_conn", None)
+    if conn is None or conn.closed:
+        conn = psycopg2.connect(REPLICA_DATABASE_URL, sslmode="require", connect_timeout=3)
+        conn.set_session(readonly=True)
+        _local.replica_conn = conn
+        _track_prepared(conn)
+    _use_tenant_schema(conn)
+    return conn
+
+
+def _mark_replica_down(error: Exception):
+    with _replica_lock:
+        _replica.update(healthy=False, error=str(error).strip()[:200], checked_at=time.monotonic())
+    conn = getattr(_local, "replica_conn", None)
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        _local.replica_conn = None
+
+
+def _refresh_replica_status():
+    try:
+        conn = _replica_connection()
+        with conn:
+            lsn, lag = run_query(conn, "replication.replica_status").fetchone()
+    except Exception as e:
+        _mark_replica_down(e)
+        return
+    with _replica_lock:
+        _replica.update(
+            healthy=True, lag=float(lag or 0), replay_lsn=_lsn(lsn), checked_at=time.monotonic(), error=None
+        )
+
+
+def _watch_replica():
+    while True:
+        _refresh_replica_status()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+def _start_replica_monitor():
+    global _replica_monitor
+    with _replica_lock:
+        if _replica_monitor is None:
+            _replica_monitor = threading.Thread(target=_watch_replica, name="replica-monitor", daemon=True)
+            _replica_monitor.start()
+
+
+def _usable_replica():
+    if _replica_monitor is None:
+        _start_replica_monitor()  # the replica stays unused until its first check
+    with _replica_lock:
+        usable = (
+            _replica["healthy"]
+            and time.monotonic() - _replica["checked_at"] < _REPLICA_STALE_AFTER
+            and _replica["lag"] <= REPLICA_MAX_LAG_SECONDS
+            and _replica["replay_lsn"] >= _last_write_lsn
+        )
+    if not usable:
+        return None
+    try:
+        return _replica_connection()
+    except Exception as e:
+        _mark_replica_down(e)
+        return None
+
+
+def read_transaction(work: Callable[[Any], T], name: str, replica: bool = True) -> T:
+    """
+    Run query-only work(conn) and return its result: on the read replica when
+    one is configured and usable (and replica is True), otherwise on the
+    primary, inside the update's unit of work if there is one. name labels
+    the trace span, as for write_transaction.
+    """
+    if tracing.active():
+        with tracing.span("db.read " + name):
+            return _read_transaction(work, replica)
+    return _read_transaction(work, replica)
+
+
+def _read_transaction(work: Callable[[Any], T], replica: bool) -> T:
+    unit = current_unit()
+    # Once the unit has written, its reads must see those writes
+    if unit is not None and (unit.in_transaction or not replica or not REPLICA_DATABASE_URL):
+        return unit.run(work, write=False)
+    if REPLICA_DATABASE_URL and replica:
+        conn = _usable_replica()
+        if conn is not None:
+            try:
+                with conn:
+                    result = work(conn)
+                _read_stats["replica"] += 1
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # Replica went away or cancelled us (recovery conflict): redo on the primary
+                _mark_replica_down(e)
+                _read_stats["fallbacks"] += 1
+        _read_stats["primary"] += 1
+    with raw_connection() as conn:
+        return work(conn)
+
+
+def replica_stats() -> Optional[dict]:
+    """Replica health and read routing counters (None without REPLICA_DATABASE_URL)."""
+    if not REPLICA_DATABASE_URL:
+        return None
+    with _replica_lock:
+        return {
+            "healthy": _replica["healthy"],
+            "lag": _replica["lag"],
+            "error": _replica["error"],
+            "behind_writes": _replica["replay_lsn"] < _last_write_lsn,
+            **_read_stats,
+        }
+
+
+def writer_stats() -> Optional[dict]:
+    """The bound tenant's group-commit batching stats (None unless SQLITE_MODE=tuned)."""
+    writer = _writers.get(db_path())
+    return writer.stats() if writer is not None else None
+
+
+# ---------------- Unit of work ----------------
+# Inside an update (bound by unitofwork.py) all write_transaction and
+# read_transaction calls share one connection from a small pool instead of
+# each running its own transaction on the per-thread connection. Reads run
+# as they come (autocommit). The first write opens a transaction that later
+# calls join, each in a savepoint so a call that fails undoes only itself,
+# and it is committed once: before the update's next Telegram call
+# (outbound.py flushes it, so nobody hears about a change that isn't
+# durable) or when the update ends. An error the update doesn't handle
+# rolls it back. The connection goes back to the pool at every commit.
+# Another update that needs a row this one has locked waits for that
+# commit, at most DB_QUERY_TIMEOUT_MS.
+_unit: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+# pool key (SQLite file, or Postgres schema) -> idle connections
+_unit_pool: Dict[str, List[Any]] = {}
+_unit_pool_lock = threading.Lock()
+# id(conn) -> PREPAREd statements, for pooled Postgres connections
+_unit_prepared: Dict[int, set] = {}
+_unit_stats = {"units": 0, "commits": 0, "rollbacks": 0, "connects": 0}
+
+
+def _unit_pool_key() -> str:
+    if USE_POSTGRES:
+        tenant = tenancy.current()
+        return tenant.schema if tenant is not None else ""
+    return db_path()
+
+
+def _connect_unit():
+    """A pooled connection: autocommit (UnitOfWork issues BEGIN itself), usable from any thread."""
+    _unit_stats["connects"] += 1
+    if not USE_POSTGRES:
+        conn = sqlite3.connect(
+            db_path(),
+            cached_statements=SQLITE_STATEMENT_CACHE,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        _register_sqlite_functions(conn)
+        return conn
+    conn = _connect()
+    conn.autocommit = True
+    tenant = tenancy.current()
+    if tenant is not None:
+        # Pools are per schema, so this sticks for the connection's life
+        with conn.cursor() as c:
+            c.execute(f"SET search_path TO {tenant.schema}")
+    _unit_prepared[id(conn)] = set()
+    return conn
+
+
+def _checkout(key: str):
+    _allow()
+    with _unit_pool_lock:
+        idle = _unit_pool.get(key)
+        while idle:
+            conn = idle.pop()
+            if not _is_closed(conn):
+                return conn
+            _unit_prepared.pop(id(conn), None)
+    try:
+        return _connect_unit()
+    except Exception as e:
+        _db_failed(e)
+        raise
+
+
+def _checkin(key: str, conn, broken: bool = False):
+    if not broken:
+        with _unit_pool_lock:
+            idle = _unit_pool.setdefault(key, [])
+            if len(idle) < UNIT_POOL_SIZE:
+                idle.append(conn)
+                return
+    _unit_prepared.pop(id(conn), None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class UnitOfWork:
+    """One update's database work: a lazily checked-out connection and at most one open transaction."""
+
+    def __init__(self):
+        self.key = _unit_pool_key()
+        self.conn = None
+        self.in_transaction = False
+        self.closed = False
+        self._savepoints = 0
+        self._after_commit: List[Callable[[], None]] = []
+        # Calls can come from the event loop and from asyncio.to_thread at once
+        self._lock = threading.RLock()
+
+    def _control(self, sql: str):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(sql)
+            return cur
+        except Exception as e:
+            _db_failed(e)
+            raise
+
+    def run(self, work: Callable[[Any], T], write: bool) -> T:
+        with self._lock:
+            savepoint = None
+            try:
+                if self.conn is None:
+                    self.conn = _checkout(self.key)
+                else:
+                    _allow()
+                if self.in_transaction:
+                    self._savepoints += 1
+                    savepoint = f"unit_{self._savepoints}"
+                    self._control(f"SAVEPOINT {savepoint}")
+                elif write:
+                    # IMMEDIATE: take SQLite's write lock now rather than fail to upgrade later
+                    self._control("BEGIN" if USE_POSTGRES else "BEGIN IMMEDIATE")
+                    self.in_transaction = True
+                result = work(self.conn)
+                if savepoint is not None:
+                    self._control(f"RELEASE SAVEPOINT {savepoint}")
+                return result
+            except Exception as e:
+                self._failed(e, savepoint)
+                raise
+
+    def _failed(self, error: Exception, savepoint: Optional[str]):
+        outage = isinstance(error, DatabaseUnavailable) or _is_outage(error)
+        if savepoint is not None and not outage:
+            try:
+                self._control(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                self._control(f"RELEASE SAVEPOINT {savepoint}")
+                return
+            except Exception:
+                pass
+        self._end(commit=False, broken=outage)
+
+    def after_commit(self, callback: Callable[[], None]):
+        """Run callback once the open transaction commits (now, if none is open)."""
+        with self._lock:
+            if self.in_transaction:
+                self._after_commit.append(callback)
+                return
+        callback()
+
+    def commit(self):
+        self._end(commit=True)
+
+    def rollback(self):
+        self._end(commit=False)
+
+    def _end(self, commit: bool, broken: bool = False):
+        with self._lock:
+            if self.conn is None:
+                return
+            callbacks, self._after_commit = self._after_commit, []
+            try:
+                if self.in_transaction and not broken:
+                    if commit:
+                        with tracing.span("db.commit"):
+                            if REPLICA_DATABASE_URL:
+                                _note_commit_lsn(self._control(_COMMIT_RETURNING_LSN).fetchone()[0])
+                            else:
+                                self._control("COMMIT")
+                        _unit_stats["commits"] += 1
+                    else:
+                        _unit_stats["rollbacks"] += 1
+                        self._control("ROLLBACK")
+            except Exception:
+                broken = True
+                raise
+            finally:
+                _checkin(self.key, self.conn, broken)
+                self.conn = None
+                self.in_transaction = False
+                self._savepoints = 0
+        if commit:
+            for callback in callbacks:
+                callback()
+
+
+def current_unit() -> Optional[UnitOfWork]:
+    unit = _unit.get()
+    return unit if unit is not None and not unit.closed else None
+
+
+@contextmanager
+def unit_of_work() -> Iterator[Optional[UnitOfWork]]:
+    """Bind a unit of work to the enclosed code: committed at the end, rolled back if it raises."""
+    if not UNIT_OF_WORK:
+        yield None
+        return
+    unit = UnitOfWork()
+    _unit_stats["units"] += 1
+    token = _unit.set(unit)
+    try:
+        try:
+            yield unit
+        except BaseException:
+            unit.rollback()
+            raise
+        unit.commit()
+    finally:
+        # Tasks the update spawned may outlive it; they fall back to plain transactions
+        unit.closed = True
+        _unit.reset(token)
+
+
+def unit_of_work_pending() -> bool:
+    """Whether the bound unit of work holds a connection (flush/rollback would touch the database)."""
+    unit = current_unit()
+    return unit is not None and unit.conn is not None
+
+
+def flush_unit_of_work():
+    """
+    Commit the bound unit of work's pending writes now (before anything
+    announces them). Blocks on the COMMIT: call it via asyncio.to_thread.
+    """
+    unit = current_unit()
+    if unit is not None:
+        unit.commit()
+
+
+def rollback_unit_of_work():
+    unit = current_unit()
+    if unit is not None:
+        unit.rollback()
+
+
+def unit_stats() -> Optional[dict]:
+    """Unit-of-work counters (None when it's off)."""
+    if not UNIT_OF_WORK:
+        return None
+    with _unit_pool_lock:
+        idle = sum(len(conns) for conns in _unit_pool.values())
+    return {**_unit_stats, "idle": idle}
+
+
+# ---------------- Table versions ----------------
+# Every write in this module and booking.py bumps the version of the tables
+# it changes (listings.py also bumps them for change events from other
+# processes), so a result cached under the versions of the tables it was
+# built from is current exactly as long as they're unchanged.
+# (tenant id, table) -> version; tenant RESET_ALL bumps every tenant's
+_table_versions: Dict[Tuple[str, str], int] = {}
+_table_versions_lock = threading.Lock()
+_table_version_seq = 0
+_table_versions_reset = 0
+RESET_ALL = "*"
+
+
+def bump_table_version(*tables: str, tenant: Optional[str] = None):
+    global _table_version_seq, _table_versions_reset
+    tenant_id = tenancy.current_id() if tenant is None else tenant
+    with _table_versions_lock:
+        _table_version_seq += 1
+        if tenant_id == RESET_ALL:
+            _table_versions_reset = _table_version_seq
+        else:
+            for table in tables:
+                _table_versions[(tenant_id, table)] = _table_version_seq
+    unit = current_unit()
+    if unit is not None and unit.in_transaction:
+        # Read before the commit, the old rows would be cached under the new version
+        unit.after_commit(lambda: bump_table_version(*tables, tenant=tenant_id))
+
+
+def table_version(table: str) -> int:
+    """Current version of `table` for the bound tenant."""
+    return max(_table_versions.get((tenancy.current_id(), table), 0), _table_versions_reset)
+
+
+def _utcnow():
+    """created_at value in the column's native format for the active dialect."""
+    now = datetime.utcnow()
+    return now if USE_POSTGRES else now.isoformat()
+
+
+# ---------------- Statements ----------------
+# On a promoted (no longer recovering) replica everything is replayed by definition
+queries.register(
+    "replication.replica_status",
+    """
+    SELECT
+        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text,
+        CASE
+            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """,
+)
+queries.register(
+    "pending_users.upsert",
+    """
+    INSERT INTO pending_users (user_id, name, block, room, created_at, row_version)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        name = EXCLUDED.name,
+        block = EXCLUDED.block,
+        room = EXCLUDED.room,
+        created_at = EXCLUDED.created_at,
+        row_version = EXCLUDED.row_version;
+    """,
+)
+queries.register(
+    "pending_users.list",
+    "SELECT user_id, name, block, room, created_at FROM pending_users ORDER BY created_at ASC",
+)
+queries.register("pending_users.delete", "DELETE FROM pending_users WHERE user_id=? RETURNING user_id")
+# Approval on Postgres: one statement moves the row and reports whether it existed
+queries.register(
+    "pending_users.promote",
+    """
+    WITH moved AS (
+        DELETE FROM pending_users WHERE user_id=?
+        RETURNING user_id, name, block, room, created_at
+    )
+    INSERT INTO registered_users (user_id, name, block, room, created_at, row_version)
+    SELECT user_id, name, block, room, created_at, ? FROM moved
+    ON CONFLICT (user_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        block = EXCLUDED.block,
+        room = EXCLUDED.room,
+        created_at = EXCLUDED.created_at,
+        row_version = EXCLUDED.row_version
+    RETURNING user_id;
+    """,
+)
+# Approval on SQLite (no data-modifying CTEs): DELETE ... RETURNING feeds the upsert
+queries.register(
+    "pending_users.take",
+    "DELETE FROM pending_users WHERE user_id=? RETURNING user_id, name, block, room, created_at",
+)
+# Registrations left pending too long, oldest first (pending_users_created_idx)
+queries.register(
+    "pending_users.expire",
+    """
+    DELETE FROM pending_users
+    WHERE created_at < ? AND user_id IN (
+        SELECT user_id FROM pending_users
+        WHERE created_at < ?
+        ORDER BY created_at, user_id
+        LIMIT ?
+    )
+    RETURNING user_id;
+    """,
+    postgres="""
+    DELETE FROM pending_users
+    WHERE created_at < ? AND user_id IN (
+        SELECT user_id FROM pending_users
+        WHERE created_at < ?
+        ORDER BY created_at, user_id
+        LIMIT ?
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING user_id;
+    """,
+)
+queries.register(
+    "registered_users.upsert",
+    """
+    INSERT INTO registered_users (user_id, name, block, room, created_at, row_version)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        block = EXCLUDED.block,
+        room = EXCLUDED.room,
+        created_at = EXCLUDED.created_at,
+        row_version = EXCLUDED.row_version;
+    """,
+)
+queries.register(
+    "registered_users.list",
+    "SELECT user_id, name, block, room, created_at FROM registered_users ORDER BY created_at ASC",
+)
+queries.register("registered_users.delete", "DELETE FROM registered_users WHERE user_id=? RETURNING user_id")
+# Registration status in one round trip (registered wins over a stale pending row)
+queries.register(
+    "users.status",
+    """
+    SELECT CASE
+        WHEN EXISTS (SELECT 1 FROM registered_users WHERE user_id = ?) THEN 'registered'
+        WHEN EXISTS (SELECT 1 FROM pending_users WHERE user_id = ?) THEN 'pending'
+        ELSE 'none'
+    END
+    """,
+)
+queries.register("health.ping", "SELECT 1")
+
+# ---------------- Change notifications ----------------
+# Every insert/update/delete on the watched tables is published so other
+# processes can evict cached copies (see invalidation.py):
+# - Postgres: a row trigger calls pg_notify(CHANGE_CHANNEL, json payload)
+# - SQLite: a row trigger appends to change_log, which listeners poll by seq
+CHANGE_CHANNEL = "hall5_changes"
+
+queries.register("change_log.head", "SELECT COALESCE(MAX(seq), 0) FROM change_log")
+queries.register(
+    "change_log.since",
+    """
+    SELECT seq, table_name, op, row_key, user_id, date
+    FROM change_log
+    WHERE seq > ?
+    ORDER BY seq
+    LIMIT ?
+    """,
+)
+queries.register("change_log.prune", "DELETE FROM change_log WHERE created_at < ?")
+
+# ---------------- Broadcast segments ----------------
+# Recipients are read in keyset pages (WHERE key > last ORDER BY key LIMIT n),
+# each page an index range scan, so a broadcast never holds a cursor open.
+queries.register("segment.all.count", "SELECT COUNT(*) FROM registered_users")
+queries.register(
+    "segment.all.page",
+    "SELECT user_id FROM registered_users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+)
+queries.register("segment.block.count", "SELECT COUNT(*) FROM registered_users WHERE block = ?")
+queries.register(
+    "segment.block.page",
+    "SELECT user_id FROM registered_users WHERE block = ? AND user_id > ? ORDER BY user_id LIMIT ?",
+)
+queries.register(
+    "segment.joined.count",
+    "SELECT COUNT(*) FROM registered_users WHERE created_at >= ? AND created_at < ?",
+)
+queries.register(
+    "segment.joined.page",
+    """
+    SELECT user_id, created_at FROM registered_users
+    WHERE created_at >= ? AND created_at < ? AND (created_at, user_id) > (?, ?)
+    ORDER BY created_at, user_id
+    LIMIT ?
+    """,
+)
+queries.register(
+    "segment.list.count",
+    """
+    SELECT COUNT(*) FROM broadcast_lists l
+    JOIN registered_users r ON r.user_id = l.user_id
+    WHERE l.name = ?
+    """,
+)
+queries.register(
+    "segment.list.page",
+    """
+    SELECT l.user_id FROM broadcast_lists l
+    JOIN registered_users r ON r.user_id = l.user_id
+    WHERE l.name = ? AND l.user_id > ?
+    ORDER BY l.user_id
+    LIMIT ?
+    """,
+)
+queries.register(
+    "broadcast_lists.add",
+    "INSERT INTO broadcast_lists (name, user_id) VALUES (?, ?) ON CONFLICT (name, user_id) DO NOTHING",
+)
+queries.register("broadcast_lists.remove", "DELETE FROM broadcast_lists WHERE name = ? AND user_id = ?")
+queries.register(
+    "broadcast_lists.summary",
+    "SELECT name, COUNT(*) FROM broadcast_lists GROUP BY name ORDER BY name",
+)
+
+
+# ---------------- Incremental exports ----------------
+# Every write to pending_users/registered_users stamps the rows it touches
+# with the next value of the row_versions counter, taken in the write's own
+# transaction. The UPDATE locks the counter row until commit, so versions
+# are handed out in commit order: a row committed after an export always
+# has a higher version than anything that export saw (created_at can't
+# promise that; approval keeps the time of the request).
+# Watermark = (row_version, user_id) of the last row an admin exported; the
+# next incremental export is an index range scan on (row_version, user_id).
+EXPORT_TABLES = ("registered_users", "pending_users")
+ROW_VERSION_COUNTER = "users"
+for _table in EXPORT_TABLES:
+    queries.register(
+        f"export.{_table}.since",
+        f"""
+        SELECT user_id, name, block, room, created_at, row_version
+        FROM {_table}
+        WHERE (row_version, user_id) > (?, ?)
+        ORDER BY row_version, user_id
+        """,
+    )
+    queries.register(f"export.{_table}.ids", f"SELECT user_id FROM {_table}")
+queries.register(
+    "row_versions.next",
+    "UPDATE row_versions SET value = value + 1 WHERE name = ? RETURNING value",
+)
+queries.register(
+    "row_versions.seed",
+    "INSERT INTO row_versions (name, value) VALUES (?, 0) ON CONFLICT (name) DO NOTHING",
+)
+queries.register(
+    "export_watermarks.get",
+    "SELECT last_version, last_id FROM export_watermarks WHERE admin_id = ? AND table_name = ?",
+)
+queries.register(
+    "export_watermarks.set",
+    """
+    INSERT INTO export_watermarks (admin_id, table_name, last_created_at, last_version, last_id, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (admin_id, table_name) DO UPDATE SET
+        last_created_at = EXCLUDED.last_created_at,
+        last_version = EXCLUDED.last_version,
+        last_id = EXCLUDED.last_id,
+        updated_at = EXCLUDED.updated_at;
+    """,
+)
+queries.register("export_watermarks.clear", "DELETE FROM export_watermarks WHERE admin_id = ? AND table_name = ?")
+
+
+# ---------------- Bulk roster import ----------------
+# Rows are staged in a temp table (COPY on Postgres, executemany on SQLite)
+# and moved into registered_users with one set-based upsert that only
+# touches rows whose details actually changed. created_at (the join date)
+# is only set on insert.
+queries.register("roster_stage.clear", "DELETE FROM roster_stage")
+queries.register("roster_stage.insert", "INSERT INTO roster_stage (user_id, name, block, room) VALUES (?, ?, ?, ?)")
+queries.register(
+    "roster_stage.existing",
+    "SELECT r.user_id FROM registered_users r JOIN roster_stage s ON s.user_id = r.user_id",
+)
+# "WHERE true" keeps SQLite from parsing ON CONFLICT as a join constraint
+queries.register(
+    "roster_stage.upsert",
+    """
+    INSERT INTO registered_users (user_id, name, block, room, created_at, row_version)
+    SELECT user_id, name, block, room, ?, ? FROM roster_stage WHERE true
+    ON CONFLICT (user_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        block = EXCLUDED.block,
+        room = EXCLUDED.room,
+        row_version = EXCLUDED.row_version
+    WHERE (registered_users.name, registered_users.block, registered_users.room)
+        IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.block, EXCLUDED.room)
+    RETURNING user_id;
+    """,
+    sqlite="""
+    INSERT INTO registered_users (user_id, name, block, room, created_at, row_version)
+    SELECT user_id, name, block, room, ?, ? FROM roster_stage WHERE true
+    ON CONFLICT (user_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        block = EXCLUDED.block,
+        room = EXCLUDED.room,
+        row_version = EXCLUDED.row_version
+    WHERE registered_users.name IS NOT EXCLUDED.name
+       OR registered_users.block IS NOT EXCLUDED.block
+       OR registered_users.room IS NOT EXCLUDED.room
+    RETURNING user_id;
+    """,
+)
+# Anyone imported is registered now; drop their pending request
+queries.register(
+    "roster_stage.clear_pending",
+    "DELETE FROM pending_users WHERE user_id IN (SELECT user_id FROM roster_stage)",
+)
+
+
+# ---------------- Resident search ----------------
+# Postgres: pg_trgm GIN indexes on lower(name) and the room's digits.
+# SQLite: an FTS5 trigram table (resident_search) kept in sync by triggers.
+# Both fall back to a LIKE scan if the index isn't available. The room key
+# is the room's digits on both, so "Rm 28_04_543" matches 2804543.
+_PG_ROOM_KEY = "regexp_replace(room, '[^0-9]', '', 'g')"
+_SQLITE_ROOM_KEY = "digits({room})"
+
+queries.register(
+    "residents.search_trgm",
+    f"""
+    SELECT user_id, name, block, room, created_at
+    FROM registered_users
+    WHERE lower(name) % ?
+       OR lower(name) LIKE ?
+       OR lower(block) = ?
+       OR {_PG_ROOM_KEY} LIKE ?
+    ORDER BY similarity(lower(name), ?) DESC, name ASC
+    LIMIT ? OFFSET ?;
+    """,
+)
+queries.register(
+    "residents.search_fts",
+    """
+    SELECT r.user_id, r.name, r.block, r.room, r.created_at
+    FROM resident_search s
+    JOIN registered_users r ON r.user_id = s.rowid
+    WHERE resident_search MATCH ?
+    ORDER BY s.rank, r.name
+    LIMIT ? OFFSET ?;
+    """,
+)
+queries.register(
+    "residents.search_like",
+    f"""
+    SELECT user_id, name, block, room, created_at
+    FROM registered_users
+    WHERE lower(name) LIKE ?
+       OR lower(block) = ?
+       OR {_SQLITE_ROOM_KEY.format(room="room")} LIKE ?
+    ORDER BY name ASC
+    LIMIT ? OFFSET ?;
+    """,
+    postgres=f"""
+    SELECT user_id, name, block, room, created_at
+    FROM registered_users
+    WHERE lower(name) LIKE ?
+       OR lower(block) = ?
+       OR {_PG_ROOM_KEY} LIKE ?
+    ORDER BY name ASC
+    LIMIT ? OFFSET ?;
+    """,
+)
+queries.register("residents.has_trgm", "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+queries.register(
+    "residents.has_fts",
+    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'resident_search'",
+)
+
+queries.register(
+    "aunty_reports.insert",
+    "INSERT INTO aunty_reports (reporter_id, reporter_name, location) VALUES (?, ?, ?) RETURNING id",
+)
+# Conditional transition, like bookings.transition: only one admin's decision takes effect
+queries.register(
+    "aunty_reports.resolve",
+    "UPDATE aunty_reports SET status=? WHERE id=? AND status='pending' RETURNING reporter_id, reporter_name, location",
+)
 
 
 def init_db():
     """
-    Create tables if they don't exist.
+    Create tables if they don't exist (for the bound tenant, if any).
     Use better types for Postgres (TIMESTAMPTZ).
     """
     if USE_POSTGRES:
-        with get_db_connection() as conn:
+        with raw_connection() as conn:
             with conn.cursor() as c:
+                tenant = tenancy.current()
+                if tenant is not None:
+                    c.execute(f"CREATE SCHEMA IF NOT EXISTS {tenant.schema};")
                 c.execute(
                     """
                     CREATE TABLE IF NOT EXISTS pending_users (
@@ -86,10 +1235,117 @@ def init_db():
                     ALTER COLUMN created_at SET DEFAULT NOW();
                     """
                 )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS registered_users_block_idx
+                    ON registered_users (block, user_id);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS registered_users_created_idx
+                    ON registered_users (created_at, user_id);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS pending_users_created_idx
+                    ON pending_users (created_at, user_id);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS export_watermarks (
+                        admin_id BIGINT NOT NULL,
+                        table_name TEXT NOT NULL,
+                        last_created_at TIMESTAMPTZ NOT NULL,
+                        last_id BIGINT NOT NULL,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        PRIMARY KEY (admin_id, table_name)
+                    );
+                    """
+                )
+                # Export row versions (see the Incremental exports statements)
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS row_versions (
+                        name TEXT PRIMARY KEY,
+                        value BIGINT NOT NULL
+                    );
+                    """
+                )
+                c.execute(queries.get("row_versions.seed").render(DIALECT), (ROW_VERSION_COUNTER,))
+                for table in EXPORT_TABLES:
+                    c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0;")
+                    c.execute(f"CREATE INDEX IF NOT EXISTS {table}_version_idx ON {table} (row_version, user_id);")
+                c.execute("ALTER TABLE export_watermarks ADD COLUMN IF NOT EXISTS last_version BIGINT;")
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS broadcast_lists (
+                        name TEXT NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        PRIMARY KEY (name, user_id)
+                    );
+                    """
+                )
+                # Managed by admins.py
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS admin_roles (
+                        user_id BIGINT NOT NULL,
+                        role TEXT NOT NULL,
+                        granted_by BIGINT,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        PRIMARY KEY (user_id, role)
+                    );
+                    """
+                )
+                c.execute(
+                    f"""
+                    CREATE OR REPLACE FUNCTION hall5_notify_change() RETURNS trigger AS $$
+                    DECLARE
+                        r jsonb;
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            r := to_jsonb(OLD);
+                        ELSE
+                            r := to_jsonb(NEW);
+                        END IF;
+                        PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                            'schema', TG_TABLE_SCHEMA,
+                            'table', TG_TABLE_NAME,
+                            'op', TG_OP,
+                            'key', r ->> TG_ARGV[0],
+                            'user_id', r ->> 'user_id',
+                            'date', r ->> 'date'
+                        )::text);
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                    """
+                )
+                install_change_notifications(conn, "pending_users", "user_id")
+                install_change_notifications(conn, "registered_users", "user_id")
+                install_change_notifications(conn, "admin_roles", "user_id")
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS aunty_reports (
+                        id SERIAL PRIMARY KEY,
+                        reporter_id BIGINT NOT NULL,
+                        reporter_name TEXT NOT NULL,
+                        location TEXT NOT NULL,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    );
+                    """
+                )
+                add_column(c, "aunty_reports", "status", "TEXT NOT NULL DEFAULT 'pending'")
             conn.commit()
     else:
-        with get_db_connection() as conn:
+        with raw_connection() as conn:
             c = conn.cursor()
+            if SQLITE_TUNED:
+                # persistent in the DB file; readers then never block the writer
+                c.execute("PRAGMA journal_mode=WAL")
             c.execute(
                 """
                 CREATE TABLE IF NOT EXISTS pending_users (
@@ -112,134 +1368,695 @@ def init_db():
                 );
                 """
             )
+            c.execute(
+                """
+                CREATE INDEX IF NOT EXISTS registered_users_block_idx
+                ON registered_users (block, user_id);
+                """
+            )
+            c.execute(
+                """
+                CREATE INDEX IF NOT EXISTS registered_users_created_idx
+                ON registered_users (created_at, user_id);
+                """
+            )
+            c.execute(
+                """
+                CREATE INDEX IF NOT EXISTS pending_users_created_idx
+                ON pending_users (created_at, user_id);
+                """
+            )
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS export_watermarks (
+                    admin_id INTEGER NOT NULL,
+                    table_name TEXT NOT NULL,
+                    last_created_at TEXT NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (admin_id, table_name)
+                );
+                """
+            )
+            # Export row versions (see the Incremental exports statements)
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS row_versions (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                """
+            )
+            c.execute(queries.get("row_versions.seed").render(DIALECT), (ROW_VERSION_COUNTER,))
+            for table in EXPORT_TABLES:
+                _sqlite_add_column(c, table, "row_version", "INTEGER NOT NULL DEFAULT 0")
+                c.execute(f"CREATE INDEX IF NOT EXISTS {table}_version_idx ON {table} (row_version, user_id);")
+            _sqlite_add_column(c, "export_watermarks", "last_version", "INTEGER")
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS broadcast_lists (
+                    name TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (name, user_id)
+                );
+                """
+            )
+            # Managed by admins.py
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS admin_roles (
+                    user_id INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    granted_by INTEGER,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, role)
+                );
+                """
+            )
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    row_key INTEGER,
+                    user_id INTEGER,
+                    date TEXT,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+                """
+            )
+            install_change_notifications(conn, "pending_users", "user_id")
+            install_change_notifications(conn, "registered_users", "user_id")
+            install_change_notifications(conn, "admin_roles", "user_id")
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS aunty_reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    reporter_id INTEGER NOT NULL,
+                    reporter_name TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+                """
+            )
+            add_column(c, "aunty_reports", "status", "TEXT NOT NULL DEFAULT 'pending'")
             conn.commit()
 
+    _init_search_index()
 
-def add_pending_user(user_id: int, name: str, block: str, room: str):
+
+def add_column(c, table: str, column: str, definition: str):
+    """Add a column to an existing table unless it's already there (for schema upgrades)."""
+    if USE_POSTGRES:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition};")
+    else:
+        _sqlite_add_column(c, table, column, definition)
+
+
+def _sqlite_add_column(c, table: str, column: str, definition: str):
+    """ALTER TABLE ... ADD COLUMN unless the column exists (SQLite has no IF NOT EXISTS for it)."""
+    if column not in {row[1] for row in c.execute(f"PRAGMA table_info({table})")}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+
+
+def install_change_notifications(conn, table: str, key_column: str, date_column: Optional[str] = None):
     """
-    Upserts user into pending_users.
+    (Re)create the change-publishing triggers on `table`. Requires init_db()
+    to have created hall5_notify_change() / change_log first.
     """
     if USE_POSTGRES:
-        created_at = datetime.utcnow()
-        with get_db_connection() as conn:
-            with conn.cursor() as c:
-                c.execute(
-                    """
-                    INSERT INTO pending_users (user_id, name, block, room, created_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (user_id)
-                    DO UPDATE SET
-                        name = EXCLUDED.name,
-                        block = EXCLUDED.block,
-                        room = EXCLUDED.room,
-                        created_at = EXCLUDED.created_at;
-                    """,
-                    (user_id, name, block, room, created_at),
-                )
-            conn.commit()
-    else:
-        created_at = datetime.utcnow().isoformat()
-        with get_db_connection() as conn:
-            c = conn.cursor()
+        with conn.cursor() as c:
+            c.execute(f"DROP TRIGGER IF EXISTS {table}_notify_change ON {table};")
             c.execute(
+                f"""
+                CREATE TRIGGER {table}_notify_change
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION hall5_notify_change('{key_column}');
                 """
-                INSERT OR REPLACE INTO pending_users (user_id, name, block, room, created_at)
-                VALUES (?, ?, ?, ?, ?);
-                """,
-                (user_id, name, block, room, created_at),
             )
-            conn.commit()
-
+        return
 
-def get_pending_users():
-    with get_db_connection() as conn:
-        c = conn.cursor()
+    c = conn.cursor()
+    for suffix, op, row in (("ai", "INSERT", "new"), ("au", "UPDATE", "new"), ("ad", "DELETE", "old")):
+        day = f"{row}.{date_column}" if date_column else "NULL"
         c.execute(
-            "SELECT user_id, name, block, room, created_at FROM pending_users ORDER BY created_at ASC"
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_change_{suffix}
+            AFTER {op} ON {table} BEGIN
+                INSERT INTO change_log (table_name, op, row_key, user_id, date)
+                VALUES ('{table}', '{op}', {row}.{key_column}, {row}.user_id, {day});
+            END;
+            """
         )
-        return c.fetchall()
 
 
-def approve_user(user_id: int) -> bool:
+def _init_search_index():
     """
-    Move user from pending_users -> registered_users.
+    Build the resident search index. Failure (no pg_trgm permission, SQLite
+    without FTS5 trigram support) is not fatal: search_residents() then
+    falls back to a LIKE scan.
     """
-    with get_db_connection() as conn:
-        c = conn.cursor()
+    if USE_POSTGRES:
+        try:
+            with raw_connection() as conn:
+                with conn.cursor() as c:
+                    c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+                    c.execute(
+                        "CREATE INDEX IF NOT EXISTS registered_users_name_trgm "
+                        "ON registered_users USING gin (lower(name) gin_trgm_ops);"
+                    )
+                    c.execute(
+                        "CREATE INDEX IF NOT EXISTS registered_users_room_trgm "
+                        f"ON registered_users USING gin (({_PG_ROOM_KEY}) gin_trgm_ops);"
+                    )
+        except Exception:
+            pass
+        return
 
-        if USE_POSTGRES:
+    room_key_new = _SQLITE_ROOM_KEY.format(room="new.room")
+    try:
+        with raw_connection() as conn:
+            c = conn.cursor()
             c.execute(
-                "SELECT user_id, name, block, room, created_at FROM pending_users WHERE user_id=%s",
-                (user_id,),
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS resident_search
+                USING fts5(name, block, room_key, tokenize='trigram');
+                """
             )
-        else:
+            # Recreated each time so triggers from an older room key get replaced
+            for trigger in ("ai", "au", "ad"):
+                c.execute(f"DROP TRIGGER IF EXISTS registered_users_search_{trigger};")
             c.execute(
-                "SELECT user_id, name, block, room, created_at FROM pending_users WHERE user_id=?",
-                (user_id,),
+                f"""
+                CREATE TRIGGER IF NOT EXISTS registered_users_search_ai
+                AFTER INSERT ON registered_users BEGIN
+                    INSERT INTO resident_search (rowid, name, block, room_key)
+                    VALUES (new.user_id, new.name, new.block, {room_key_new});
+                END;
+                """
             )
-
-        row = c.fetchone()
-        if not row:
-            return False
-
-        if USE_POSTGRES:
             c.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS registered_users_search_au
+                AFTER UPDATE ON registered_users BEGIN
+                    DELETE FROM resident_search WHERE rowid = old.user_id;
+                    INSERT INTO resident_search (rowid, name, block, room_key)
+                    VALUES (new.user_id, new.name, new.block, {room_key_new});
+                END;
                 """
-                INSERT INTO registered_users (user_id, name, block, room, created_at)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (user_id) DO NOTHING;
-                """,
-                row,
             )
-            c.execute("DELETE FROM pending_users WHERE user_id=%s", (user_id,))
-        else:
             c.execute(
                 """
-                INSERT OR REPLACE INTO registered_users (user_id, name, block, room, created_at)
-                VALUES (?, ?, ?, ?, ?);
-                """,
-                row,
+                CREATE TRIGGER IF NOT EXISTS registered_users_search_ad
+                AFTER DELETE ON registered_users BEGIN
+                    DELETE FROM resident_search WHERE rowid = old.user_id;
+                END;
+                """
             )
-            c.execute("DELETE FROM pending_users WHERE user_id=?", (user_id,))
+            # Backfill rows that existed before the index did
+            c.execute(
+                f"""
+                INSERT INTO resident_search (rowid, name, block, room_key)
+                SELECT user_id, name, block, {_SQLITE_ROOM_KEY.format(room="room")}
+                FROM registered_users
+                WHERE user_id NOT IN (SELECT rowid FROM resident_search);
+                """
+            )
+            # and rows indexed under an older room key
+            c.execute(
+                f"""
+                UPDATE resident_search
+                SET room_key = (
+                    SELECT {_SQLITE_ROOM_KEY.format(room="room")}
+                    FROM registered_users WHERE user_id = resident_search.rowid
+                )
+                WHERE rowid IN (
+                    SELECT r.user_id FROM registered_users r JOIN resident_search s ON s.rowid = r.user_id
+                    WHERE s.room_key IS NOT {_SQLITE_ROOM_KEY.format(room="r.room")}
+                );
+                """
+            )
+    except sqlite3.OperationalError:
+        pass
 
-        conn.commit()
-        return True
 
+def add_pending_user(user_id: int, name: str, block: str, room: str):
+    """
+    Upserts user into pending_users.
+    """
+    def work(conn):
+        run_query(conn, "pending_users.upsert", (user_id, name, block, room, _utcnow(), _next_row_version(conn)))
 
-def reject_user(user_id: int):
-    with get_db_connection() as conn:
-        c = conn.cursor()
+    write_transaction(work, "add_pending_user")
+    bump_table_version("pending_users")
+    invalidate_user_status(user_id)
+
+
+def get_pending_users(replica: bool = True):
+    return read_transaction(
+        lambda conn: run_query(conn, "pending_users.list").fetchall(), "get_pending_users", replica=replica
+    )
+
+
+def is_pending(user_id: int) -> bool:
+    return user_status(user_id) == "pending"
+
+
+def approve_user(user_id: int) -> bool:
+    """
+    Move user from pending_users -> registered_users.
+    The pending row is claimed by a single DELETE ... RETURNING, so two admins
+    approving at once can't both succeed.
+    """
+    def work(conn) -> bool:
+        version = _next_row_version(conn)
         if USE_POSTGRES:
-            c.execute("DELETE FROM pending_users WHERE user_id=%s", (user_id,))
-        else:
-            c.execute("DELETE FROM pending_users WHERE user_id=?", (user_id,))
-        conn.commit()
+            return bool(run_query(conn, "pending_users.promote", (user_id, version)).fetchall())
+        rows = run_query(conn, "pending_users.take", (user_id,)).fetchall()
+        if not rows:
+            return False
+        run_query(conn, "registered_users.upsert", (*rows[0], version))
+        return True
+
+    approved = write_transaction(work, "approve_user")
+    bump_table_version("pending_users", "registered_users")
+    invalidate_user_status(user_id)
+    return approved
+
+
+def reject_user(user_id: int) -> bool:
+    """Returns False if the user wasn't pending."""
+    rejected = write_transaction(
+        lambda conn: bool(run_query(conn, "pending_users.delete", (user_id,)).fetchall()), "reject_user"
+    )
+    bump_table_version("pending_users")
+    invalidate_user_status(user_id)
+    return rejected
+
+
+def expire_pending_users(older_than: timedelta, limit: int) -> List[int]:
+    """Drop up to `limit` registrations pending for longer than `older_than`; returns their user_ids."""
+    cutoff = datetime.utcnow() - older_than
+    if not USE_POSTGRES:
+        cutoff = cutoff.isoformat()
+    params = (cutoff, cutoff, limit)
+    rows = write_transaction(
+        lambda conn: run_query(conn, "pending_users.expire", params).fetchall(), "expire_pending_users"
+    )
+    expired = [int(r[0]) for r in rows]
+    if expired:
+        bump_table_version("pending_users")
+    for user_id in expired:
+        invalidate_user_status(user_id)
+    return expired
 
 
 def is_registered(user_id: int) -> bool:
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        if USE_POSTGRES:
-            c.execute("SELECT 1 FROM registered_users WHERE user_id=%s LIMIT 1", (user_id,))
+    return user_status(user_id) == "registered"
+
+
+def remove_user(user_id: int) -> bool:
+    """Returns False if the user wasn't registered."""
+    removed = write_transaction(
+        lambda conn: bool(run_query(conn, "registered_users.delete", (user_id,)).fetchall()), "remove_user"
+    )
+    bump_table_version("registered_users")
+    invalidate_user_status(user_id)
+    return removed
+
+
+# ---------------- Registration status cache ----------------
+# Checked on every restricted update, so it's worth caching, but only while
+# the change listener (invalidation.py) runs: it's what evicts entries when
+# another process or a manual SQL fix changes the user tables.
+# tenant id -> user_id -> status
+_status_cache: Dict[str, Dict[int, str]] = {}
+_status_version = 0
+_status_lock = threading.Lock()
+_status_cache_enabled = False
+
+
+def enable_user_status_cache(enabled: bool = True):
+    global _status_cache_enabled, _status_version
+    _status_cache_enabled = enabled
+    with _status_lock:
+        _status_version += 1
+        _status_cache.clear()
+
+
+def invalidate_user_status(user_id: Optional[int] = None, tenant: Optional[str] = None):
+    """
+    Evict one user's cached status, or all of them when user_id is None, for
+    `tenant` (default: the bound one). tenant="*" clears every tenant.
+    """
+    global _status_version
+    key = tenancy.current_id() if tenant is None else tenant
+    with _status_lock:
+        _status_version += 1
+        if key == "*":
+            _status_cache.clear()
+        elif user_id is None:
+            _status_cache.pop(key, None)
         else:
-            c.execute("SELECT 1 FROM registered_users WHERE user_id=? LIMIT 1", (user_id,))
-        return c.fetchone() is not None
+            _status_cache.get(key, {}).pop(user_id, None)
+    unit = current_unit()
+    if unit is not None and unit.in_transaction:
+        # Others still read (and may cache) the old row until the unit commits
+        unit.after_commit(lambda: invalidate_user_status(user_id, key))
+
+
+# tenant id -> user_id -> status as last read; never evicted, only used
+# while the database is unavailable
+_last_status: Dict[str, Dict[int, str]] = {}
+
+
+def user_status(user_id: int) -> str:
+    """
+    'registered', 'pending' or 'none'. Always read from the primary: the
+    result is cached and a replica could still be behind the change that
+    just evicted it. While the database is unavailable, the last status
+    read for the user (DatabaseUnavailable if there is none).
+    """
+    key = tenancy.current_id()
+    if _status_cache_enabled:
+        cached = _status_cache.get(key, {}).get(user_id)
+        if cached is not None:
+            return cached
+    version = _status_version
+    try:
+        status = read_transaction(
+            lambda conn: run_query(conn, "users.status", (user_id, user_id)).fetchone()[0], "user_status", replica=False
+        )
+    except DatabaseUnavailable:
+        # Degraded mode: answer from the last status we saw, if any
+        last = _last_status.get(key, {}).get(user_id)
+        if last is None:
+            raise
+        return last
+    last_known = _last_status.setdefault(key, {})
+    if len(last_known) >= USER_STATUS_CACHE_SIZE:
+        last_known.clear()
+    last_known[user_id] = status
+    if _status_cache_enabled:
+        with _status_lock:
+            # Skip the store if an invalidation raced with the read
+            if version == _status_version:
+                cache = _status_cache.setdefault(key, {})
+                if len(cache) >= USER_STATUS_CACHE_SIZE:
+                    cache.clear()
+                cache[user_id] = status
+    return status
 
 
-def remove_user(user_id: int):
+def ping():
+    """One trivial query; raises DatabaseUnavailable on an outage (used as the breaker's recovery probe)."""
     with get_db_connection() as conn:
-        c = conn.cursor()
+        run_query(conn, "health.ping").fetchone()
+
+
+def get_registered_users():
+    return read_transaction(lambda conn: run_query(conn, "registered_users.list").fetchall(), "get_registered_users")
+
+
+def add_aunty_report(reporter_id: int, reporter_name: str, location: str) -> int:
+    """
+    Stores a Hall Aunty sighting awaiting admin action; returns report id.
+    Kept in the DB (not process memory) so any worker can act on it.
+    """
+    params = (reporter_id, reporter_name, location)
+    row = write_transaction(lambda conn: run_query(conn, "aunty_reports.insert", params).fetchone(), "add_aunty_report")
+    return int(row[0])
+
+
+def resolve_aunty_report(report_id: int, status: str) -> Optional[Tuple[int, str, str]]:
+    """
+    Mark a pending report 'broadcast' or 'rejected'. Returns (reporter_id,
+    reporter_name, location), or None if it doesn't exist or was already handled.
+    """
+    row = write_transaction(
+        lambda conn: run_query(conn, "aunty_reports.resolve", (status, report_id)).fetchone(), "resolve_aunty_report"
+    )
+    return (int(row[0]), row[1], row[2]) if row else None
+
+
+def normalize_room(room: str) -> str:
+    """
+    Canonical room format. Hall V rooms are block-floor-room ("28-04-543"),
+    so any 7-digit input ("28 04 543", "#28-04-543", "2804543") maps to that;
+    anything else is just trimmed and upper-cased.
+    """
+    digits = re.sub(r"\D", "", room)
+    if len(digits) == 7:
+        return f"{digits[:2]}-{digits[2:4]}-{digits[4:]}"
+    return re.sub(r"\s+", " ", room.strip()).upper()
+
+
+# tenant id -> search backend its database supports
+_search_backends: Dict[str, str] = {}
+
+
+def _resident_search_backend(conn) -> str:
+    tenant_id = tenancy.current_id()
+    backend = _search_backends.get(tenant_id)
+    if backend is None:
         if USE_POSTGRES:
-            c.execute("DELETE FROM registered_users WHERE user_id=%s", (user_id,))
+            has_index = run_query(conn, "residents.has_trgm").fetchone() is not None
+            backend = "trgm" if has_index else "like"
         else:
-            c.execute("DELETE FROM registered_users WHERE user_id=?", (user_id,))
-        conn.commit()
+            has_index = run_query(conn, "residents.has_fts").fetchone() is not None
+            backend = "fts" if has_index else "like"
+        _search_backends[tenant_id] = backend
+    return backend
 
 
-def get_registered_users():
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute(
-            "SELECT user_id, name, block, room, created_at FROM registered_users ORDER BY created_at ASC"
-        )
-        return c.fetchall()
+def _fts_match(text: str) -> Optional[str]:
+    """FTS5 query: every word (3+ chars) and room fragment (3+ digits) must match."""
+    terms = []
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        if len(word) >= 3 and not word.isdigit():
+            terms.append('"' + word + '"')
+    for fragment in re.findall(r"\d[\d\-#/. ]*\d|\d", text):
+        digits = re.sub(r"\D", "", fragment)
+        if len(digits) >= 3:
+            terms.append(f'room_key : "{digits}"')
+    return " AND ".join(terms) or None
+
+
+def search_residents(text: str, limit: int = 10, offset: int = 0) -> Tuple[List[tuple], bool]:
+    """
+    Ranked resident lookup by name, block or room number.
+    Returns (rows, has_more); rows are (user_id, name, block, room, created_at).
+    """
+    text = text.strip()
+    q = text.lower()
+    digits = re.sub(r"\D", "", text)
+    like = "%" + q.replace("\\", "").replace("%", "").replace("_", "") + "%"
+    room_like = f"%{digits}%" if len(digits) >= 3 else None
+
+    def work(conn):
+        backend = _resident_search_backend(conn)
+        match = _fts_match(text) if backend == "fts" else None
+        if backend == "trgm":
+            return run_query(conn, "residents.search_trgm", (q, like, q, room_like, q, limit + 1, offset)).fetchall()
+        if match:
+            return run_query(conn, "residents.search_fts", (match, limit + 1, offset)).fetchall()
+        return run_query(conn, "residents.search_like", (like, q, room_like, limit + 1, offset)).fetchall()
+
+    rows = read_transaction(work, "search_residents")
+    return rows[:limit], len(rows) > limit
+
+
+# ---------------- Broadcast segments ----------------
+@dataclass(frozen=True)
+class Segment:
+    """
+    Broadcast audience: kind is "all", "block" (value=block name),
+    "joined" (value=(start, end) dates, end exclusive) or "list" (value=list name).
+    """
+    kind: str
+    value: Any = None
+
+    @property
+    def label(self) -> str:
+        if self.kind == "block":
+            return f"{self.value} Block"
+        if self.kind == "joined":
+            last_day = date.fromisoformat(self.value[1]) - timedelta(days=1)
+            return f"residents who joined {self.value[0]} to {last_day.isoformat()}"
+        if self.kind == "list":
+            return f"list '{self.value}'"
+        return "all users"
+
+
+def _segment_params(segment: Segment) -> Tuple[Any, ...]:
+    if segment.kind == "all":
+        return ()
+    if segment.kind == "joined":
+        return tuple(segment.value)
+    return (segment.value,)
+
+
+def count_segment(segment: Segment) -> int:
+    name, params = f"segment.{segment.kind}.count", _segment_params(segment)
+    return int(read_transaction(lambda conn: run_query(conn, name, params).fetchone()[0], "count_segment"))
+
+
+def iter_segment_user_ids(segment: Segment, batch_size: int = 500) -> Iterator[List[int]]:
+    """Yields recipient user_ids in batches, one indexed keyset query per batch."""
+    params = _segment_params(segment)
+    name = f"segment.{segment.kind}.page"
+    last_id, last_created = 0, ""
+    if segment.kind == "joined":
+        last_created = segment.value[0]
+    while True:
+        if segment.kind == "joined":
+            page_params = params + (last_created, last_id, batch_size)
+        else:
+            page_params = params + (last_id, batch_size)
+        rows = read_transaction(lambda conn: run_query(conn, name, page_params).fetchall(), "iter_segment_user_ids")
+        if not rows:
+            return
+        yield [int(r[0]) for r in rows]
+        last_id = rows[-1][0]
+        if segment.kind == "joined":
+            last_created = rows[-1][1]
+        if len(rows) < batch_size:
+            return
+
+
+def add_to_broadcast_list(name: str, user_ids: List[int]):
+    def work(conn):
+        for uid in user_ids:
+            run_query(conn, "broadcast_lists.add", (name, uid))
+
+    write_transaction(work, "add_to_broadcast_list")
+
+
+def remove_from_broadcast_list(name: str, user_ids: List[int]):
+    def work(conn):
+        for uid in user_ids:
+            run_query(conn, "broadcast_lists.remove", (name, uid))
+
+    write_transaction(work, "remove_from_broadcast_list")
+
+
+def get_broadcast_lists() -> List[Tuple[str, int]]:
+    return read_transaction(lambda conn: run_query(conn, "broadcast_lists.summary").fetchall(), "get_broadcast_lists")
+
+
+# ---------------- Incremental exports ----------------
+# Lower bound for a first export (rows written before row versions existed have 0)
+_EXPORT_START = (-1, 0)
+
+
+def _next_row_version(conn) -> int:
+    """Next export row version; call inside the write's transaction (see the Statements section)."""
+    return int(run_query(conn, "row_versions.next", (ROW_VERSION_COUNTER,)).fetchone()[0])
+
+
+def get_export_watermark(admin_id: int, table: str) -> Optional[Tuple[int, int]]:
+    """(row_version, user_id) of the last exported row; None before the first export."""
+    row = read_transaction(
+        lambda conn: run_query(conn, "export_watermarks.get", (admin_id, table)).fetchone(),
+        "get_export_watermark", replica=False
+    )
+    # A watermark saved before row versions (last_version NULL) can't be compared: start over
+    if row is None or row[0] is None:
+        return None
+    return int(row[0]), int(row[1])
+
+
+def set_export_watermark(admin_id: int, table: str, watermark: Tuple[int, int]):
+    params = (admin_id, table, watermark[0], watermark[1])
+    write_transaction(lambda conn: run_query(conn, "export_watermarks.set", params), "set_export_watermark")
+
+
+def clear_export_watermark(admin_id: int, table: str):
+    write_transaction(
+        lambda conn: run_query(conn, "export_watermarks.clear", (admin_id, table)), "clear_export_watermark"
+    )
+
+
+def get_rows_since(table: str, watermark: Optional[Tuple[int, int]]) -> Tuple[List[tuple], Optional[Tuple[int, int]]]:
+    """
+    (user_id, name, block, room, created_at) rows of pending_users or
+    registered_users written (added, approved or re-upserted) after the
+    watermark, in commit order, and the watermark to save once they're
+    delivered. Read from the primary, like the watermark itself.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unsupported export table {table!r}.")
+    params = watermark or _EXPORT_START
+    rows = read_transaction(
+        lambda conn: run_query(conn, f"export.{table}.since", params).fetchall(), "get_rows_since", replica=False
+    )
+    if not rows:
+        return [], watermark
+    last = rows[-1]
+    return [tuple(r[:5]) for r in rows], (int(last[5]), int(last[0]))
+
+
+def get_export_ids(table: str) -> Set[int]:
+    """Every user_id now in pending_users or registered_users (to prune a cumulative export)."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unsupported export table {table!r}.")
+    rows = read_transaction(
+        lambda conn: run_query(conn, f"export.{table}.ids").fetchall(), "get_export_ids", replica=False
+    )
+    return {int(r[0]) for r in rows}
+
+
+# ---------------- Bulk roster import ----------------
+def bulk_upsert_registered_users(rows: List[Tuple[int, str, str, str]]) -> Tuple[List[int], List[int]]:
+    """
+    Upsert (user_id, name, block, room) rows into registered_users in one
+    transaction. Returns (inserted_ids, updated_ids); rows identical to what's
+    stored are left alone and appear in neither list.
+    """
+    if not rows:
+        return [], []
+
+    def work(conn):
+        if USE_POSTGRES:
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            buf.seek(0)
+            with conn.cursor() as c:
+                c.execute(
+                    """
+                    CREATE TEMP TABLE roster_stage (
+                        user_id BIGINT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        block TEXT NOT NULL,
+                        room TEXT NOT NULL
+                    ) ON COMMIT DROP;
+                    """
+                )
+                c.copy_expert("COPY roster_stage (user_id, name, block, room) FROM STDIN WITH (FORMAT csv)", buf)
+        else:
+            conn.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS roster_stage (
+                    user_id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    block TEXT NOT NULL,
+                    room TEXT NOT NULL
+                );
+                """
+            )
+            run_query(conn, "roster_stage.clear")
+            conn.executemany(queries.get("roster_stage.insert").render(DIALECT), rows)
+        existing = {int(r[0]) for r in run_query(conn, "roster_stage.existing").fetchall()}
+        changed = [int(r[0]) for r in run_query(conn, "roster_stage.upsert", (_utcnow(), _next_row_version(conn))).fetchall()]
+        run_query(conn, "roster_stage.clear_pending")
+        if not USE_POSTGRES:
+            run_query(conn, "roster_stage.clear")
+        return existing, changed
+
+    existing, changed = write_transaction(work, "bulk_upsert_registered_users")
+    bump_table_version("registered_users", "pending_users")
+    invalidate_user_status()
+    inserted = [uid for uid in changed if uid not in existing]
+    updated = [uid for uid in changed if uid in existing]
+    return inserted, updated
@@ -0,0 +1,274 @@
+"""
+Cross-process cache invalidation.
+
+database.py / booking.py install triggers that publish every insert, update
+and delete on pending_users, registered_users and bookings. One listener
+thread per process turns those into Change events and hands them to the
+callbacks registered with subscribe(), so in-process caches can be kept
+aggressively and still drop entries as soon as another worker (or someone
+running SQL by hand) changes the underlying rows.
+
+- Postgres: LISTEN on database.CHANGE_CHANNEL; notifications arrive on commit.
+- SQLite: poll change_log by sequence number every CHANGE_POLL_INTERVAL.
+
+Whenever events may have been missed (listener reconnected, change_log was
+pruned past our position) subscribers get a RESET change and should drop
+everything they cache.
+
+Changes carry the tenant they belong to (see tenancy.py): the Postgres
+payload names the row's schema, and SQLite runs one poller per tenant file.
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import database
+import tenancy
+from database import USE_POSTGRES, run_query
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", "1"))
+CHANGE_POLL_BATCH = 500
+# change_log rows older than this are pruned (SQLite only)
+CHANGE_LOG_RETENTION_HOURS = float(os.getenv("CHANGE_LOG_RETENTION_HOURS", "24"))
+_PRUNE_EVERY = 600.0  # seconds
+_RECONNECT_DELAY = 5.0
+
+RESET = "RESET"
+ALL = "*"
+
+
+@dataclass(frozen=True)
+class Change:
+    table: str  # a watched table, or ALL for RESET
+    op: str  # INSERT / UPDATE / DELETE / RESET
+    key: Optional[int] = None  # primary key of the changed row
+    user_id: Optional[int] = None
+    date: Optional[str] = None  # bookings only, 'YYYY-MM-DD'
+    # Owning tenant id ("" in single-bot mode); None only on a RESET for every tenant
+    tenant: Optional[str] = None
+
+
+def _int_or_none(value) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+# ---------------- Subscriptions ----------------
+_subscribers: Dict[str, List[Callable[[Change], None]]] = defaultdict(list)
+_stats = {"events": 0, "resets": 0}
+
+
+def subscribe(table: str, callback: Callable[[Change], None]):
+    """
+    Call callback(change) for every change to `table` (or every table, with
+    ALL). RESET changes go to every subscriber. Callbacks run on the listener
+    thread and must be quick and thread-safe (evict, don't reload).
+    """
+    _subscribers[table].append(callback)
+
+
+def dispatch(change: Change):
+    if change.op == RESET:
+        _stats["resets"] += 1
+        targets = [cb for callbacks in _subscribers.values() for cb in callbacks]
+    else:
+        _stats["events"] += 1
+        targets = _subscribers.get(change.table, []) + _subscribers.get(ALL, [])
+    for callback in targets:
+        try:
+            callback(change)
+        except Exception:
+            logger.exception("Invalidation callback failed for %s", change)
+
+
+def publish_local(change: Change):
+    """
+    Deliver a change made by this process right away (tagged with the bound
+    tenant). Other processes hear about it through their listener; this one
+    may too, a moment later, which is harmless since callbacks only evict.
+    """
+    if change.tenant is None:
+        change = replace(change, tenant=tenancy.current_id())
+    dispatch(change)
+    unit = database.current_unit()
+    if unit is not None and unit.in_transaction:
+        # Until the update's unit of work commits, readers can still cache the old rows
+        unit.after_commit(lambda: dispatch(change))
+
+
+def _reset(tenant: Optional[str] = None):
+    dispatch(Change(ALL, RESET, tenant=tenant))
+
+
+# ---------------- Listeners ----------------
+class _Listener:
+    backend = "?"
+
+    def __init__(self, tenant: Optional[tenancy.Tenant] = None):
+        self.tenant = tenant
+        self._stop = threading.Event()
+        name = "change-listener" + (f"-{tenant.id}" if tenant is not None else "")
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=_RECONNECT_DELAY + 1)
+
+    def _run(self):
+        # Threads don't inherit context variables: bind the tenant whose file we poll
+        with tenancy.use(self.tenant):
+            while not self._stop.is_set():
+                conn = None
+                try:
+                    conn = database.new_connection()
+                    self._listen(conn)
+                except Exception:
+                    logger.exception("Change listener (%s) failed; reconnecting", self.backend)
+                    self._stop.wait(_RECONNECT_DELAY)
+                finally:
+                    if conn is not None:
+                        conn.close()
+
+    def _listen(self, conn):
+        raise NotImplementedError
+
+
+class PostgresListener(_Listener):
+    backend = "postgres LISTEN/NOTIFY"
+
+    def _listen(self, conn):
+        conn.autocommit = True
+        with conn.cursor() as c:
+            c.execute(f"LISTEN {database.CHANGE_CHANNEL};")
+        # Anything committed while we weren't listening is unknown
+        _reset()
+        while not self._stop.is_set():
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(notify.payload)
+                    change = Change(
+                        table=payload["table"],
+                        op=payload["op"],
+                        key=_int_or_none(payload.get("key")),
+                        user_id=_int_or_none(payload.get("user_id")),
+                        date=payload.get("date"),
+                        tenant=tenancy.by_schema(payload.get("schema")),
+                    )
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Ignoring malformed change notification %r", notify.payload)
+                    continue
+                dispatch(change)
+
+
+class SqlitePoller(_Listener):
+    backend = "sqlite change_log polling"
+
+    def __init__(self, tenant: Optional[tenancy.Tenant] = None):
+        super().__init__(tenant)
+        self.tenant_id = tenant.id if tenant is not None else ""
+        self.last_seq = 0
+        self._last_prune = 0.0
+
+    def _listen(self, conn):
+        # Start at the head: earlier changes predate anything we could have cached
+        self.last_seq = run_query(conn, "change_log.head", breaker=False).fetchone()[0]
+        _reset(self.tenant_id)
+        while not self._stop.is_set():
+            self._poll(conn)
+            if time.monotonic() - self._last_prune > _PRUNE_EVERY:
+                self._prune()
+            self._stop.wait(CHANGE_POLL_INTERVAL)
+
+    def _poll(self, conn):
+        while True:
+            rows = run_query(conn, "change_log.since", (self.last_seq, CHANGE_POLL_BATCH), breaker=False).fetchall()
+            if not rows:
+                return
+            if rows[0][0] > self.last_seq + 1:
+                # Sequence gap: rows we never saw were pruned
+                _reset(self.tenant_id)
+            for seq, table, op, key, user_id, day in rows:
+                dispatch(Change(table, op, key, user_id, day, self.tenant_id))
+                self.last_seq = seq
+            if len(rows) < CHANGE_POLL_BATCH:
+                return
+
+    def _prune(self):
+        self._last_prune = time.monotonic()
+        cutoff = (datetime.utcnow() - timedelta(hours=CHANGE_LOG_RETENTION_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            database.write_transaction(lambda conn: run_query(conn, "change_log.prune", (cutoff,)), "prune_change_log")
+        except Exception:
+            logger.exception("change_log prune failed")
+
+
+# ---------------- Process lifecycle ----------------
+_listeners: List[_Listener] = []
+_lock = threading.Lock()
+
+
+def _evict_user_status(change: Change):
+    if change.op == RESET:
+        database.invalidate_user_status(tenant="*" if change.tenant is None else change.tenant)
+    else:
+        database.invalidate_user_status(change.user_id, tenant=change.tenant)
+
+
+subscribe("pending_users", _evict_user_status)
+subscribe("registered_users", _evict_user_status)
+
+
+def start():
+    """
+    Start this process's listener (one per tenant database on SQLite;
+    idempotent) and turn on the caches that depend on it. Call after
+    init_db()/init_booking_db().
+    """
+    with _lock:
+        if _listeners:
+            return
+        if USE_POSTGRES:
+            _listeners.append(PostgresListener())
+        else:
+            _listeners.extend(SqlitePoller(t) for t in tenancy.all_tenants() or [None])
+        for listener in _listeners:
+            listener.start()
+        database.enable_user_status_cache()
+        logger.info("Change listener started (%s, %s thread(s))", _listeners[0].backend, len(_listeners))
+
+
+def stop():
+    with _lock:
+        if not _listeners:
+            return
+        database.enable_user_status_cache(False)
+        for listener in _listeners:
+            listener.stop()
+        _listeners.clear()
+
+
+def running() -> bool:
+    return bool(_listeners)
+
+
+def stats() -> Optional[dict]:
+    """Listener backend and event counters (None when not started)."""
+    if not _listeners:
+        return None
+    return {"backend": _listeners[0].backend, **_stats}
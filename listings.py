@@ -0,0 +1,137 @@
+"""
+Rendered admin listings: /pending, /booking_pending, /daily_bookings and
+/all_daily_bookings.
+
+Each listing's finished Markdown is cached under the versions of the tables
+it reads (database.table_version). Writes in database.py and booking.py
+bump those versions, and so do change events from other processes
+(subscribed below), so a cached listing is served only while nothing it was
+built from has changed: several admins refreshing an unchanged queue cost
+one query. Entries under old versions are never hit again and age out of
+the LRU (LISTING_CACHE_SIZE). Entries are keyed by tenant, and like the
+other caches this one is only used while the change listener runs.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Tuple
+
+import database
+import invalidation
+import tenancy
+from booking import get_all_daily_bookings, get_daily_bookings, get_pending_bookings
+
+# ---------------- Config ----------------
+LISTING_CACHE_SIZE = int(os.getenv("LISTING_CACHE_SIZE", "128"))
+
+# Tables whose versions are bumped on change events
+WATCHED_TABLES = ("pending_users", "registered_users", "bookings")
+
+
+# ---------------- Rendering ----------------
+def _pending_users(replica: bool) -> str:
+    users = database.get_pending_users(replica=replica)
+    if not users:
+        return "✅ No pending users."
+    msg = "*Pending Registrations:*\n"
+    for u in users:
+        msg += f"- {u[1]} ({u[2]} Block, Room {u[3]}) — `{u[0]}`\n"
+    return msg
+
+
+def _pending_bookings(replica: bool) -> str:
+    pending_list = get_pending_bookings(replica=replica)
+    if not pending_list:
+        return "✅ No pending bookings."
+    msg = "*Pending Bookings:*\n"
+    for b in pending_list:
+        msg += f"- ID {b[0]}: {b[2] or 'Unknown'} (UID {b[1]}) — {b[3]} on {b[4]} ({b[5]})\n"
+    return msg
+
+
+def _daily_bookings(replica: bool) -> str:
+    bookings = get_daily_bookings(replica=replica)
+    if not bookings:
+        return "✅ No approved bookings today."
+    msg = "📋 *Today's Approved Bookings:*\n\n"
+    for b in bookings:
+        msg += f"• ID {b[0]}: {b[2]} — {b[3]} ({b[4]})\n"
+    return msg
+
+
+def _all_daily_bookings(replica: bool) -> str:
+    bookings = get_all_daily_bookings(replica=replica)
+    if not bookings:
+        return "✅ No bookings today."
+    msg = "📋 *All Today's Bookings:*\n\n"
+    for b in bookings:
+        icon = "✅" if b[5] == "approved" else "⏳" if b[5] == "pending" else "❌"
+        msg += f"{icon} ID {b[0]}: {b[2]} — {b[3]} ({b[4]}) [{b[5]}]\n"
+    return msg
+
+
+# ---------------- Cache ----------------
+# (tenant id, listing, day, table versions) -> rendered Markdown, least recently used first
+_cache: "OrderedDict[Tuple, str]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+
+def _bump(change: invalidation.Change):
+    if change.tenant is None:
+        database.bump_table_version(tenant=database.RESET_ALL)
+    elif change.op == invalidation.RESET:
+        database.bump_table_version(*WATCHED_TABLES, tenant=change.tenant)
+    else:
+        database.bump_table_version(change.table, tenant=change.tenant)
+
+
+for _table in WATCHED_TABLES:
+    invalidation.subscribe(_table, _bump)
+
+
+def _cached(name: str, tables: Tuple[str, ...], render: Callable[[bool], str]) -> str:
+    if not invalidation.running():
+        return render(True)
+    unit = database.current_unit()
+    if unit is not None and unit.in_transaction:
+        # Would see (and cache) this update's uncommitted writes
+        return render(False)
+    # Versions first: a write landing while we render bumps them, so its result is never served
+    key = (tenancy.current_id(), name, date.today(), tuple(database.table_version(t) for t in tables))
+    with _lock:
+        text = _cache.get(key)
+        if text is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return text
+    _stats["misses"] += 1
+    # From the primary: a lagging replica could cache rows older than the versions say
+    text = render(False)
+    with _lock:
+        _cache[key] = text
+        while len(_cache) > LISTING_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _stats["evicted"] += 1
+    return text
+
+
+def pending_users() -> str:
+    return _cached("pending_users", ("pending_users",), _pending_users)
+
+
+def pending_bookings() -> str:
+    return _cached("pending_bookings", ("bookings",), _pending_bookings)
+
+
+def daily_bookings() -> str:
+    return _cached("daily_bookings", ("bookings",), _daily_bookings)
+
+
+def all_daily_bookings() -> str:
+    return _cached("all_daily_bookings", ("bookings",), _all_daily_bookings)
+
+
+def stats() -> Dict[str, int]:
+    return {"entries": len(_cache), **_stats}
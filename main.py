@@ -1,7 +1,11 @@
 import os
 import io
+import asyncio
+import logging
+import uuid
 from datetime import datetime, timedelta
 from functools import wraps
+from typing import Optional, Tuple
 
 import pandas as pd
 from dotenv import load_dotenv
@@ -22,53 +26,110 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler,
 )
+from telegram.request import BaseRequest
+
+# Before the local modules below, which read their config at import time
+load_dotenv()
 
 from database import (
-    get_db_connection,   # ✅ NEW: use this instead of sqlite3 + DB_PATH
     init_db,
     add_pending_user,
     get_pending_users,
     approve_user,
     reject_user,
     is_registered,
+    user_status,
     remove_user,
     get_registered_users,
+    writer_stats,
+    unit_stats,
+    replica_stats,
+    REPLICA_MAX_LAG_SECONDS,
+    add_aunty_report,
+    resolve_aunty_report,
+    normalize_room,
+    search_residents,
+    Segment,
+    count_segment,
+    iter_segment_user_ids,
+    add_to_broadcast_list,
+    remove_from_broadcast_list,
+    get_broadcast_lists,
+    get_export_watermark,
+    set_export_watermark,
+    clear_export_watermark,
+    get_rows_since,
+    get_export_ids,
+    DatabaseUnavailable,
 )
 
+import admins
+import backup
+import calendar_view
+import capture
+import circuit
+import content
+import invalidation
+import listings
+import maintenance
+import outbound
+import profiler
+import reminders
+import roster
+import sessions
+import spool
+import tenancy
+import tracing
+import unitofwork
+from queries import query_stats
+
 from booking import (
     init_booking_db,
     add_booking,
-    get_pending_bookings,
     approve_booking_db,
     reject_booking_db,
-    get_daily_bookings,
-    get_all_daily_bookings,
 )
 
+logger = logging.getLogger(__name__)
+
 # ---------------- ENV ----------------
-load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# Support multiple admins - can be comma-separated IDs
-ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "1779704544")
-ADMIN_IDS = set(int(x.strip()) for x in ADMIN_IDS_STR.split(",") if x.strip())
-ADMIN_ID = next(iter(ADMIN_IDS))  # kept for backward compatibility
+# >1 lets PTB process that many updates at once (e.g. a registration surge),
+# so writes can share group commits in SQLITE_MODE=tuned
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+
+# Where cumulative incremental exports are kept (one file per admin and table)
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
 
-if not BOT_TOKEN:
+# >1 runs one polling ingress process plus this many user-sharded workers (see cluster.py)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+# With TENANTS_FILE set, the bots' tokens come from that file instead (see tenancy.py)
+if not BOT_TOKEN and not tenancy.TENANTS_FILE:
     raise ValueError("❌ BOT_TOKEN environment variable is not set!")
 
 
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+def is_admin(user_id: int, *roles: str) -> bool:
+    """Any admin role (or one of `roles`); super-admins pass every check."""
+    return admins.has_role(user_id, *roles)
 
 
-async def notify_admins(bot, text: str, parse_mode: str = "Markdown"):
-    """Send a message to all admins (safe if 1 fails)."""
-    for aid in ADMIN_IDS:
-        try:
-            await bot.send_message(chat_id=aid, text=text, parse_mode=parse_mode)
-        except Exception:
-            pass
+async def notify_admins(bot, text: str, *roles: str, parse_mode: str = "Markdown", reply_markup=None):
+    """
+    Alert the admins holding one of `roles` (super-admins if nobody does) at
+    once, ahead of any queued DMs/broadcasts (safe if 1 fails).
+    """
+    await asyncio.gather(
+        *(
+            bot.send_message(
+                chat_id=aid, text=text, parse_mode=parse_mode, reply_markup=reply_markup,
+                rate_limit_args=outbound.ALERT,
+            )
+            for aid in admins.recipients(*roles)
+        ),
+        return_exceptions=True,
+    )
 
 
 async def notify_user_safely(bot, user_id: int, text: str) -> bool:
@@ -88,14 +149,28 @@ EQUIPMENTS = [
     "Tennis Items", "Table Tennis Items", "Frisbee", "Touch Rugby", "Softball", "Pickleball",
 ]
 
+VALID_BLOCKS = ["Purple", "Orange", "Green", "Blue"]
+
+
+def valid_blocks() -> list:
+    """The bound tenant's blocks (VALID_BLOCKS unless its config overrides them)."""
+    tenant = tenancy.current()
+    return list(tenant.blocks) if tenant is not None and tenant.blocks else VALID_BLOCKS
+
+
+def equipments() -> list:
+    tenant = tenancy.current()
+    return list(tenant.equipment) if tenant is not None and tenant.equipment else EQUIPMENTS
+
+DB_DOWN_MESSAGE = "⚠️ The bot's database is having trouble right now. Please try again in a few minutes."
+
 # ---------------- STATES ----------------
 ASK_NAME, ASK_BLOCK, ASK_ROOM = range(3)
 ASK_EQUIP, ASK_DATE, ASK_DURATION = range(10, 13)
 ASK_AUNTY_LOCATION = 20
 ASK_BROADCAST_MESSAGE = 30
 ASK_REJECTION_REASON = 40
-
-pending_aunty_reports = {}
+ASK_ROSTER_FILE = 50
 
 # ---------------- HELPERS ----------------
 def _valid_date(text: str) -> bool:
@@ -119,73 +194,105 @@ def _normalize_date(text: str) -> str:
     return text.strip()
 
 
+async def registration_gate(update: Update) -> bool:
+    """True if the user may use restricted features; otherwise tells them why not."""
+    user_id = update.effective_user.id
+
+    # Admin bypass
+    if is_admin(user_id):
+        return True
+
+    try:
+        status = user_status(user_id)
+    except DatabaseUnavailable:
+        if update.message:
+            await update.message.reply_text(DB_DOWN_MESSAGE)
+        elif update.callback_query:
+            await update.callback_query.answer(DB_DOWN_MESSAGE, show_alert=True)
+        return False
+    if status != "registered":
+        if update.message:
+            if status == "pending":
+                await update.message.reply_text("⏳ Your registration is pending admin approval. Please wait.")
+            else:
+                await update.message.reply_text("❌ You must register first using /register.")
+        elif update.callback_query:
+            await update.callback_query.answer("❌ Register first using /register.", show_alert=True)
+        return False
+
+    return True
+
+
 def restricted(func):
     @wraps(func)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        user_id = update.effective_user.id
-
-        # Admin bypass
-        if is_admin(user_id):
-            return await func(update, context, *args, **kwargs)
-
-        # ✅ FIX: check pending using DB-agnostic connection
-        is_pending = False
-        try:
-            with get_db_connection() as conn:
-                cur = conn.cursor()
-                try:
-                    # Postgres: %s, SQLite: ?
-                    cur.execute("SELECT 1 FROM pending_users WHERE user_id=%s", (user_id,))
-                except Exception:
-                    cur.execute("SELECT 1 FROM pending_users WHERE user_id=?", (user_id,))
-                is_pending = cur.fetchone() is not None
-        except Exception:
-            # If DB is temporarily down, still block restricted actions safely
-            is_pending = False
-
-        if not is_registered(user_id):
-            if update.message:
-                if is_pending:
-                    await update.message.reply_text("⏳ Your registration is pending admin approval. Please wait.")
-                else:
-                    await update.message.reply_text("❌ You must register first using /register.")
-            elif update.callback_query:
-                await update.callback_query.answer("❌ Register first using /register.", show_alert=True)
+        if not await registration_gate(update):
             return
-
         return await func(update, context, *args, **kwargs)
 
     return wrapped
 
 
+def admin_only(*roles: str):
+    """Only admins holding one of `roles` (or super-admins) get through; ends any conversation otherwise."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            if not is_admin(update.effective_user.id, *roles):
+                if update.callback_query:
+                    await update.callback_query.answer("❌ Not authorized.", show_alert=True)
+                elif update.message:
+                    await update.message.reply_text("❌ You are not authorized.")
+                return ConversationHandler.END
+            return await func(update, context, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
 # ---------------- BOT COMMANDS ----------------
+BOT_COMMANDS = [
+    BotCommand("start", "Welcome message"),
+    BotCommand("register", "Register yourself in the bot"),
+    BotCommand("cancel", "Cancel an ongoing process"),
+    BotCommand("help", "List all available commands"),
+    BotCommand("food", "Find supper and food options"),
+    BotCommand("groups", "View Hall 5 group links"),
+    BotCommand("committees", "Committees in Hall V"),
+    BotCommand("book", "Request to book sports equipment"),
+    BotCommand("enemyspotted", "Report Hall Aunty sighting"),
+
+    # Admin
+    BotCommand("broadcast", "Admin: Broadcast to all users, a block, a join date range or a list"),
+    BotCommand("lists", "Admin: View saved broadcast lists"),
+    BotCommand("list_add", "Admin: Add users to a broadcast list"),
+    BotCommand("list_remove", "Admin: Remove users from a broadcast list"),
+    BotCommand("pending", "Admin: View pending registrations"),
+    BotCommand("approve", "Admin: Approve a pending user"),
+    BotCommand("reject", "Admin: Reject a pending user"),
+    BotCommand("remove", "Admin: Remove a registered user"),
+    BotCommand("export", "Admin: Export registered users"),
+    BotCommand("export_pending", "Admin: Export pending users"),
+    BotCommand("find", "Admin: Search residents by name, block or room"),
+    BotCommand("import_roster", "Admin: Bulk-register residents from a CSV/XLSX roster"),
+    BotCommand("booking_pending", "Admin: View pending bookings"),
+    BotCommand("booking_approve", "Admin: Approve a booking"),
+    BotCommand("booking_reject", "Admin: Reject a booking"),
+    BotCommand("daily_bookings", "Admin: View today's approved bookings"),
+    BotCommand("all_daily_bookings", "Admin: View all today's bookings (all statuses)"),
+    BotCommand("calendar", "Admin: Weekly equipment booking calendar"),
+    BotCommand("admins", "Admin: List admins and their roles"),
+    BotCommand("grant", "Admin: Give a user an admin role"),
+    BotCommand("revoke", "Admin: Take away admin roles"),
+    BotCommand("dbstats", "Admin: Query execution counts"),
+    BotCommand("profile", "Admin: Profile the bot for N seconds"),
+    BotCommand("backup", "Admin: Snapshot the database now"),
+]
+
+
 async def set_bot_commands(application):
-    commands = [
-        BotCommand("start", "Welcome message"),
-        BotCommand("register", "Register yourself in the bot"),
-        BotCommand("cancel", "Cancel an ongoing process"),
-        BotCommand("help", "List all available commands"),
-        BotCommand("food", "Find supper and food options"),
-        BotCommand("groups", "View Hall 5 group links"),
-        BotCommand("committees", "Committees in Hall V"),
-        BotCommand("book", "Request to book sports equipment"),
-        BotCommand("enemyspotted", "Report Hall Aunty sighting"),
-
-        # Admin
-        BotCommand("broadcast", "Admin: Broadcast message to all users"),
-        BotCommand("pending", "Admin: View pending registrations"),
-        BotCommand("approve", "Admin: Approve a pending user"),
-        BotCommand("reject", "Admin: Reject a pending user"),
-        BotCommand("remove", "Admin: Remove a registered user"),
-        BotCommand("export", "Admin: Export registered users"),
-        BotCommand("export_pending", "Admin: Export pending users"),
-        BotCommand("booking_pending", "Admin: View pending bookings"),
-        BotCommand("booking_approve", "Admin: Approve a booking"),
-        BotCommand("booking_reject", "Admin: Reject a booking"),
-        BotCommand("daily_bookings", "Admin: View today's approved bookings"),
-        BotCommand("all_daily_bookings", "Admin: View all today's bookings (all statuses)"),
-    ]
-    await application.bot.set_my_commands(commands)
+    await application.bot.set_my_commands(BOT_COMMANDS)
 
 
 # ---------------- BASIC ----------------
@@ -202,7 +309,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ---------------- REGISTRATION FLOW ----------------
 async def start_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if is_registered(user_id):
+    try:
+        registered = is_registered(user_id)
+    except DatabaseUnavailable:
+        # Degraded mode: let them fill in the form; the request is spooled (registered wins over pending)
+        registered = False
+    if registered:
         await update.message.reply_text("✅ You are already registered.")
         return ConversationHandler.END
     await update.message.reply_text("👋 Hi! What's your full name?")
@@ -216,7 +328,8 @@ async def ask_block(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ASK_NAME
     
     context.user_data["name"] = name
-    reply_keyboard = [["Purple", "Orange"], ["Green", "Blue"]]
+    blocks = valid_blocks()
+    reply_keyboard = [blocks[i:i + 2] for i in range(0, len(blocks), 2)]
     markup = ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text("🏢 Which block are you from?", reply_markup=markup)
     return ASK_BLOCK
@@ -224,10 +337,9 @@ async def ask_block(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def ask_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
     block = update.message.text.strip()
-    valid_blocks = ["Purple", "Orange", "Green", "Blue"]
-    
-    if block not in valid_blocks:
-        await update.message.reply_text(f"❌ Please select a valid block: {', '.join(valid_blocks)}")
+    blocks = valid_blocks()
+    if block not in blocks:
+        await update.message.reply_text(f"❌ Please select a valid block: {', '.join(blocks)}")
         return ASK_BLOCK
     
     context.user_data["block"] = block
@@ -237,30 +349,24 @@ async def ask_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def save_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    room = update.message.text.strip()
+    room = normalize_room(update.message.text)
     
     if not room:
         await update.message.reply_text("❌ Room number cannot be empty. Try again.")
         return ASK_ROOM
     
-    name = context.user_data.get("name", "").strip()
-    block = context.user_data.get("block", "").strip()
+    name = context.user_data.pop("name", "").strip()
+    block = context.user_data.pop("block", "").strip()
 
     try:
-        add_pending_user(user_id, name, block, room)
+        await asyncio.to_thread(add_pending_user, user_id, name, block, room)
         await update.message.reply_text("✅ Registration request sent! Await admin approval.")
-
-        await notify_admins(
-            context.bot,
-            (
-                f"🚨 *New registration request*\n"
-                f"Name: {name}\n"
-                f"Block: {block}\n"
-                f"Room: {room}\n"
-                f"User ID: `{user_id}`\n\n"
-                f"`/approve {user_id}`\n"
-                f"`/reject {user_id}`"
-            ),
+        await announce_registration(context.bot, user_id, name, block, room)
+    except DatabaseUnavailable:
+        await asyncio.to_thread(spool.enqueue, "registration", user_id, {"name": name, "block": block, "room": room})
+        await update.message.reply_text(
+            "🕓 Saved, will sync: our database is down right now, so your registration request will be "
+            "sent to the admins automatically once it's back. No need to register again."
         )
     except Exception as e:
         await update.message.reply_text(f"❌ Error saving registration: {str(e)}")
@@ -268,22 +374,45 @@ async def save_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def announce_registration(bot, user_id: int, name: str, block: str, room: str):
+    await notify_admins(
+        bot,
+        (
+            f"🚨 *New registration request*\n"
+            f"Name: {name}\n"
+            f"Block: {block}\n"
+            f"Room: {room}\n"
+            f"User ID: `{user_id}`\n\n"
+            f"`/approve {user_id}`\n"
+            f"`/reject {user_id}`"
+        ),
+        admins.REGISTRATION,
+    )
+
+
+async def replay_registration(bot, user_id: int, payload: dict):
+    """Spooled registration request (see spool.py), once the database is back."""
+    await asyncio.to_thread(add_pending_user, user_id, payload["name"], payload["block"], payload["room"])
+    await notify_user_safely(bot, user_id, "✅ Your saved registration request has now been sent. Await admin approval.")
+    await announce_registration(bot, user_id, payload["name"], payload["block"], payload["room"])
+
+
+spool.register("registration", replay_registration)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Cancelled.")
     return ConversationHandler.END
 
 
-@restricted
+@admin_only(admins.REGISTRATION)
 async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ You are not authorized.")
-        return
     try:
         user_id = int(context.args[0])
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Usage: /approve <user_id>")
         return
-    if approve_user(user_id):
+    if await asyncio.to_thread(approve_user, user_id):
         user_notified = await notify_user_safely(context.bot, user_id, "✅ You are now registered!")
         status_suffix = "" if user_notified else " User approved, but I couldn't DM them on Telegram."
         await update.message.reply_text(f"✅ Approved user {user_id}.{status_suffix}")
@@ -291,82 +420,230 @@ async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ User not found in pending list.")
 
 
-@restricted
+@admin_only(admins.REGISTRATION)
 async def reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ You are not authorized.")
-        return
     try:
         user_id = int(context.args[0])
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Usage: /reject <user_id>")
         return
-    reject_user(user_id)
+    if not await asyncio.to_thread(reject_user, user_id):
+        await update.message.reply_text("❌ User not found in pending list.")
+        return
     user_notified = await notify_user_safely(context.bot, user_id, "❌ Your registration was rejected.")
     status_suffix = "" if user_notified else " User rejected, but I couldn't DM them on Telegram."
     await update.message.reply_text(f"❌ Rejected user {user_id}.{status_suffix}")
 
 
-@restricted
+@admin_only(admins.REGISTRATION)
 async def pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ You are not authorized.")
-        return
-    users = get_pending_users()
-    if not users:
-        await update.message.reply_text("✅ No pending users.")
-        return
-    msg = "*Pending Registrations:*\n"
-    for u in users:
-        msg += f"- {u[1]} ({u[2]} Block, Room {u[3]}) — `{u[0]}`\n"
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    await update.message.reply_text(listings.pending_users(), parse_mode="Markdown")
 
 
-@restricted
+@admin_only(admins.REGISTRATION)
 async def remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ You are not authorized.")
-        return
     try:
         user_id = int(context.args[0])
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Usage: /remove <user_id>")
         return
-    remove_user(user_id)
+    if not await asyncio.to_thread(remove_user, user_id):
+        await update.message.reply_text("❌ User not found in registered list.")
+        return
     await update.message.reply_text(f"🗑️ Removed user {user_id}.")
     await context.bot.send_message(chat_id=user_id, text="⚠️ You have been removed. Contact admin.")
 
 
-@restricted
-async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    users = get_registered_users()
-    if not users:
-        await update.message.reply_text("⚠️ No registered users found.")
+# ---------------- ADMIN ROLES ----------------
+ROLE_USAGE = "⚠️ Usage: /{cmd} <user_id> {role}\nRoles: " + ", ".join(admins.ROLES)
+
+
+@admin_only(admins.SUPER)
+async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    current = admins.list_admins()
+    msg = "*Admins:*\n"
+    for uid in sorted(current):
+        pinned = " (permanent)" if uid in admins.bootstrap_ids() else ""
+        msg += f"- `{uid}` — {', '.join(sorted(current[uid]))}{pinned}\n"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+
+@admin_only(admins.SUPER)
+async def grant_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id, role = int(context.args[0]), context.args[1].lower()
+    except (IndexError, ValueError):
+        await update.message.reply_text(ROLE_USAGE.format(cmd="grant", role="<role>"))
+        return
+    if role not in admins.ROLES:
+        await update.message.reply_text(ROLE_USAGE.format(cmd="grant", role="<role>"))
         return
-    df = pd.DataFrame(users, columns=["User ID", "Name", "Block", "Room", "Created At"])
+    if not await asyncio.to_thread(admins.grant, user_id, role, update.effective_user.id):
+        await update.message.reply_text(f"ℹ️ {user_id} already has the {role} role.")
+        return
+    await update.message.reply_text(f"✅ Gave {user_id} the {role} role.")
+    await notify_user_safely(context.bot, user_id, f"🔑 You are now a {role} admin. Send /help to see your commands.")
+
+
+@admin_only(admins.SUPER)
+async def revoke_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text(ROLE_USAGE.format(cmd="revoke", role="[role]"))
+        return
+    role = context.args[1].lower() if len(context.args) > 1 else None
+    if role is not None and role not in admins.ROLES:
+        await update.message.reply_text(ROLE_USAGE.format(cmd="revoke", role="[role]"))
+        return
+    removed = await asyncio.to_thread(admins.revoke, user_id, [role] if role else None)
+    pinned = " They stay a permanent super-admin." if user_id in admins.bootstrap_ids() else ""
+    if not removed:
+        await update.message.reply_text(f"❌ {user_id} has no such role.{pinned}")
+        return
+    await update.message.reply_text(f"🗑️ Revoked {role or 'all roles'} from {user_id}.{pinned}")
+
+
+EXPORT_COLUMNS = ["User ID", "Name", "Block", "Room", "Created At"]
+EXPORT_USAGE = (
+    "⚠️ Usage: /{cmd} [new [merge] | reset]\n"
+    "new — only rows added since your last incremental export\n"
+    "new merge — same, merged into your cumulative file (users removed since drop out)\n"
+    "reset — forget your watermark (next 'new' exports everything)"
+)
+
+
+def _cumulative_path(admin_id: int, table: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{admin_id}_{table}.xlsx")
+
+
+def _to_excel(df: pd.DataFrame) -> io.BytesIO:
     output = io.BytesIO()
     df.to_excel(output, index=False)
     output.seek(0)
+    return output
+
+
+def _merge_cumulative(table: str, path: str, rows: list, existing: bool):
+    """
+    Merge new/changed rows into the admin's cumulative file, dropping users no
+    longer in the table (removed, rejected or approved since). Returns
+    (merged DataFrame, how many were dropped).
+    """
+    df = pd.DataFrame(rows, columns=EXPORT_COLUMNS)
+    if existing:
+        df = pd.concat([pd.read_excel(path), df]).drop_duplicates(subset="User ID", keep="last")
+    kept = df[df["User ID"].isin(get_export_ids(table))]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    kept.to_excel(path, index=False)
+    return kept, len(df) - len(kept)
+
+
+async def _export_table(update: Update, context: ContextTypes.DEFAULT_TYPE, table: str, full_rows, label: str):
+    admin_id = update.effective_user.id
+    mode = [a.lower() for a in context.args or []]
+    cmd = "export" if table == "registered_users" else "export_pending"
+
+    if not mode:
+        users = await asyncio.to_thread(full_rows)
+        if not users:
+            await update.message.reply_text(f"⚠️ No {label} found.")
+            return
+        df = pd.DataFrame(users, columns=EXPORT_COLUMNS)
+        await context.bot.send_document(
+            chat_id=admin_id,
+            document=InputFile(await asyncio.to_thread(_to_excel, df), filename=f"{table}.xlsx"),
+        )
+        return
+
+    if mode == ["reset"]:
+        await asyncio.to_thread(clear_export_watermark, admin_id, table)
+        await update.message.reply_text(f"♻️ Export watermark for {label} cleared.")
+        return
+
+    if mode not in (["new"], ["new", "merge"]):
+        await update.message.reply_text(EXPORT_USAGE.format(cmd=cmd))
+        return
+
+    merge = len(mode) == 2
+    cumulative = _cumulative_path(admin_id, table)
+    watermark = await asyncio.to_thread(get_export_watermark, admin_id, table)
+    if merge and not os.path.exists(cumulative):
+        watermark = None  # no file to merge into (e.g. fresh host): rebuild it from scratch
+
+    rows, next_watermark = await asyncio.to_thread(get_rows_since, table, watermark)
+    caption = f"📦 {len(rows)} new/changed {label}."
+    if merge:
+        df, dropped = await asyncio.to_thread(_merge_cumulative, table, cumulative, rows, watermark is not None)
+        filename = f"{table}_cumulative.xlsx"
+        if dropped:
+            caption += f" {dropped} no longer listed, removed."
+    else:
+        df, dropped = pd.DataFrame(rows, columns=EXPORT_COLUMNS), 0
+        filename = f"{table}_new.xlsx"
+    if not rows and not dropped:
+        await update.message.reply_text(f"✅ No new {label} since your last export.")
+        return
+
     await context.bot.send_document(
-        chat_id=update.effective_user.id,
-        document=InputFile(output, filename="registered_users.xlsx"),
+        chat_id=admin_id,
+        document=InputFile(await asyncio.to_thread(_to_excel, df), filename=filename),
+        caption=caption,
     )
+    # Advance only once the file is delivered
+    await asyncio.to_thread(set_export_watermark, admin_id, table, next_watermark)
 
 
-@restricted
+@admin_only(admins.REGISTRATION)
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _export_table(update, context, "registered_users", get_registered_users, "registered users")
+
+
+@admin_only(admins.REGISTRATION)
 async def export_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    users = get_pending_users()
-    if not users:
-        await update.message.reply_text("⚠️ No pending users found.")
+    await _export_table(update, context, "pending_users", get_pending_users, "pending users")
+
+
+FIND_PAGE_SIZE = 10
+
+
+def _render_find_page(text: str, page: int):
+    rows, has_more = search_residents(text, limit=FIND_PAGE_SIZE, offset=page * FIND_PAGE_SIZE)
+    if not rows:
+        return f"🔍 No residents match `{text}`.", None
+    msg = f"🔍 *Residents matching* `{text}` (page {page + 1}):\n"
+    for u in rows:
+        msg += f"- {u[1]} ({u[2]} Block, Room {u[3]}) — `{u[0]}`\n"
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"find_page:{page - 1}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"find_page:{page + 1}"))
+    return msg, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+@admin_only(admins.REGISTRATION)
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args).strip()
+    if not text:
+        await update.message.reply_text("⚠️ Usage: /find <name | block | room>")
         return
-    df = pd.DataFrame(users, columns=["User ID", "Name", "Block", "Room", "Created At"])
-    output = io.BytesIO()
-    df.to_excel(output, index=False)
-    output.seek(0)
-    await context.bot.send_document(
-        chat_id=update.effective_user.id,
-        document=InputFile(output, filename="pending_users.xlsx"),
-    )
+    context.user_data["find_query"] = text
+    msg, markup = _render_find_page(text, 0)
+    await update.message.reply_text(msg, parse_mode="Markdown", reply_markup=markup)
+
+
+@admin_only(admins.REGISTRATION)
+async def find_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    text = context.user_data.get("find_query")
+    if not text:
+        await query.answer("⚠️ Search expired, run /find again.", show_alert=True)
+        return
+    await query.answer()
+    page = max(0, int(query.data.split(":", 1)[1]))
+    msg, markup = _render_find_page(text, page)
+    await query.edit_message_text(msg, parse_mode="Markdown", reply_markup=markup)
 
 
 @restricted
@@ -384,109 +661,106 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "`/cancel` — Cancel an ongoing process\n"
     )
     if is_admin(uid):
+        text += "\n*🔑 Admin Commands:*\n"
+    if is_admin(uid, admins.REGISTRATION):
         text += (
-            "\n*🔑 Admin Commands:*\n\n"
-            "*User Management:*\n"
+            "\n*User Management:*\n"
             "`/pending` — View pending registrations\n"
             "`/approve <user_id>` — Approve a pending user\n"
             "`/reject <user_id>` — Reject a pending user\n"
             "`/remove <user_id>` — Remove a registered user\n"
-            "`/export` — Export registered users to Excel\n"
-            "`/export_pending` — Export pending users to Excel\n\n"
-            "*Booking Management:*\n"
+            "`/export [new [merge]|reset]` — Export registered users to Excel\n"
+            "`/export_pending [new [merge]|reset]` — Export pending users to Excel\n"
+            "`/find <name|block|room>` — Search residents\n"
+            "`/import_roster` — Bulk-register residents from a CSV/XLSX roster\n"
+        )
+    if is_admin(uid, admins.BOOKING):
+        text += (
+            "\n*Booking Management:*\n"
             "`/booking_pending` — View pending bookings\n"
             "`/booking_approve <booking_id>` — Approve a booking\n"
             "`/booking_reject <booking_id>` — Reject a booking\n"
             "`/daily_bookings` — View today's approved bookings\n"
             "`/all_daily_bookings` — View all today's bookings\n"
-            "`/broadcast` — Broadcast message to all users\n"
+            "`/calendar [next|last|YYYY-MM-DD]` — Weekly equipment calendar\n"
+        )
+    if is_admin(uid, admins.SUPER):
+        text += (
+            "\n*Broadcasts:*\n"
+            "`/broadcast [block|joined <from> [to]|list <name>]` — Broadcast to everyone or a segment\n"
+            "`/lists` — View saved broadcast lists\n"
+            "`/list_add <name> <user_id> ...` — Add users to a list\n"
+            "`/list_remove <name> <user_id> ...` — Remove users from a list\n\n"
+            "*Admins:*\n"
+            "`/admins` — List admins and their roles\n"
+            "`/grant <user_id> <role>` — Give a role (super, booking, registration)\n"
+            "`/revoke <user_id> [role]` — Take a role, or all of them\n\n"
+            "*Diagnostics:*\n"
+            "`/dbstats` — Query execution counts\n"
+            "`/profile [seconds]` — Sample the running bot and send a flamegraph file\n"
+            "`/backup [list]` — Snapshot the database now, or list snapshots\n"
         )
     await update.message.reply_text(text, parse_mode="Markdown")
 
 
-# ---------------- FOOD ----------------
-CANTEEN_MENUS = {
-    "canteen_1": {"name": "🏫 Canteen 1", "food": ["Japanese Curry Rice", "Mala", "Vietnamese Cusine", "Mixed Rice"]},
-    "canteen_2": {"name": "🏫 Canteen 2", "food": ["Western", "Abang Dol", "Chicken Rice", "Mini Wok", "Pasta", "Snail Noodles", "Japanese and Korean Stall", "Caifan"]},
-    "canteen_4": {"name": "🏫 Canteen 4", "food": ["Hot Pot", "Chicken Rice", "Flapjack + waffle + Drink stall"]},
-    "crespion": {"name": "☕ Crespion", "food": ["Caifan", "Thai", "Dingo", "Ban Mian", "Fusion Bowl", "Indian Stall", "Mr Pasta", "Mala", "Tealer BBT", "Drink and Waffle store"]},
-    "south_spine": {"name": "🍽️ South Spine", "food": ["Ban Mian", "Chicken Rice", "Drink Stall", "Caifan", "La Mian/ Xiao Long Bao", "Mala", "Rice Noodle"]},
-}
-
-COMMITTEES = {
-    "JCRC": {"description": "Hall Council\n\nThe heart of Hall V, Hall Council plans major events and initiatives to make hall life vibrant, inclusive, and unforgettable.", "photo_url": "https://drive.google.com/uc?export=view&id=1Ah45TyWq6cfQX6Y7-rEj-7IeW5SXKJJP"},
-    "TYH": {"description": "Twenty-One Young Hearts (TYH)\n\nHall V's community service committee planning meaningful service projects.", "photo_url": "https://drive.google.com/uc?export=view&id=1aLkv-e3MrB56yEPoT9vCcuOJktUuAkQh"},
-    "HAVOC": {"description": "HAVOC (Hall Orientation Committee)\n\nRuns Hall V orientation and welcomes freshies.", "photo_url": "https://drive.google.com/uc?export=view&id=1FSa71k0UL-twfddQuufl1Z-E1P4i_47D"},
-    "HAPZ": {"description": "HAPZ (Hall Anniversary Party Committee)\n\nOrganises Hall V's major celebrations like Seniors' Farewell and D&D.", "photo_url": "https://drive.google.com/uc?export=view&id=135sgG29JZu-r9WQdNKkDff_8Jf5Peztz"},
-    "Quindance": {"description": "QuinDanze\n\nHall V’s dance family — all styles, all levels.", "photo_url": "https://drive.google.com/uc?export=view&id=1qNjutTjEGNpougxl-DAgnHDhiPEGf5X-"},
-    "Quinstical Productions": {"description": "Quintsical Productions (QP)\n\nFilm & media crew — shoot, edit, act, create.", "photo_url": "https://drive.google.com/uc?export=view&id=1Ly9cRfUhWWajYrHZ_fpQ3bo3k746Lts7"},
-    "Vikings": {"description": "Vikings\n\nHall V’s cheerleading team bringing energy to every event.", "photo_url": "https://via.placeholder.com/400x300?text=Vikings"},
-    "Jamband": {"description": "Jamband\n\nHall V’s music crew — jam sessions, workshops, performances.", "photo_url": "https://drive.google.com/uc?export=view&id=1lpSij_B0fTYrbJ_jPw3ZrAkhECrKRtlC"},
-    "SPOREC": {"description": "SPOREC\n\nSports & recreation committee running games and sports events.", "photo_url": "https://drive.google.com/uc?export=view&id=1hotBBzsWFm7marCS6Yp-7h_DfotSwy5X"},
-}
-
-for committee in COMMITTEES.values():
-    committee["photo_url"] = committee["photo_url"].replace("export=view", "export=download")
-
-COMMITTEE_PHOTOS = {
-    "JCRC": os.path.join("assets", "committees", "jcrc.jpg"),
-    "TYH": os.path.join("assets", "committees", "tyh_compressed.jpg"),
-    "HAVOC": os.path.join("assets", "committees", "havoc.jpg"),
-    "HAPZ": os.path.join("assets", "committees", "hapz.jpg"),
-    "Quindance": os.path.join("assets", "committees", "quindance.jpg"),
-    "Quinstical Productions": os.path.join("assets", "committees", "quinstical_productions.jpg"),
-    "Jamband": os.path.join("assets", "committees", "jamband.jpg"),
-    "SPOREC": os.path.join("assets", "committees", "sporec.jpg"),
-}
+# ---------------- STATIC CONTENT ----------------
+# Menus, committees and group links live in content.json (see content.py)
+def content_command(name: str):
+    """Handler that sends a pre-rendered content.json command reply."""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        reply = content.command(name)
+        if not reply.public and not await registration_gate(update):
+            return
+        await update.message.reply_text(reply.text, parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
 
+    handler.__name__ = handler.__qualname__ = f"content_{name}"
+    return handler
 
-@restricted
-async def food(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("🍜 Supper Spots Nearby", callback_data="supper_nearby")],
-        [InlineKeyboardButton("🍛 Food Places Near Hall", callback_data="food_near_hall")],
-        [InlineKeyboardButton("🔗 Supper Channels to Join", callback_data="supper_channels")],
-        [InlineKeyboardButton("🍔 Popular Hall 5 GrabFood", callback_data="grab_options")],
-    ]
-    await update.message.reply_text("🍽 What are you looking for?", reply_markup=InlineKeyboardMarkup(keyboard))
 
+food = content_command("food")
+groups = content_command("groups")
+show_committees = content_command("committees")
 
-@restricted
-async def groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = (
-        "*🏛️ HALL V GROUP CHATS TO JOIN!*\n\n"
-        "*ANNOUNCEMENTS:*\n"
-        "[Announcements](https://t.me/+wNb72ZmYBPVlYjI1)\n\n"
-        "*BLOCK CHATS:*\n"
-        "💜 [Purple Block (Block 28)](https://t.me/+YLowJE5pAI4zYWNl)\n"
-        "🧡 [Orange Block (Block 29)](https://t.me/+KcGB8uMeP8ZmZTE1)\n"
-        "💙 [Blue Block (Block 30)](https://t.me/+lK95Tc_NFgc4OTBl)\n"
-        "💚 [Green Block (Block 31)](https://t.me/+0rHuc8UPaY01ZWY1)\n\n"
-        "*HALL V SPORTS FANATICS:*\n"
-        "[Sports Fanatics](https://t.me/+urn2-hrYt-A2OWY1)\n\n"
-        "*HALL V SPORTS:*\n"
-        "[Sports Activities](https://linktr.ee/HALLVSPORTS)\n\n"
-        "*HALL V RECREATIONAL GAMES:*\n"
-        "[Recreational Games](https://linktr.ee/HALLVREC)"
-    )
-    await update.message.reply_text(message, parse_mode="Markdown")
 
+async def send_committee_card(query, context: ContextTypes.DEFAULT_TYPE, card: content.CommitteeCard):
+    await query.edit_message_text("Loading committee info...")
+    chat_id = query.message.chat_id
+
+    if card.photo_path and os.path.exists(card.photo_path):
+        file_id = content.cached_photo_id(card.photo_path)
+        if file_id:
+            await context.bot.send_photo(chat_id=chat_id, photo=file_id, caption=card.caption, parse_mode="Markdown")
+            return
+        with open(card.photo_path, "rb") as photo_file:
+            sent = await context.bot.send_photo(
+                chat_id=chat_id,
+                photo=photo_file,
+                caption=card.caption,
+                parse_mode="Markdown",
+            )
+        if sent.photo:
+            content.remember_photo_id(card.photo_path, sent.photo[-1].file_id)
+        return
 
-async def show_committees(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("JCRC", callback_data="JCRC"), InlineKeyboardButton("TYH", callback_data="TYH")],
-        [InlineKeyboardButton("HAVOC", callback_data="HAVOC"), InlineKeyboardButton("HAPZ", callback_data="HAPZ")],
-        [InlineKeyboardButton("Quindance", callback_data="Quindance"),
-         InlineKeyboardButton("Quinstical Productions", callback_data="Quinstical Productions")],
-        [InlineKeyboardButton("Vikings", callback_data="Vikings"), InlineKeyboardButton("Jamband", callback_data="Jamband")],
-        [InlineKeyboardButton("SPOREC", callback_data="SPOREC")],
-    ]
-    await update.message.reply_text("Select a committee:", reply_markup=InlineKeyboardMarkup(keyboard))
+    try:
+        await context.bot.send_photo(
+            chat_id=chat_id,
+            photo=card.photo_url,
+            caption=card.caption,
+            parse_mode="Markdown",
+        )
+    except Exception:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=card.caption,
+            parse_mode="Markdown",
+        )
 
 # ---------------- BOOKING FLOW ----------------
 @restricted
 async def start_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    reply_keyboard = [EQUIPMENTS[i:i + 2] for i in range(0, len(EQUIPMENTS), 2)]
+    options = equipments()
+    reply_keyboard = [options[i:i + 2] for i in range(0, len(options), 2)]
     markup = ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text("Which equipment would you like to book?", reply_markup=markup)
     return ASK_EQUIP
@@ -512,27 +786,60 @@ async def confirm_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     duration = update.message.text.strip()
     user = update.effective_user
 
-    equipment = context.user_data.get("equipment")
-    date = context.user_data.get("date")
+    equipment = context.user_data.pop("equipment", None)
+    date = context.user_data.pop("date", None)
     name = user.full_name or ""
 
-    booking_id = add_booking(user.id, name, equipment, date, duration)
+    # Idempotency key: if the insert commits but the call still fails (e.g. the
+    # connection drops at COMMIT), the spooled replay finds the booking instead of adding another
+    request_key = uuid.uuid4().hex
+    try:
+        booking_id = await asyncio.to_thread(add_booking, user.id, name, equipment, date, duration, request_key)
+    except DatabaseUnavailable:
+        payload = {
+            "name": name, "equipment": equipment, "date": date, "duration": duration, "request_key": request_key,
+        }
+        await asyncio.to_thread(spool.enqueue, "booking", user.id, payload)
+        await update.message.reply_text(
+            "🕓 Saved, will sync: our database is down right now, so your booking request will be submitted "
+            "automatically once it's back. You'll get its booking ID then."
+        )
+        return ConversationHandler.END
 
     await update.message.reply_text(f"✅ Booking submitted (ID: {booking_id}). Await admin approval.")
+    await announce_booking(context.bot, booking_id, user.id, name, equipment, date, duration)
+    return ConversationHandler.END
+
 
+async def announce_booking(bot, booking_id: int, user_id: int, name: str, equipment: str, date: str, duration: str):
     await notify_admins(
-        context.bot,
+        bot,
         (
             f"📢 *New booking request* (ID: {booking_id})\n"
-            f"User: {name} (`{user.id}`)\n"
+            f"User: {name} (`{user_id}`)\n"
             f"Equipment: {equipment}\n"
             f"Date: {date}\n"
             f"Duration: {duration}\n\n"
             f"`/booking_approve {booking_id}`\n"
             f"`/booking_reject {booking_id}`"
         ),
+        admins.BOOKING,
     )
-    return ConversationHandler.END
+
+
+async def replay_booking(bot, user_id: int, payload: dict):
+    """Spooled booking request (see spool.py), once the database is back."""
+    name, equipment, date, duration = payload["name"], payload["equipment"], payload["date"], payload["duration"]
+    booking_id = await asyncio.to_thread(
+        add_booking, user_id, name, equipment, date, duration, payload.get("request_key")
+    )
+    await notify_user_safely(
+        bot, user_id, f"✅ Your saved booking request for {equipment} on {date} is now submitted (ID: {booking_id})."
+    )
+    await announce_booking(bot, booking_id, user_id, name, equipment, date, duration)
+
+
+spool.register("booking", replay_booking)
 
 
 async def cancel_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -541,35 +848,20 @@ async def cancel_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ---------------- BOOKING ADMIN ----------------
-@restricted
+@admin_only(admins.BOOKING)
 async def booking_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ Not authorized.")
-        return
-
-    pending_list = get_pending_bookings()
-    if not pending_list:
-        await update.message.reply_text("✅ No pending bookings.")
-        return
-
-    msg = "*Pending Bookings:*\n"
-    for b in pending_list:
-        msg += f"- ID {b[0]}: {b[2] or 'Unknown'} (UID {b[1]}) — {b[3]} on {b[4]} ({b[5]})\n"
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    await update.message.reply_text(listings.pending_bookings(), parse_mode="Markdown")
 
 
-@restricted
+@admin_only(admins.BOOKING)
 async def booking_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ Not authorized.")
-        return
     try:
         booking_id = int(context.args[0])
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Usage: /booking_approve <booking_id>")
         return
 
-    user_id = approve_booking_db(booking_id)
+    user_id = await asyncio.to_thread(approve_booking_db, booking_id)
     if user_id:
         user_notified = await notify_user_safely(
             context.bot,
@@ -582,18 +874,15 @@ async def booking_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Booking not found or already processed.")
 
 
-@restricted
+@admin_only(admins.BOOKING)
 async def booking_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ Not authorized.")
-        return
     try:
         booking_id = int(context.args[0])
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Usage: /booking_reject <booking_id>")
         return
 
-    user_id = reject_booking_db(booking_id)
+    user_id = await asyncio.to_thread(reject_booking_db, booking_id)
     if user_id:
         user_notified = await notify_user_safely(
             context.bot,
@@ -606,42 +895,213 @@ async def booking_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Booking not found or already processed.")
 
 
-@restricted
+@admin_only(admins.BOOKING)
 async def daily_bookings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ Not authorized.")
+    await update.message.reply_text(listings.daily_bookings(), parse_mode="Markdown")
+
+
+@admin_only(admins.BOOKING)
+async def all_daily_bookings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(listings.all_daily_bookings(), parse_mode="Markdown")
+
+
+CALENDAR_USAGE = "⚠️ Usage: /calendar [next | last | +N | -N | YYYY-MM-DD]"
+
+
+def _calendar_markup(monday) -> InlineKeyboardMarkup:
+    prev_week = monday - timedelta(weeks=1)
+    next_week = monday + timedelta(weeks=1)
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("◀️ Prev", callback_data=f"cal:{prev_week.isoformat()}"),
+        InlineKeyboardButton("Next ▶️", callback_data=f"cal:{next_week.isoformat()}"),
+    ]])
+
+
+@admin_only(admins.BOOKING)
+async def calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    monday = calendar_view.parse_week(" ".join(context.args or []), datetime.utcnow().date())
+    if monday is None:
+        await update.message.reply_text(CALENDAR_USAGE)
+        return
+    text = await asyncio.to_thread(calendar_view.week_calendar, monday)
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=_calendar_markup(monday))
+
+
+@admin_only(admins.BOOKING)
+async def calendar_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    monday = calendar_view.parse_week(query.data.split(":", 1)[1], datetime.utcnow().date())
+    if monday is None:
+        await query.answer()
         return
-    bookings = get_daily_bookings()
-    if not bookings:
-        await update.message.reply_text("✅ No approved bookings today.")
+    await query.answer()
+    text = await asyncio.to_thread(calendar_view.week_calendar, monday)
+    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=_calendar_markup(monday))
+
+
+@admin_only(admins.SUPER)
+async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = query_stats()
+    if not stats:
+        await update.message.reply_text("✅ No queries executed yet.")
         return
-    msg = "📋 *Today's Approved Bookings:*\n\n"
-    for b in bookings:
-        msg += f"• ID {b[0]}: {b[2]} — {b[3]} ({b[4]})\n"
+    msg = "📊 *Query executions:*\n\n"
+    for name, count in stats.items():
+        msg += f"• `{name}`: {count}\n"
+    group_commit = writer_stats()
+    if group_commit:
+        msg += (
+            f"\n✍️ *Group commit:* {group_commit['writes']} writes in "
+            f"{group_commit['batches']} commits (avg batch {group_commit['avg_batch']})\n"
+        )
+    units = unit_stats()
+    if units:
+        msg += (
+            f"\n🧾 *Unit of work:* {units['units']} updates, {units['commits']} commits, "
+            f"{units['rollbacks']} rollbacks, {units['connects']} connections opened ({units['idle']} idle)\n"
+        )
+    changes = invalidation.stats()
+    if changes:
+        msg += (
+            f"\n🔔 *Change listener* ({changes['backend']}): "
+            f"{changes['events']} events, {changes['resets']} resets\n"
+        )
+        cal = calendar_view.cache_stats()
+        msg += f"📅 *Calendar cache:* {cal['weeks']} weeks, {cal['hits']} hits / {cal['misses']} misses\n"
+        listed = listings.stats()
+        msg += (
+            f"📋 *Listing cache:* {listed['entries']} entries, {listed['hits']} hits / {listed['misses']} misses, "
+            f"{listed['evicted']} evicted\n"
+        )
+    replica = replica_stats()
+    if replica:
+        state = "✅ in use" if replica["healthy"] else "⚠️ unreachable, reading from primary"
+        if replica["healthy"] and replica["lag"] > REPLICA_MAX_LAG_SECONDS:
+            state = f"⚠️ lagging {replica['lag']:.1f}s, reading from primary"
+        msg += (
+            f"\n🪞 *Read replica:* {state}\n"
+            f"reads: {replica['replica']} replica / {replica['primary']} primary, "
+            f"{replica['fallbacks']} mid-query fallbacks\n"
+        )
+    memory = sessions.gauges(context.application)
+    msg += (
+        f"\n🧠 *Per-user state:* {memory['user_data']} users, {memory['chat_data']} chats, "
+        f"{memory['conversations']} open conversations\n"
+    )
+    expiry = maintenance.stats()
+    msg += (
+        f"⌛ *Expiry:* {expiry['bookings']} bookings, {expiry['registrations']} registrations "
+        f"in {expiry['runs']} runs ({expiry['notified']} notified, {expiry['notify_failed']} failed)\n"
+    )
+    due = reminders.stats()
+    msg += (
+        f"⏰ *Reminders:* {due['scheduled']} in the current window, {due['sent']} sent, "
+        f"{due['failed']} failed, {due['late_dropped']} dropped as too late\n"
+    )
+    breaker, spooled = circuit.db.stats(), spool.stats()
+    msg += (
+        f"🛡️ *DB breaker:* {breaker['state']}, opened {breaker['opened']}x, {breaker['rejected']} calls rejected; "
+        f"spool: {spooled['waiting']} waiting, {spooled['replayed']} replayed, {spooled['dropped']} dropped\n"
+    )
+    traces = tracing.stats()
+    msg += (
+        f"🔎 *Tracing:* {traces['traces']} updates, {traces['slow']} slow (>{tracing.TRACE_SLOW_MS:.0f} ms), "
+        f"{traces['sampled']} sampled, {traces['exported']} exported, {traces['dropped']} dropped\n"
+    )
+    backups = backup.stats()
+    if backups["snapshots"] or backups["failed"]:
+        msg += (
+            f"💾 *Backups:* {backups['snapshots']} taken, {backups['failed']} failed, "
+            f"{backups['restarts']} restarts; last {backups['last_at'] or '-'}\n"
+        )
+    if capture.enabled():
+        captured = capture.stats()
+        msg += f"🎥 *Capture:* {captured['captured']} updates recorded, {captured['failed']} failed\n"
+    limiter = context.bot.rate_limiter
+    if isinstance(limiter, (outbound.OutboundScheduler, outbound.TenantLane)):
+        msg += "\n📤 *Outbound* (sent/failed/retried, queued, p50/p95):\n"
+        for name, s in limiter.stats().items():
+            msg += (
+                f"• {name}: {s['sent']}/{s['failed']}/{s['retried']}, "
+                f"{s['queued']} queued, {s['p50_ms']}/{s['p95_ms']} ms\n"
+            )
     await update.message.reply_text(msg, parse_mode="Markdown")
 
 
-@restricted
-async def all_daily_bookings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ Not authorized.")
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
+
+async def _run_profile(bot, chat_id: int, seconds: int):
+    result = await profiler.profile_for(seconds)
+    if result is None:
+        await bot.send_message(chat_id=chat_id, text="⚠️ A profile is already running.")
         return
-    bookings = get_all_daily_bookings()
-    if not bookings:
-        await update.message.reply_text("✅ No bookings today.")
+    if not result.samples:
+        await bot.send_message(chat_id=chat_id, text="⚠️ Profile finished but collected no samples.")
         return
-    msg = "📋 *All Today's Bookings:*\n\n"
-    for b in bookings:
-        icon = "✅" if b[5] == "approved" else "⏳" if b[5] == "pending" else "❌"
-        msg += f"{icon} ID {b[0]}: {b[2]} — {b[3]} ({b[4]}) [{b[5]}]\n"
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    output = io.BytesIO(result.collapsed().encode("utf-8"))
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    await bot.send_document(
+        chat_id=chat_id,
+        document=InputFile(output, filename=f"profile-{stamp}.folded"),
+        caption=(
+            f"🔥 {result.sample_count} samples over {seconds}s.\n"
+            "Collapsed stacks: open in speedscope.app or run flamegraph.pl on it."
+        ),
+    )
 
-@restricted
-async def start_user_reject_with_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("You are not authorized.")
-        return ConversationHandler.END
 
+@admin_only(admins.SUPER)
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("⚠️ Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    # Run in the background so this update doesn't hold up the ones being profiled
+    context.application.create_task(_run_profile(context.bot, update.effective_chat.id, seconds))
+    await update.message.reply_text(f"🔬 Profiling for {seconds}s, the file will follow.")
+
+
+# Telegram bots can upload documents up to 50 MB
+BACKUP_UPLOAD_MAX_BYTES = 45 * 1024 * 1024
+
+
+@admin_only(admins.SUPER)
+async def backup_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args and context.args[0] == "list":
+        snapshots = backup.list_snapshots()
+        if not snapshots:
+            await update.message.reply_text("✅ No snapshots yet.")
+            return
+        msg = "*Snapshots* (newest first):\n"
+        for path in snapshots:
+            msg += f"- `{os.path.basename(path)}` — {os.path.getsize(path) // 1024} KB\n"
+        await update.message.reply_text(msg, parse_mode="Markdown")
+        return
+
+    await update.message.reply_text("💾 Taking a snapshot...")
+    try:
+        snap = await asyncio.to_thread(backup.snapshot)
+    except backup.BackupError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    counts = ", ".join(f"{table}: {n}" for table, n in snap.counts.items())
+    summary = f"✅ Snapshot {os.path.basename(snap.path)} ({snap.size // 1024} KB, {snap.seconds:.1f}s)\n{counts}"
+    if snap.size > BACKUP_UPLOAD_MAX_BYTES:
+        await update.message.reply_text(summary + "\n\n⚠️ Too large to send here; it's on the server.")
+        return
+    # A copy in the admin's chat survives losing the server's disk
+    with open(snap.path, "rb") as f:
+        await update.message.reply_document(
+            document=InputFile(f, filename=os.path.basename(snap.path)), caption=summary
+        )
+
+
+@admin_only(admins.REGISTRATION)
+async def start_user_reject_with_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = int(context.args[0])
     except (IndexError, ValueError):
@@ -653,12 +1113,8 @@ async def start_user_reject_with_reason(update: Update, context: ContextTypes.DE
     return ASK_REJECTION_REASON
 
 
-@restricted
+@admin_only(admins.BOOKING)
 async def start_booking_reject_with_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("Not authorized.")
-        return ConversationHandler.END
-
     try:
         booking_id = int(context.args[0])
     except (IndexError, ValueError):
@@ -686,7 +1142,9 @@ async def submit_rejection_reason(update: Update, context: ContextTypes.DEFAULT_
     context.user_data.pop("pending_rejection", None)
 
     if rejection_type == "registration":
-        reject_user(target_id)
+        if not await asyncio.to_thread(reject_user, target_id):
+            await update.message.reply_text("User not found in pending list.")
+            return ConversationHandler.END
         user_notified = await notify_user_safely(
             context.bot,
             target_id,
@@ -697,7 +1155,7 @@ async def submit_rejection_reason(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
 
     if rejection_type == "booking":
-        user_id = reject_booking_db(target_id)
+        user_id = await asyncio.to_thread(reject_booking_db, target_id)
         if user_id:
             user_notified = await notify_user_safely(
                 context.bot,
@@ -731,12 +1189,8 @@ async def aunty_location_received(update: Update, context: ContextTypes.DEFAULT_
     user = update.effective_user
     location_msg = update.message.text
 
-    report_id = f"aunty_{user.id}_{datetime.utcnow().timestamp()}"
-    pending_aunty_reports[report_id] = {
-        "location": location_msg,
-        "reporter_id": user.id,
-        "reporter_name": user.full_name or "Unknown",
-    }
+    reporter_name = user.full_name or "Unknown"
+    report_id = await asyncio.to_thread(add_aunty_report, user.id, reporter_name, location_msg)
 
     keyboard = [[
         InlineKeyboardButton("✅ Broadcast", callback_data=f"broadcast_aunty_{report_id}"),
@@ -745,48 +1199,157 @@ async def aunty_location_received(update: Update, context: ContextTypes.DEFAULT_
 
     admin_msg = (
         f"🚨 *Hall Aunty Spotted!*\n\n"
-        f"Reporter: {pending_aunty_reports[report_id]['reporter_name']} (ID: {user.id})\n"
+        f"Reporter: {reporter_name} (ID: {user.id})\n"
         f"Location: {location_msg}"
     )
 
-    await notify_admins(context.bot, admin_msg)
+    await notify_admins(context.bot, admin_msg, admins.SUPER, reply_markup=InlineKeyboardMarkup(keyboard))
     await update.message.reply_text("✅ Report sent to admin for verification!")
     return ConversationHandler.END
 
 
+@admin_only(admins.SUPER)
+async def aunty_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """✅ Broadcast / ❌ Reject on a Hall Aunty report (broadcast_aunty_<id> / reject_aunty_<id>)."""
+    query = update.callback_query
+    action, report_id = query.data.split("_aunty_", 1)
+    status = "broadcast" if action == "broadcast" else "rejected"
+    report = await asyncio.to_thread(resolve_aunty_report, int(report_id), status)
+    if report is None:
+        await query.answer("Already handled by another admin.", show_alert=True)
+        return
+    await query.answer()
+    _, _, location = report
+    admin_name = update.effective_user.full_name or "an admin"
+
+    if status == "rejected":
+        await query.edit_message_text(f"{query.message.text}\n\n❌ Rejected by {admin_name}.")
+        return
+    await query.edit_message_text(f"{query.message.text}\n\n📢 Broadcasting (approved by {admin_name})...")
+    # Plain text: the location is the reporter's own words
+    sent, failed = await _fan_out(
+        context.bot, Segment("all"), f"🚨 Hall Aunty spotted!\n📍 {location}", parse_mode=None
+    )
+    outcome = f"✅ Broadcast to {sent} users by {admin_name}." + (f" ❌ {failed} failed." if failed else "")
+    await query.edit_message_text(f"{query.message.text}\n\n{outcome}")
+
+
 async def cancel_enemy_spotted(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Report cancelled.")
     return ConversationHandler.END
 
 
+# ---------- ROSTER IMPORT --------
+ROSTER_REJECTED_PREVIEW = 10
+
+
+@admin_only(admins.REGISTRATION)
+async def start_roster_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "📥 Send the roster as a .csv or .xlsx file with the columns "
+        "User ID, Name, Block, Room (same as /export).\n"
+        "Existing residents are updated, new ones registered. /cancel to stop."
+    )
+    return ASK_ROSTER_FILE
+
+
+async def roster_file_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    tg_file = await document.get_file()
+    data = bytes(await tg_file.download_as_bytearray())
+    await update.message.reply_text("⏳ Importing roster...")
+    try:
+        result = await asyncio.to_thread(roster.import_roster, data, document.file_name or "", valid_blocks())
+    except roster.RosterError as e:
+        await update.message.reply_text(f"❌ {e} Send a corrected file or /cancel.")
+        return ASK_ROSTER_FILE
+
+    msg = (
+        f"✅ Roster imported ({result.total} rows)\n\n"
+        f"🆕 Inserted: {len(result.inserted)}\n"
+        f"✏️ Updated: {len(result.updated)}\n"
+        f"➖ Unchanged: {len(result.unchanged)}\n"
+        f"❌ Rejected: {len(result.rejected)}"
+    )
+    for line, raw_id, reason in result.rejected[:ROSTER_REJECTED_PREVIEW]:
+        msg += f"\n• line {line} ({raw_id or 'no id'}): {reason}"
+    if len(result.rejected) > ROSTER_REJECTED_PREVIEW:
+        msg += f"\n…and {len(result.rejected) - ROSTER_REJECTED_PREVIEW} more, see the report."
+    await update.message.reply_text(msg)
+    await context.bot.send_document(
+        chat_id=update.effective_chat.id,
+        document=InputFile(io.BytesIO(roster.report_csv(result)), filename="roster_import_report.csv"),
+    )
+    return ConversationHandler.END
+
+
+async def roster_not_a_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("📎 Please send the roster as a file (.csv or .xlsx), or /cancel.")
+    return ASK_ROSTER_FILE
+
+
+async def cancel_roster_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("❌ Roster import cancelled.")
+    return ConversationHandler.END
+
+
 # ---------- BROADCAST MESSAGE --------
-@restricted
+BROADCAST_USAGE = (
+    "⚠️ Usage:\n"
+    "/broadcast — everyone\n"
+    "/broadcast <Purple|Orange|Green|Blue> — one block\n"
+    "/broadcast joined <YYYY-MM-DD> [YYYY-MM-DD] — registered in that date range\n"
+    "/broadcast list <name> — a saved list (see /lists)"
+)
+
+
+def _parse_segment(args) -> Optional[Segment]:
+    """Parse /broadcast arguments into a Segment, or None if they don't make sense."""
+    if not args:
+        return Segment("all")
+    head = args[0].lower()
+    if head == "block" and len(args) == 2:
+        args = args[1:]
+        head = args[0].lower()
+    blocks = {b.lower(): b for b in valid_blocks()}
+    if len(args) == 1 and head in blocks:
+        return Segment("block", blocks[head])
+    if head == "joined" and len(args) in (2, 3):
+        try:
+            start = datetime.strptime(args[1], "%Y-%m-%d").date()
+            end = datetime.strptime(args[2], "%Y-%m-%d").date() if len(args) == 3 else datetime.utcnow().date()
+        except ValueError:
+            return None
+        # end date is inclusive for admins, exclusive in the query
+        return Segment("joined", (start.isoformat(), (end + timedelta(days=1)).isoformat()))
+    if head == "list" and len(args) == 2:
+        return Segment("list", args[1])
+    return None
+
+
+@admin_only(admins.SUPER)
 async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        await update.message.reply_text("❌ You are not authorized.")
+    segment = _parse_segment(context.args or [])
+    if segment is None:
+        await update.message.reply_text(BROADCAST_USAGE)
         return ConversationHandler.END
-    await update.message.reply_text("📢 Enter the message you want to broadcast to all users:")
+    context.user_data["broadcast_segment"] = segment
+    await update.message.reply_text(f"📢 Enter the message you want to broadcast to {segment.label}:")
     return ASK_BROADCAST_MESSAGE
 
 
 async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_text = update.message.text
+    segment = context.user_data.pop("broadcast_segment", None) or Segment("all")
 
-    users = get_registered_users()
-    if not users:
-        await update.message.reply_text("⚠️ No registered users to broadcast to.")
+    total = await asyncio.to_thread(count_segment, segment)
+    if not total:
+        await update.message.reply_text(f"⚠️ No registered users in {segment.label} to broadcast to.")
         return ConversationHandler.END
 
-    await update.message.reply_text(f"📢 Broadcasting message to {len(users)} users...")
+    await update.message.reply_text(f"📢 Broadcasting message to {total} users ({segment.label})...")
 
-    sent_count = 0
-    failed_count = 0
-    for user in users:
-        try:
-            await context.bot.send_message(chat_id=user[0], text=message_text, parse_mode="Markdown")
-            sent_count += 1
-        except Exception:
-            failed_count += 1
+    sent_count, failed_count = await _fan_out(context.bot, segment, message_text)
 
     summary = f"✅ Broadcast complete!\n\n📬 Sent to: {sent_count} users"
     if failed_count > 0:
@@ -796,107 +1359,158 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def _fan_out(bot, segment: Segment, text: str, parse_mode: Optional[str] = "Markdown") -> Tuple[int, int]:
+    """Send text to everyone in segment; returns (sent, failed)."""
+    sent_count = 0
+    failed_count = 0
+    pages = iter_segment_user_ids(segment)
+    while True:
+        # Each page's query runs in a worker thread, not on the event loop
+        batch = await asyncio.to_thread(next, pages, None)
+        if batch is None:
+            break
+        # Queued at bulk priority: the outbound scheduler paces them and lets alerts/replies go first
+        results = await asyncio.gather(
+            *(
+                bot.send_message(chat_id=user_id, text=text, parse_mode=parse_mode, rate_limit_args=outbound.BULK)
+                for user_id in batch
+            ),
+            return_exceptions=True,
+        )
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        sent_count += len(results) - failed
+        failed_count += failed
+    return sent_count, failed_count
+
+
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop("broadcast_segment", None)
     await update.message.reply_text("❌ Broadcast cancelled.")
     return ConversationHandler.END
 
 
+def _parse_list_args(args):
+    try:
+        return args[0], [int(x) for x in args[1:]] or None
+    except (IndexError, ValueError):
+        return None, None
+
+
+@admin_only(admins.SUPER)
+async def list_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    name, user_ids = _parse_list_args(context.args)
+    if not user_ids:
+        await update.message.reply_text("⚠️ Usage: /list_add <name> <user_id> [user_id ...]")
+        return
+    await asyncio.to_thread(add_to_broadcast_list, name, user_ids)
+    await update.message.reply_text(f"✅ Added {len(user_ids)} user(s) to list '{name}'.")
+
+
+@admin_only(admins.SUPER)
+async def list_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    name, user_ids = _parse_list_args(context.args)
+    if not user_ids:
+        await update.message.reply_text("⚠️ Usage: /list_remove <name> <user_id> [user_id ...]")
+        return
+    await asyncio.to_thread(remove_from_broadcast_list, name, user_ids)
+    await update.message.reply_text(f"🗑️ Removed {len(user_ids)} user(s) from list '{name}'.")
+
+
+@admin_only(admins.SUPER)
+async def lists(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    saved = await asyncio.to_thread(get_broadcast_lists)
+    if not saved:
+        await update.message.reply_text("✅ No saved broadcast lists.")
+        return
+    msg = "*Saved broadcast lists:*\n"
+    for name, count in saved:
+        msg += f"- `{name}` — {count} users\n"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+
 # ---------------- INLINE BUTTONS ----------------
-@restricted
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
+    route = content.route(query.data)
 
-    # Committee -> photo
-    if query.data in COMMITTEES:
-        committee = COMMITTEES[query.data]
-        await query.edit_message_text("Loading committee info...")
-        local_photo_path = COMMITTEE_PHOTOS.get(query.data)
-
-        if local_photo_path and os.path.exists(local_photo_path):
-            with open(local_photo_path, "rb") as photo_file:
-                await context.bot.send_photo(
-                    chat_id=query.message.chat_id,
-                    photo=photo_file,
-                    caption=committee["description"],
-                    parse_mode="Markdown",
-                )
-            return
-
-        try:
-            await context.bot.send_photo(
-                chat_id=query.message.chat_id,
-                photo=committee["photo_url"],
-                caption=committee["description"],
-                parse_mode="Markdown",
-            )
-        except Exception:
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=committee["description"],
-                parse_mode="Markdown",
-            )
+    # Public content skips the registration DB checks entirely
+    if (route is None or not route.public) and not await registration_gate(update):
         return
+    await query.answer()
 
-    # Food menus
-    if query.data in CANTEEN_MENUS:
-        canteen = CANTEEN_MENUS[query.data]
-        food_list = "\n".join([f"• {food}" for food in canteen["food"]])
-        message = f"{canteen['name']}\n\n📋 *Food Options:*\n{food_list}"
-        await query.edit_message_text(message, parse_mode="Markdown")
+    if route is None:
         return
-
-    if query.data == "food_near_hall":
-        keyboard = [
-            [InlineKeyboardButton("🏫 Canteen 1", callback_data="canteen_1"),
-             InlineKeyboardButton("🏫 Canteen 2", callback_data="canteen_2")],
-            [InlineKeyboardButton("🏫 Canteen 4", callback_data="canteen_4"),
-             InlineKeyboardButton("☕ Crespion", callback_data="crespion")],
-            [InlineKeyboardButton("🍽️ South Spine", callback_data="south_spine")],
-        ]
-        await query.edit_message_text("🍽 Select a canteen to explore:", reply_markup=InlineKeyboardMarkup(keyboard))
+    if route.kind == "committee":
+        await send_committee_card(query, context, route.payload)
         return
 
-    responses = {
-        "supper_nearby": (
-            "🍜 *Supper Spots Nearby:*\n\n"
-            "• [Extension](https://maps.app.goo.gl/56sPvRMdJPujKLzb7)\n"
-            "• [Nearby Prata Shop](https://maps.app.goo.gl/d3A4HLFudtiPQQKP6)"
-        ),
-        "supper_channels": (
-            "🔗 *Supper Telegram Channels:*\n\n"
-            "• [GigabiteNTU](https://t.me/GigabiteNTU)\n"
-            "• [DingoNTU](https://t.me/dingontu)\n"
-            "• [UrMomsCooking](https://t.me/urmomscooking)\n"
-            "• [NomAtNTU](https://t.me/NomAtNTU)\n"
-            "• [AnAcaiAffairXNTU](https://t.me/AnAcaiAffairXNTU)"
-        ),
-        "grab_options": (
-            "🍔 *Popular GrabFood Options:*\n\n"
-            "• McDonald's Jurong West\n"
-            "• Bai Li Xiang\n"
-            "• Kimly Dim Sum\n"
-            "• Ah Long's Pancake\n"
-            "• Western Food"
-        ),
-    }
+    page = route.payload
+    await query.edit_message_text(page.text, parse_mode=page.parse_mode, reply_markup=page.reply_markup)
 
-    if query.data in responses:
-        await query.edit_message_text(responses[query.data], parse_mode="Markdown")
 
+# ---------------- ERRORS ----------------
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Tell the user when a handler failed because the database is down; log anything else."""
+    if isinstance(context.error, DatabaseUnavailable):
+        if isinstance(update, Update) and update.effective_message is not None:
+            try:
+                await update.effective_message.reply_text(DB_DOWN_MESSAGE)
+            except Exception:
+                pass
+        return
+    logger.error("Error while handling an update", exc_info=context.error)
 
-# ---------------- MAIN ----------------
-def main():
-    init_db()
-    init_booking_db()
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-    app.post_init = set_bot_commands
+# ---------------- MAIN ----------------
+def build_application(
+    with_updater: bool = True,
+    tenant: Optional[tenancy.Tenant] = None,
+    scheduler: Optional[outbound.OutboundScheduler] = None,
+    request: Optional[BaseRequest] = None,
+):
+    """
+    Application with every handler registered. Cluster workers pass
+    with_updater=False and feed updates in via process_update(). In
+    multi-tenant mode each tenant's Application gets a lane of the shared
+    outbound scheduler and runs its updates and jobs with the tenant bound.
+    Either way every update is traced (see tracing.py). replay.py passes
+    its fake Bot API as `request`.
+    """
+    builder = (
+        ApplicationBuilder()
+        .concurrent_updates(CONCURRENT_UPDATES if CONCURRENT_UPDATES > 1 else False)
+        # Same pool size as PTB's default request; getUpdates stays untraced
+        .request(request or tracing.TracedRequest(connection_pool_size=256))
+    )
+    if tenant is None:
+        # Telegram's global limit is per bot, so cluster workers split it
+        workers = max(1, WORKER_PROCESSES)
+        builder = (
+            builder.token(BOT_TOKEN)
+            .application_class(unitofwork.UnitOfWorkApplication)
+            .rate_limiter(outbound.OutboundScheduler(
+                global_rate=outbound.GLOBAL_RATE / workers,
+                global_burst=max(1.0, outbound.GLOBAL_BURST / workers),
+            ))
+        )
+    else:
+        builder = (
+            builder.token(tenant.token)
+            .application_class(tenancy.TenantApplication, kwargs={"tenant": tenant})
+            .job_queue(tenancy.TenantJobQueue())
+            .rate_limiter((scheduler or outbound.OutboundScheduler()).lane(tenant.id))
+        )
+    if not with_updater:
+        builder = builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
 
     app.add_handler(CommandHandler("food", food))
+    app.add_handler(CallbackQueryHandler(find_page, pattern=r"^find_page:"))
+    app.add_handler(CallbackQueryHandler(calendar_page, pattern=r"^cal:"))
+    app.add_handler(CallbackQueryHandler(aunty_decision, pattern=r"^(broadcast|reject)_aunty_\d+$"))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(CommandHandler("groups", groups))
     app.add_handler(CommandHandler("committees", show_committees))
@@ -907,16 +1521,40 @@ def main():
             ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_block)],
             ASK_BLOCK: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_room)],
             ASK_ROOM: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_user)],
+            ConversationHandler.TIMEOUT: [
+                sessions.timeout_handler(("name", "block"), "⌛ Registration timed out. Send /register to start again.")
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=sessions.conversation_timeout("register"),
     )
     app.add_handler(register_conv)
 
     app.add_handler(CommandHandler("approve", approve))
     app.add_handler(CommandHandler("pending", pending))
     app.add_handler(CommandHandler("remove", remove))
+    app.add_handler(CommandHandler("admins", list_admins))
+    app.add_handler(CommandHandler("grant", grant_role))
+    app.add_handler(CommandHandler("revoke", revoke_role))
     app.add_handler(CommandHandler("export", export))
     app.add_handler(CommandHandler("export_pending", export_pending))
+    app.add_handler(CommandHandler("find", find))
+
+    roster_conv = ConversationHandler(
+        entry_points=[CommandHandler("import_roster", start_roster_import)],
+        states={
+            ASK_ROSTER_FILE: [
+                MessageHandler(filters.Document.ALL, roster_file_received),
+                MessageHandler(~filters.COMMAND, roster_not_a_file),
+            ],
+            ConversationHandler.TIMEOUT: [
+                sessions.timeout_handler((), "⌛ Roster import timed out. Send /import_roster to try again.")
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_roster_import)],
+        conversation_timeout=sessions.conversation_timeout("import_roster"),
+    )
+    app.add_handler(roster_conv)
 
     booking_conv = ConversationHandler(
         entry_points=[CommandHandler("book", start_booking)],
@@ -924,8 +1562,12 @@ def main():
             ASK_EQUIP: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_date)],
             ASK_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_duration)],
             ASK_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_booking)],
+            ConversationHandler.TIMEOUT: [
+                sessions.timeout_handler(("equipment", "date"), "⌛ Booking timed out. Send /book to start again.")
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel_booking)],
+        conversation_timeout=sessions.conversation_timeout("book"),
     )
     app.add_handler(booking_conv)
 
@@ -936,8 +1578,12 @@ def main():
         ],
         states={
             ASK_REJECTION_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, submit_rejection_reason)],
+            ConversationHandler.TIMEOUT: [
+                sessions.timeout_handler(("pending_rejection",), "⌛ Rejection timed out; nothing was rejected.")
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel_rejection)],
+        conversation_timeout=sessions.conversation_timeout("reject"),
     )
     app.add_handler(rejection_conv)
 
@@ -945,21 +1591,116 @@ def main():
     app.add_handler(CommandHandler("booking_approve", booking_approve))
     app.add_handler(CommandHandler("daily_bookings", daily_bookings_cmd))
     app.add_handler(CommandHandler("all_daily_bookings", all_daily_bookings_cmd))
+    app.add_handler(CommandHandler("calendar", calendar))
+    app.add_handler(CommandHandler("dbstats", dbstats))
+    app.add_handler(CommandHandler("profile", profile))
+    app.add_handler(CommandHandler("backup", backup_now))
 
     enemy_spotted_conv = ConversationHandler(
         entry_points=[CommandHandler("enemyspotted", enemy_spotted)],
-        states={ASK_AUNTY_LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, aunty_location_received)]},
+        states={
+            ASK_AUNTY_LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, aunty_location_received)],
+            ConversationHandler.TIMEOUT: [
+                sessions.timeout_handler((), "⌛ Report timed out. Send /enemyspotted to try again.")
+            ],
+        },
         fallbacks=[CommandHandler("cancel", cancel_enemy_spotted)],
+        conversation_timeout=sessions.conversation_timeout("enemyspotted"),
     )
     app.add_handler(enemy_spotted_conv)
 
     broadcast_conv = ConversationHandler(
         entry_points=[CommandHandler("broadcast", start_broadcast)],
-        states={ASK_BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast)]},
+        states={
+            ASK_BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast)],
+            ConversationHandler.TIMEOUT: [
+                sessions.timeout_handler(("broadcast_segment",), "⌛ Broadcast timed out; nothing was sent.")
+            ],
+        },
         fallbacks=[CommandHandler("cancel", cancel_broadcast)],
+        conversation_timeout=sessions.conversation_timeout("broadcast"),
     )
     app.add_handler(broadcast_conv)
+    app.add_handler(CommandHandler("lists", lists))
+    app.add_handler(CommandHandler("list_add", list_add))
+    app.add_handler(CommandHandler("list_remove", list_remove))
+
+    sessions.install(
+        app, [register_conv, roster_conv, booking_conv, rejection_conv, enemy_spotted_conv, broadcast_conv]
+    )
+    maintenance.install(app)
+    reminders.install(app)
+    spool.install(app)
+    backup.install(app)
+    capture.install(app, lambda: valid_blocks() + equipments())
+    app.add_error_handler(on_error)
+    return app
+
+
+async def _serve_tenants(apps: list):
+    """Run every tenant's Application in this event loop until SIGINT/SIGTERM."""
+    import signal
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    started = []
+    try:
+        for app in apps:
+            with tenancy.use(app.tenant):
+                await app.initialize()
+                started.append(app)
+                await set_bot_commands(app)
+                await app.updater.start_polling()
+                await app.start()
+        await stop.wait()
+    finally:
+        for app in reversed(started):
+            with tenancy.use(app.tenant):
+                if app.updater.running:
+                    await app.updater.stop()
+                if app.running:
+                    await app.stop()
+                await app.shutdown()
+
+
+def run_tenants():
+    from database import DB_PATH
+
+    tenants = tenancy.load(tenancy.TENANTS_FILE, default_dir=os.path.dirname(os.path.abspath(DB_PATH)))
+    for tenant in tenants:
+        with tenancy.use(tenant):
+            init_db()
+            init_booking_db()
+            content.current()  # fail fast on a broken content file
+    invalidation.start()
+
+    scheduler = outbound.OutboundScheduler()
+    apps = [build_application(tenant=tenant, scheduler=scheduler) for tenant in tenants]
+    asyncio.run(_serve_tenants(apps))
+
 
+def main():
+    if tenancy.TENANTS_FILE:
+        if WORKER_PROCESSES > 1:
+            raise ValueError("❌ TENANTS_FILE can't be combined with WORKER_PROCESSES > 1.")
+        run_tenants()
+        return
+
+    if WORKER_PROCESSES > 1:
+        import cluster
+
+        cluster.run(WORKER_PROCESSES)
+        return
+
+    init_db()
+    init_booking_db()
+    content.current()  # fail fast on a broken content file
+    invalidation.start()
+
+    app = build_application()
+    app.post_init = set_bot_commands
     app.run_polling(close_loop=False)
 
 
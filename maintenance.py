@@ -0,0 +1,95 @@
+"""
+Scheduled expiry of stale requests.
+
+Nothing else ever moves a booking for a date that has passed out of
+'pending', or clears a registration nobody approved, so /booking_pending
+and /pending would keep growing for as long as the bot runs. A JobQueue
+job every EXPIRY_INTERVAL seconds:
+
+- marks pending bookings dated before today as 'expired',
+- drops pending registrations older than PENDING_REGISTRATION_TTL_DAYS
+  (0 keeps them forever),
+
+in batches of EXPIRY_BATCH_SIZE, one short write transaction each, and
+(unless EXPIRY_NOTIFY_USERS=0) tells the affected users at bulk priority.
+Rows are claimed atomically, so cluster workers all running the job never
+expire or notify the same row twice.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from telegram.ext import Application, ContextTypes
+
+import outbound
+from booking import expire_past_pending_bookings
+from database import expire_pending_users
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+EXPIRY_INTERVAL = float(os.getenv("EXPIRY_INTERVAL", "3600"))
+PENDING_REGISTRATION_TTL_DAYS = float(os.getenv("PENDING_REGISTRATION_TTL_DAYS", "14"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "200"))
+EXPIRY_NOTIFY_USERS = os.getenv("EXPIRY_NOTIFY_USERS", "1") != "0"
+
+_stats = {"runs": 0, "bookings": 0, "registrations": 0, "notified": 0, "notify_failed": 0}
+
+
+async def _notify(bot, messages: Iterable[Tuple[int, str]]):
+    """Send one batch of notices concurrently; the outbound scheduler paces them."""
+    results = await asyncio.gather(
+        *(bot.send_message(chat_id=uid, text=text, rate_limit_args=outbound.BULK) for uid, text in messages),
+        return_exceptions=True,
+    )
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    _stats["notified"] += len(results) - failed
+    _stats["notify_failed"] += failed
+
+
+async def expire_stale(context: ContextTypes.DEFAULT_TYPE):
+    _stats["runs"] += 1
+    bot = context.bot
+    today = date.today().isoformat()
+
+    bookings = 0
+    while True:
+        rows: List[tuple] = await asyncio.to_thread(expire_past_pending_bookings, today, EXPIRY_BATCH_SIZE)
+        bookings += len(rows)
+        if rows and EXPIRY_NOTIFY_USERS:
+            await _notify(bot, [
+                (user_id, f"⌛ Your booking (ID {booking_id}) for {equipment} on {day} expired without being approved.")
+                for booking_id, user_id, equipment, day in rows
+            ])
+        if len(rows) < EXPIRY_BATCH_SIZE:
+            break
+
+    registrations = 0
+    if PENDING_REGISTRATION_TTL_DAYS > 0:
+        ttl = timedelta(days=PENDING_REGISTRATION_TTL_DAYS)
+        while True:
+            user_ids: List[int] = await asyncio.to_thread(expire_pending_users, ttl, EXPIRY_BATCH_SIZE)
+            registrations += len(user_ids)
+            if user_ids and EXPIRY_NOTIFY_USERS:
+                await _notify(bot, [
+                    (user_id, "⌛ Your registration request expired before it was reviewed. Send /register to apply again.")
+                    for user_id in user_ids
+                ])
+            if len(user_ids) < EXPIRY_BATCH_SIZE:
+                break
+
+    _stats["bookings"] += bookings
+    _stats["registrations"] += registrations
+    if bookings or registrations:
+        logger.info("Expired %s pending bookings and %s pending registrations", bookings, registrations)
+
+
+def install(app: Application):
+    """Schedule the expiry job; the first run is shortly after startup."""
+    app.job_queue.run_repeating(expire_stale, interval=EXPIRY_INTERVAL, first=10, name="maintenance.expire_stale")
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
@@ -0,0 +1,411 @@
+"""
+Outbound scheduler: every Bot API call the Application makes goes through it.
+
+It plugs in as PTB's rate limiter (ApplicationBuilder().rate_limiter(...)),
+so replies, DMs, admin alerts and broadcasts all share one view of
+Telegram's limits:
+
+- priority classes: ALERT (admin alerts) > DIRECT (replies, approval DMs,
+  the default) > BULK (broadcasts). A broadcast never delays an alert by
+  more than the request already in flight.
+- a global token bucket (~30 msg/s per bot) and per-chat buckets (1 msg/s
+  in private chats, 20/min in groups). A chat that's out of tokens is
+  deferred without blocking other chats.
+- up to OUTBOUND_CONCURRENCY requests in flight at once.
+- RetryAfter (HTTP 429) re-queues the request after the delay Telegram
+  asks for, and holds back that chat (or everything, for chat-less calls).
+- per-class latency (queued -> sent) and outcome counters, see stats().
+
+Pick a class per call with rate_limit_args, e.g.
+    await bot.send_message(chat_id, text, rate_limit_args=outbound.BULK)
+
+Several bots (tenants, see tenancy.py) can share one scheduler: give each
+Application scheduler.lane(tenant_id) as its rate limiter. Every lane has
+its own bot bucket and chat buckets, since Telegram's limits are per bot,
+while the in-flight slots are shared. Within a priority class, lanes take
+turns (start-time fair queuing), so one hall's broadcast can't hold up
+another hall's messages, and a lane that's out of tokens is parked instead
+of stalling the others.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import database
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "28"))  # requests/second for this process
+GLOBAL_BURST = float(os.getenv("OUTBOUND_GLOBAL_BURST", "30"))
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 3.0
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", "16"))
+MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10000
+LATENCY_SAMPLES = 512
+
+
+class Priority(IntEnum):
+    # Lower runs first. Starts at 1: ExtBot drops falsy rate_limit_args.
+    ALERT = 1
+    DIRECT = 2
+    BULK = 3
+
+
+ALERT = Priority.ALERT
+DIRECT = Priority.DIRECT
+BULK = Priority.BULK
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until
+
+
+@dataclass
+class _Job:
+    priority: Priority
+    callback: Callable
+    args: Any
+    kwargs: Dict[str, Any]
+    chat_id: Optional[Any]
+    future: asyncio.Future
+    lane: str = ""
+    seq: int = 0
+    # Virtual start time: orders a class's requests fairly across lanes
+    vstart: float = 0.0
+    queued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+    # Parking key (lane, chat_id or None) that last released this job
+    woken_from: Optional[tuple] = None
+    # Caller's context, so the send runs inside the caller's trace
+    context: Optional[contextvars.Context] = None
+
+    @property
+    def order(self) -> tuple:
+        return (self.priority, self.vstart, self.seq)
+
+
+class _BotLane:
+    """Per-bot state: Telegram's global limit and the lane's fair-queuing tag."""
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.finish = 0.0
+        self.sent = 0
+
+
+class _ClassStats:
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1) if ordered else 0.0
+
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        }
+
+
+class OutboundScheduler(BaseRateLimiter):
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+        concurrency: int = OUTBOUND_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._lanes: Dict[str, _BotLane] = {}
+        # (lane, chat_id) -> bucket
+        self._chats: Dict[tuple, TokenBucket] = {}
+        # Requests for a chat (lane, chat_id) or a whole bot (lane, None) that's out
+        # of tokens wait here, in queue order, with one wake-up timer per key
+        self._parked: Dict[tuple, List[Tuple[tuple, _Job]]] = {}
+        self._wakers: Dict[tuple, asyncio.TimerHandle] = {}
+        self._stats = {p: _ClassStats() for p in Priority}
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._users = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def lane(self, name: str) -> "TenantLane":
+        """Rate limiter for one of several bots sharing this scheduler."""
+        return TenantLane(self, name)
+
+    def _bot_lane(self, name: str) -> _BotLane:
+        lane = self._lanes.get(name)
+        if lane is None:
+            lane = self._lanes[name] = _BotLane(self.global_rate, self.global_burst)
+        return lane
+
+    # ---------------- BaseRateLimiter ----------------
+    async def initialize(self) -> None:
+        if self._dispatcher is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-dispatcher")
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        self._dispatcher = None
+        # Let requests already in flight finish
+        for _ in range(self.concurrency):
+            await self._slots.acquire()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        return await self._submit("", callback, args, kwargs, endpoint, data, rate_limit_args)
+
+    async def _attach(self):
+        self._users += 1
+        await self.initialize()
+
+    async def _detach(self):
+        self._users -= 1
+        if self._users <= 0:
+            await self.shutdown()
+
+    async def _submit(self, lane: str, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Commit the update's pending writes before anyone is told about them
+        if database.unit_of_work_pending():
+            await asyncio.to_thread(database.flush_unit_of_work)
+        if self._dispatcher is None:
+            # Not initialized (e.g. a bare Bot call during startup): send directly
+            return await callback(*args, **kwargs)
+        priority = Priority(rate_limit_args) if rate_limit_args is not None else DIRECT
+        if tracing.active():
+            # Queue wait plus the send itself
+            with tracing.span("telegram " + endpoint, priority=priority.name.lower()):
+                return await self._queue_job(lane, callback, args, kwargs, data, priority)
+        return await self._queue_job(lane, callback, args, kwargs, data, priority)
+
+    async def _queue_job(self, lane: str, callback, args, kwargs, data, priority: Priority):
+        bot_lane = self._bot_lane(lane)
+        vstart = max(self._vtime, bot_lane.finish)
+        bot_lane.finish = vstart + 1
+        job = _Job(
+            priority=priority,
+            callback=callback,
+            args=args,
+            kwargs=kwargs,
+            chat_id=data.get("chat_id"),
+            future=asyncio.get_running_loop().create_future(),
+            lane=lane,
+            seq=next(self._seq),
+            vstart=vstart,
+            context=contextvars.copy_context(),
+        )
+        self._stats[priority].queued += 1
+        self._enqueue(job)
+        return await job.future
+
+    # ---------------- Scheduling ----------------
+    def _enqueue(self, job: _Job):
+        self._queue.put_nowait((job.order, job))
+
+    def _park(self, key: tuple, job: _Job, seconds: float):
+        heapq.heappush(self._parked.setdefault(key, []), (job.order, job))
+        if key not in self._wakers:
+            self._wakers[key] = asyncio.get_running_loop().call_later(seconds, self._wake, key)
+
+    def _wake(self, key: tuple):
+        """Release the key's next parked request back into the main queue."""
+        self._wakers.pop(key, None)
+        parked = self._parked.get(key)
+        if not parked:
+            self._parked.pop(key, None)
+            return
+        job = heapq.heappop(parked)[1]
+        if not parked:
+            del self._parked[key]
+        job.woken_from = key
+        self._enqueue(job)
+
+    def _rearm(self, key: tuple, bucket: TokenBucket, now: float):
+        if key in self._parked and key not in self._wakers:
+            self._wakers[key] = asyncio.get_running_loop().call_later(bucket.delay(now), self._wake, key)
+
+    def _chat_bucket(self, lane: str, chat_id) -> TokenBucket:
+        key = (lane, chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for k in [k for k, b in self._chats.items() if b.idle(now)]:
+                    del self._chats[k]
+            group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            bucket = self._chats[key] = TokenBucket(GROUP_CHAT_RATE if group else PRIVATE_CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    def _must_wait(self, key: tuple, bucket: TokenBucket, job: _Job, now: float) -> bool:
+        """Park the job behind `key` if the bucket is empty or others are already waiting on it."""
+        if key in self._parked and job.woken_from != key:
+            # Keep the key's order
+            self._park(key, job, bucket.delay(now))
+            return True
+        wait = bucket.delay(now)
+        if wait > 0:
+            self._park(key, job, wait)
+            return True
+        return False
+
+    async def _dispatch(self):
+        while True:
+            _, job = await self._queue.get()
+            if job.future.done():  # caller went away
+                self._stats[job.priority].queued -= 1
+                continue
+            now = time.monotonic()
+            bot_lane = self._bot_lane(job.lane)
+            chat_key = (job.lane, job.chat_id)
+            bot_key = (job.lane, None)
+            chat = self._chat_bucket(job.lane, job.chat_id) if job.chat_id is not None else None
+            if chat is not None and self._must_wait(chat_key, chat, job, now):
+                continue
+            # An empty bot bucket parks only this lane; other bots keep sending
+            if self._must_wait(bot_key, bot_lane.bucket, job, now):
+                continue
+            job.woken_from = None
+            self._vtime = max(self._vtime, job.vstart)
+            bot_lane.bucket.take(now)
+            bot_lane.sent += 1
+            self._rearm(bot_key, bot_lane.bucket, now)
+            if chat is not None:
+                chat.take(now)
+                self._rearm(chat_key, chat, now)
+            await self._slots.acquire()
+            job.context.run(asyncio.create_task, self._send(job))
+
+    async def _send(self, job: _Job):
+        stats = self._stats[job.priority]
+        try:
+            result = await job.callback(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            job.attempts += 1
+            if job.attempts > self.max_retries or job.future.done():
+                stats.queued -= 1
+                stats.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            stats.retried += 1
+            delay = float(e.retry_after)
+            logger.warning("Flood control on chat %s; retrying in %ss", job.chat_id, delay)
+            if job.chat_id is not None:
+                self._chat_bucket(job.lane, job.chat_id).block(delay)
+                self._park((job.lane, job.chat_id), job, delay)
+            else:
+                self._bot_lane(job.lane).bucket.block(delay)
+                self._park((job.lane, None), job, delay)
+        except Exception as e:
+            stats.queued -= 1
+            stats.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            stats.queued -= 1
+            stats.sent += 1
+            stats.latencies.append(time.monotonic() - job.queued_at)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-class counters and queued->sent latency percentiles."""
+        return {p.name.lower(): s.snapshot() for p, s in self._stats.items()}
+
+    def lane_stats(self) -> Dict[str, int]:
+        """Requests sent per lane (bot)."""
+        return {name: lane.sent for name, lane in self._lanes.items()}
+
+
+class TenantLane(BaseRateLimiter):
+    """One bot's view of a shared OutboundScheduler."""
+
+    def __init__(self, scheduler: OutboundScheduler, name: str):
+        self.scheduler = scheduler
+        self.name = name
+        self._attached = False
+
+    async def initialize(self) -> None:
+        # ExtBot calls this from both Application.initialize() and Updater.initialize()
+        if not self._attached:
+            self._attached = True
+            await self.scheduler._attach()
+
+    async def shutdown(self) -> None:
+        if self._attached:
+            self._attached = False
+            await self.scheduler._detach()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        return await self.scheduler._submit(self.name, callback, args, kwargs, endpoint, data, rate_limit_args)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return self.scheduler.stats()
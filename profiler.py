@@ -0,0 +1,141 @@
+"""
+On-demand sampling profiler for the live bot process.
+
+A background thread snapshots every thread's Python stack (event loop,
+executor threads running DB calls, the SQLite writer, ...) plus the await
+chain of every pending asyncio task, N times a second, and aggregates them
+into collapsed stacks ("frame;frame;frame count" lines). The output loads
+directly into flamegraph.pl, speedscope or inferno.
+
+Thread samples show where CPU time goes; task samples show where handlers
+are *waiting* (Telegram HTTP, a DB call pushed to a thread, a sleep), which
+is what usually makes the bot feel slow.
+"""
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+DEFAULT_INTERVAL = 0.01  # 100 Hz
+MAX_DEPTH = 64
+
+_active_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    name = getattr(code, "co_qualname", code.co_name)
+    if module in ("main", "__main__"):
+        # Resolve the generic wrappers in main.py to the handler they wrap
+        if code.co_name == "wrapped":
+            func = frame.f_locals.get("func")
+            if func is not None:
+                # Named after the decorator: restricted.<locals>.wrapped, admin_only.<locals>.decorator.<locals>.wrapped
+                decorator = name.split(".<locals>.", 1)[0] if ".<locals>." in name else "wrapped"
+                name = f"{decorator}[{getattr(func, '__name__', '?')}]"
+        elif code.co_name == "handler" and "name" in frame.f_locals:
+            name = f"content_command[{frame.f_locals['name']}]"
+        module = "main"
+    return f"{module}.{name}"
+
+
+def _thread_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _task_stack(task: asyncio.Task) -> Optional[List[str]]:
+    """Await chain of a suspended task, outermost coroutine first."""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None and len(stack) < MAX_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack or None
+
+
+class SamplingProfiler:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None, interval: float = DEFAULT_INTERVAL):
+        self.loop = loop
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample_threads(self, names: Dict[int, str]):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = _thread_stack(frame)
+            if stack:
+                self.samples[";".join([f"thread:{names.get(ident, ident)}"] + stack)] += 1
+
+    def _sample_tasks(self):
+        if self.loop is None:
+            return
+        try:
+            tasks = list(asyncio.all_tasks(self.loop))
+        except RuntimeError:
+            return  # task set changed mid-iteration; skip this tick
+        for task in tasks:
+            if task.done():
+                continue
+            stack = _task_stack(task)
+            if stack:
+                self.samples[";".join(["task"] + stack)] += 1
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self._sample_threads(names)
+            self._sample_tasks()
+            self.sample_count += 1
+            next_tick += self.interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_tick = time.perf_counter()
+
+    def collapsed(self) -> str:
+        """Collapsed-stack text, heaviest stacks first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+async def profile_for(seconds: float, interval: float = DEFAULT_INTERVAL) -> Optional[SamplingProfiler]:
+    """
+    Profile the running process for `seconds`. Returns None if a profile is
+    already running (only one at a time).
+    """
+    if not _active_lock.acquire(blocking=False):
+        return None
+    try:
+        profiler = SamplingProfiler(asyncio.get_running_loop(), interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+        return profiler
+    finally:
+        _active_lock.release()
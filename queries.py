@@ -0,0 +1,96 @@
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# ---------------- Dialects ----------------
+POSTGRES = "postgres"
+SQLITE = "sqlite"
+
+_PLACEHOLDER = re.compile(r"\?")
+
+
+@dataclass(frozen=True)
+class Statement:
+    """
+    A named SQL statement written once with `?` placeholders.
+    Dialect-specific overrides are only needed where the SQL itself differs
+    (casts, upsert syntax); placeholders are rendered per dialect.
+    """
+    name: str
+    sql: str
+    postgres: Optional[str] = None
+    sqlite: Optional[str] = None
+
+    def text(self, dialect: str) -> str:
+        if dialect == POSTGRES and self.postgres is not None:
+            return self.postgres
+        if dialect == SQLITE and self.sqlite is not None:
+            return self.sqlite
+        return self.sql
+
+    def param_count(self, dialect: str) -> int:
+        return len(_PLACEHOLDER.findall(self.text(dialect)))
+
+    def render(self, dialect: str) -> str:
+        """SQL for a plain cursor.execute(sql, params) call."""
+        sql = self.text(dialect)
+        if dialect == POSTGRES:
+            return _PLACEHOLDER.sub("%s", sql.replace("%", "%%"))
+        return sql
+
+    @property
+    def prepared_name(self) -> str:
+        return "hv_" + re.sub(r"\W", "_", self.name)
+
+    def prepare_sql(self) -> str:
+        """Postgres PREPARE ... AS ... with $n parameters (sent without params)."""
+        counter = iter(range(1, 10_000))
+        body = _PLACEHOLDER.sub(lambda _m: f"${next(counter)}", self.text(POSTGRES).strip().rstrip(";"))
+        return f"PREPARE {self.prepared_name} AS {body}"
+
+    def execute_sql(self) -> str:
+        """Postgres EXECUTE for the prepared statement, with %s params."""
+        n = self.param_count(POSTGRES)
+        if not n:
+            return f"EXECUTE {self.prepared_name}"
+        return f"EXECUTE {self.prepared_name} ({', '.join(['%s'] * n)})"
+
+
+# ---------------- Registry ----------------
+_REGISTRY: Dict[str, Statement] = {}
+_COUNTS: Counter = Counter()
+_COUNTS_LOCK = threading.Lock()
+
+
+def register(name: str, sql: str, *, postgres: Optional[str] = None, sqlite: Optional[str] = None) -> Statement:
+    """Register a named statement. Names are unique across the app."""
+    if name in _REGISTRY:
+        raise ValueError(f"Statement {name!r} is already registered.")
+    stmt = Statement(name=name, sql=sql, postgres=postgres, sqlite=sqlite)
+    _REGISTRY[name] = stmt
+    return stmt
+
+
+def get(name: str) -> Statement:
+    try:
+        return _REGISTRY[name]
+    except KeyError:
+        raise KeyError(f"Unknown statement {name!r}.") from None
+
+
+def record_execution(name: str):
+    with _COUNTS_LOCK:
+        _COUNTS[name] += 1
+
+
+def query_stats() -> Dict[str, int]:
+    """Execution counts per statement name, most used first."""
+    with _COUNTS_LOCK:
+        return dict(_COUNTS.most_common())
+
+
+def reset_query_stats():
+    with _COUNTS_LOCK:
+        _COUNTS.clear()
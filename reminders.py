@@ -0,0 +1,310 @@
+"""
+Booking reminders.
+
+Approving a booking stores its reminders in the reminders table in the same
+transaction: one on the morning of the booking (REMINDER_MORNING_AT) and one
+at the return deadline that evening (REMINDER_RETURN_AT), both in
+BOT_TIMEZONE. Either can be turned off by setting it to "".
+
+The table is the only durable state. Each process keeps just the next
+REMINDER_WINDOW seconds of due times in a hashed timer wheel, loaded with
+one range scan on reminders_due_idx, and one JobQueue job advances the
+wheel every REMINDER_TICK seconds. When a slot fires, due reminders are
+claimed (DELETE ... RETURNING) and sent in batches through the outbound
+scheduler. So 10k future bookings cost one index entry each, not a timer
+each. A restart just reloads the window, and anything that came due while
+the bot was down goes out then, unless it is more than
+REMINDER_MAX_LATE seconds late. Claiming is atomic, so cluster workers
+never send the same reminder twice. Each tenant (tenancy.py) has its own
+wheel, filled from its own table.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram.ext import Application, ContextTypes
+
+import invalidation
+import outbound
+import queries
+import tenancy
+from database import USE_POSTGRES, raw_connection, run_query, write_transaction
+
+# ---------------- Config ----------------
+BOT_TIMEZONE = ZoneInfo(os.getenv("BOT_TIMEZONE", "Asia/Singapore"))
+REMINDER_MORNING_AT = os.getenv("REMINDER_MORNING_AT", "08:00")
+REMINDER_RETURN_AT = os.getenv("REMINDER_RETURN_AT", "21:00")
+REMINDER_TICK = float(os.getenv("REMINDER_TICK", "30"))
+REMINDER_WINDOW = float(os.getenv("REMINDER_WINDOW", "1800"))
+REMINDER_MAX_LATE = float(os.getenv("REMINDER_MAX_LATE", "7200"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "100"))
+# Most due times held in memory at once; the rest of the window loads later
+REMINDER_WINDOW_LIMIT = 5000
+
+MESSAGES = {
+    "morning": "⏰ Reminder: your {equipment} booking (ID {booking_id}) is today. Don't forget to collect it!",
+    "return": "↩️ Reminder: please return the {equipment} (booking ID {booking_id}) by tonight.",
+}
+
+# ---------------- Statements ----------------
+queries.register(
+    "reminders.insert",
+    """
+    INSERT INTO reminders (booking_id, user_id, kind, equipment, date, due_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (booking_id, kind) DO NOTHING;
+    """,
+    postgres="""
+    INSERT INTO reminders (booking_id, user_id, kind, equipment, date, due_at)
+    VALUES (?, ?, ?, ?, ?::date, ?)
+    ON CONFLICT (booking_id, kind) DO NOTHING;
+    """,
+)
+queries.register(
+    "reminders.window",
+    "SELECT due_at FROM reminders WHERE due_at < ? ORDER BY due_at LIMIT ?",
+)
+# Claim a batch of due reminders; whoever deletes a row sends it
+queries.register(
+    "reminders.claim",
+    """
+    DELETE FROM reminders
+    WHERE due_at <= ? AND id IN (
+        SELECT id FROM reminders
+        WHERE due_at <= ?
+        ORDER BY due_at, id
+        LIMIT ?
+    )
+    RETURNING booking_id, user_id, kind, equipment, date, due_at;
+    """,
+    postgres="""
+    DELETE FROM reminders
+    WHERE due_at <= ? AND id IN (
+        SELECT id FROM reminders
+        WHERE due_at <= ?
+        ORDER BY due_at, id
+        LIMIT ?
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING booking_id, user_id, kind, equipment, date::text, due_at;
+    """,
+)
+
+
+def init_reminders_db():
+    """Create the reminders table if it doesn't exist."""
+    with raw_connection() as conn:
+        c = conn.cursor()
+        if USE_POSTGRES:
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id SERIAL PRIMARY KEY,
+                    booking_id INTEGER NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    kind TEXT NOT NULL,
+                    equipment TEXT NOT NULL,
+                    date DATE NOT NULL,
+                    due_at TIMESTAMPTZ NOT NULL,
+                    UNIQUE (booking_id, kind)
+                );
+                """
+            )
+        else:
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    booking_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    equipment TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    due_at TEXT NOT NULL,
+                    UNIQUE (booking_id, kind)
+                );
+                """
+            )
+        c.execute("CREATE INDEX IF NOT EXISTS reminders_due_idx ON reminders (due_at, id);")
+        conn.commit()
+
+
+# ---------------- Due times ----------------
+def _to_db(ts: float):
+    """due_at value in the column's native format (UTC)."""
+    if USE_POSTGRES:
+        return datetime.fromtimestamp(ts, timezone.utc)
+    return datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _from_db(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _local_time(day: date, hhmm: str) -> float:
+    hour, minute = (int(x) for x in hhmm.split(":"))
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=BOT_TIMEZONE).timestamp()
+
+
+def due_times(day: str, now: Optional[float] = None) -> List[Tuple[str, float]]:
+    """(kind, unix time) reminders for a booking on `day` that are still in the future."""
+    now = time.time() if now is None else now
+    booking_day = date.fromisoformat(day)
+    due = []
+    for kind, at in (("morning", REMINDER_MORNING_AT), ("return", REMINDER_RETURN_AT)):
+        if at:
+            ts = _local_time(booking_day, at)
+            if ts > now:
+                due.append((kind, ts))
+    return due
+
+
+def schedule_booking(conn, booking_id: int, user_id: int, equipment: str, day: str):
+    """
+    Store an approved booking's reminders, inside the approving transaction.
+    The approval's change event makes every process reload its window.
+    """
+    for kind, ts in due_times(day):
+        run_query(conn, "reminders.insert", (booking_id, user_id, kind, equipment or "equipment", day, _to_db(ts)))
+
+
+# ---------------- Timer wheel ----------------
+class TimerWheel:
+    """
+    Hashed timing wheel: `slots` buckets of `tick` seconds, covering
+    (slots - 1) * tick seconds ahead of the cursor. Holds bare due times;
+    the database says what is actually due when a slot fires.
+    """
+
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self.slots = slots
+        self._buckets: List[List[float]] = [[] for _ in range(slots)]
+        self._cursor: Optional[int] = None
+        self.size = 0
+
+    def reset(self, now: float):
+        for bucket in self._buckets:
+            bucket.clear()
+        self._cursor = int(now // self.tick)
+        self.size = 0
+
+    def add(self, due: float) -> bool:
+        """False if `due` is beyond the wheel's horizon (it'll come in with a later window)."""
+        slot = max(int(due // self.tick), self._cursor)
+        if slot - self._cursor >= self.slots:
+            return False
+        self._buckets[slot % self.slots].append(due)
+        self.size += 1
+        return True
+
+    def advance(self, now: float) -> int:
+        """Move the cursor to `now`; returns how many due times fired."""
+        current = int(now // self.tick)
+        fired = 0
+        for slot in range(self._cursor, min(current, self._cursor + self.slots - 1) + 1):
+            bucket = self._buckets[slot % self.slots]
+            if not bucket:
+                continue
+            keep = [due for due in bucket if due > now]
+            fired += len(bucket) - len(keep)
+            bucket[:] = keep
+        self._cursor = current
+        self.size -= fired
+        return fired
+
+
+class _Window:
+    """One tenant's loaded window."""
+
+    def __init__(self):
+        self.wheel = TimerWheel(REMINDER_TICK, int(REMINDER_WINDOW // REMINDER_TICK) + 1)
+        self.loaded_until = 0.0
+        self.dirty = threading.Event()
+
+
+_windows: Dict[str, _Window] = {}
+_stats = {"sent": 0, "failed": 0, "late_dropped": 0}
+
+
+def _window() -> _Window:
+    return _windows.setdefault(tenancy.current_id(), _Window())
+
+
+def _mark_dirty(change: invalidation.Change):
+    # An approval (here or in another process) may have added reminders inside our window
+    if change.op in ("UPDATE", invalidation.RESET):
+        for tenant_id, window in list(_windows.items()):
+            if change.tenant is None or change.tenant == tenant_id:
+                window.dirty.set()
+
+
+invalidation.subscribe("bookings", _mark_dirty)
+
+
+def _load_window(window: _Window, now: float):
+    """Refill the wheel from the index: every unsent reminder due before now + REMINDER_WINDOW."""
+    end = now + REMINDER_WINDOW
+    with raw_connection() as conn:
+        rows = run_query(conn, "reminders.window", (_to_db(end), REMINDER_WINDOW_LIMIT)).fetchall()
+    window.wheel.reset(now)
+    for (due_at,) in rows:
+        window.wheel.add(_from_db(due_at))
+    # A full page means the window was cut short; load the rest when we get there
+    window.loaded_until = _from_db(rows[-1][0]) if len(rows) >= REMINDER_WINDOW_LIMIT else end
+
+
+def _claim(now: float) -> List[tuple]:
+    cutoff = _to_db(now)
+    return write_transaction(
+        lambda conn: run_query(conn, "reminders.claim", (cutoff, cutoff, REMINDER_BATCH_SIZE)).fetchall(),
+        "claim_reminders"
+    )
+
+
+async def _send_due(bot, now: float):
+    while True:
+        rows = await asyncio.to_thread(_claim, now)
+        messages = []
+        for booking_id, user_id, kind, equipment, day, due_at in rows:
+            if now - _from_db(due_at) > REMINDER_MAX_LATE:
+                _stats["late_dropped"] += 1
+                continue
+            text = MESSAGES.get(kind, MESSAGES["morning"]).format(equipment=equipment, booking_id=booking_id)
+            messages.append((int(user_id), text))
+        results = await asyncio.gather(
+            *(bot.send_message(chat_id=uid, text=text, rate_limit_args=outbound.BULK) for uid, text in messages),
+            return_exceptions=True,
+        )
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        _stats["sent"] += len(results) - failed
+        _stats["failed"] += failed
+        if len(rows) < REMINDER_BATCH_SIZE:
+            return
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    window = _window()
+    if window.dirty.is_set() or now + REMINDER_TICK >= window.loaded_until:
+        window.dirty.clear()
+        await asyncio.to_thread(_load_window, window, now)
+    if window.wheel.advance(now):
+        await _send_due(context.bot, now)
+
+
+def install(app: Application):
+    """Schedule the reminder tick; the first one loads the window."""
+    app.job_queue.run_repeating(tick, interval=REMINDER_TICK, first=1, name="reminders.tick")
+
+
+def stats() -> Dict[str, Any]:
+    """The bound tenant's window plus process-wide send counters."""
+    window = _window()
+    return {"scheduled": window.wheel.size, "window_until": window.loaded_until, **_stats}
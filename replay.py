@@ -0,0 +1,382 @@
+"""
+Replay a capture (capture.py) against this checkout, to compare handler
+latency and errors between two versions of the code.
+
+    python replay.py run traces/updates.jsonl --speed 10 --out base.json
+    git checkout my-branch
+    python replay.py run traces/updates.jsonl --speed 10 --out head.json
+    python replay.py diff base.json head.json
+
+run feeds the trace's updates into a fresh Application at their recorded
+pace divided by --speed (1 = real time, 10 = ten times faster, 0 = as fast
+as possible). Telegram is replaced by FakeBotAPI, which answers every call
+locally after --api-ms milliseconds; outbound.py still paces the calls as
+in production (e.g. one message per second per chat). The database is a
+scratch SQLite file (never DATABASE_URL; a temp file that is removed
+afterwards, unless --db) seeded with each sender's status and admin roles
+as captured; bookings and other rows the trace relies on aren't there, so
+handlers see an empty hall at first.
+
+For each update it reports the latency (queued -> handled, as the user
+sees it), the time spent in handlers alone, the errors that reached the
+error handler and the Bot API methods called. diff compares two reports
+per update kind and lists updates whose errors or calls changed; it exits
+1 when an update fails in the second report that didn't in the first.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+# update_id of the update being replayed, for attributing Bot API calls
+_replaying: ContextVar[Optional[int]] = ContextVar("replaying", default=None)
+
+# Methods that answer with the Message they sent or edited
+MESSAGE_METHODS = frozenset({
+    "sendMessage", "sendDocument", "sendPhoto", "sendMediaGroup", "forwardMessage",
+    "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+})
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+
+
+# ---------------- Fake Bot API ----------------
+class FakeBotAPI(BaseRequest):
+    """Answers every Bot API call locally, recording which methods each replayed update called."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[int, List[str]] = defaultdict(list)
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "getFile":
+            return {"file_id": params.get("file_id", ""), "file_unique_id": "replay", "file_path": "replay"}
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in MESSAGE_METHODS and "inline_message_id" not in params:
+            chat_id = params.get("chat_id")
+            message = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id if isinstance(chat_id, int) else 0, "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            return [message] if method == "sendMediaGroup" else message
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if method == "GET":
+            return 200, b""  # file download
+        api_method = url.rsplit("/", 1)[-1]
+        update_id = _replaying.get()
+        if update_id is not None:
+            self.calls[update_id].append(api_method)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+
+# ---------------- Trace ----------------
+def load_trace(path: str, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Captured entries in time order (one tenant's; required when the trace has several)."""
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    tenants = {e.get("tenant") for e in entries}
+    if tenant is not None:
+        entries = [e for e in entries if e.get("tenant") == tenant]
+    elif len(tenants) > 1:
+        names = ", ".join(sorted(map(str, tenants)))
+        raise SystemExit(f"❌ The trace has several tenants ({names}); pick one with --tenant.")
+    seen = set()
+    unique = []
+    for entry in sorted(entries, key=lambda e: e["ts"]):
+        update_id = entry["update"].get("update_id")
+        if update_id not in seen:
+            seen.add(update_id)
+            unique.append(entry)
+    return unique
+
+
+def _scratch_env(db_path: str):
+    """Point this process at a scratch SQLite database; before importing main and friends."""
+    os.environ["DATABASE_URL"] = ""  # set, so .env can't bring Postgres back
+    os.environ["DB_PATH"] = db_path
+    os.environ["TENANTS_FILE"] = ""
+    os.environ["WORKER_PROCESSES"] = "1"
+    os.environ["ADMIN_IDS"] = ""  # admins come from the trace
+    os.environ["CAPTURE_FILE"] = ""  # don't capture the replay
+    os.environ["BACKUP_INTERVAL"] = "0"
+    os.environ.setdefault("BOT_TOKEN", "1:replay")
+
+
+def _seed(entries: List[Dict[str, Any]]):
+    """Give each sender the status and roles they had when first captured."""
+    import admins
+    import database
+    import main
+
+    first: Dict[int, Dict[str, Any]] = {}
+    for entry in entries:
+        user = (entry["update"].get("message") or entry["update"].get("callback_query") or {}).get("from")
+        if user and user["id"] not in first:
+            first[user["id"]] = entry
+    block = main.valid_blocks()[0]
+    registered = [(uid, f"User {uid}", block, "00-00-000") for uid, e in first.items() if e["status"] == "registered"]
+    database.bulk_upsert_registered_users(registered)
+    for uid, entry in first.items():
+        if entry["status"] == "pending":
+            database.add_pending_user(uid, f"User {uid}", block, "00-00-000")
+        for role in entry["roles"]:
+            admins.grant(uid, role, 0)
+
+
+# ---------------- Replay ----------------
+async def _replay(entries: List[Dict[str, Any]], speed: float, api: FakeBotAPI, timeout: float) -> Dict[str, Any]:
+    import capture
+    import main
+
+    app = main.build_application(with_updater=False, request=api)
+    results: Dict[int, Dict[str, Any]] = {}
+    queued: Dict[int, float] = {}
+    finished = asyncio.Event()
+    process_update, process_error = app.process_update, app.process_error
+
+    async def timed(update: object) -> None:
+        update_id = update.update_id if isinstance(update, Update) else None
+        token = _replaying.set(update_id)
+        started = time.monotonic()
+        try:
+            await process_update(update)
+        finally:
+            _replaying.reset(token)
+            if update_id in results:
+                done = time.monotonic()
+                results[update_id]["handler_ms"] = round((done - started) * 1000, 2)
+                results[update_id]["latency_ms"] = round((done - queued.pop(update_id)) * 1000, 2)
+                if not queued:
+                    finished.set()
+
+    async def recorded(update: object, error: Exception, job=None, coroutine=None) -> bool:
+        if isinstance(update, Update) and update.update_id in results:
+            results[update.update_id]["errors"].append(type(error).__name__)
+        return await process_error(update, error, job, coroutine)
+
+    app.process_update, app.process_error = timed, recorded
+    await app.initialize()
+    await app.start()
+    try:
+        first_ts, start = entries[0]["ts"], time.monotonic()
+        for entry in entries:
+            if speed > 0:
+                delay = (entry["ts"] - first_ts) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(entry["update"], app.bot)
+            results[update.update_id] = {"kind": capture.update_kind(entry["update"]), "errors": []}
+            queued[update.update_id] = time.monotonic()
+            await app.update_queue.put(update)
+        try:
+            await asyncio.wait_for(finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {len(queued)} updates still running after {timeout:.0f}s", file=sys.stderr)
+        wall = time.monotonic() - start
+    finally:
+        await app.stop()
+        await app.shutdown()
+    for update_id, result in results.items():
+        result["calls"] = api.calls.get(update_id, [])
+        if update_id in queued:
+            result["errors"].append("Unfinished")
+    return {"wall_seconds": round(wall, 2), "updates": results}
+
+
+def _revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run(trace: str, speed: float, api_ms: float, tenant: Optional[str], db_path: Optional[str], timeout: float):
+    entries = load_trace(trace, tenant)
+    if not entries:
+        raise SystemExit("❌ Nothing to replay.")
+    scratch = None
+    if db_path is None:
+        scratch = tempfile.mkdtemp(prefix="replay-")
+        db_path = os.path.join(scratch, "replay.db")
+    _scratch_env(db_path)
+
+    import database
+    import invalidation
+    import main
+
+    main.init_db()
+    main.init_booking_db()
+    _seed(entries)
+    invalidation.start()
+    try:
+        report = asyncio.run(_replay(entries, speed, FakeBotAPI(api_ms / 1000), timeout))
+    finally:
+        invalidation.stop()
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    report.update(
+        trace=trace,
+        revision=_revision(),
+        speed=speed,
+        api_ms=api_ms,
+        sqlite_mode=database.SQLITE_MODE,
+        summary=summarize(report["updates"]),
+    )
+    return report
+
+
+# ---------------- Reports ----------------
+def _pct(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def summarize(updates: Dict[Any, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per update kind (and "all"): count, latency and handler-time percentiles, errors."""
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for result in updates.values():
+        groups[result["kind"]].append(result)
+        groups["all"].append(result)
+    summary = {}
+    for kind, results in groups.items():
+        latency = sorted(r.get("latency_ms", 0.0) for r in results)
+        handler = sorted(r.get("handler_ms", 0.0) for r in results)
+        summary[kind] = {
+            "count": len(results),
+            "p50_ms": _pct(latency, 0.50),
+            "p95_ms": _pct(latency, 0.95),
+            "max_ms": latency[-1],
+            "handler_p95_ms": _pct(handler, 0.95),
+            "errors": sum(1 for r in results if r["errors"]),
+        }
+    return summary
+
+
+def print_summary(report: Dict[str, Any]):
+    print(
+        f"Replayed {report['summary']['all']['count']} updates in {report['wall_seconds']}s "
+        f"(speed {report['speed'] or 'max'}, revision {report['revision'] or '?'})"
+    )
+    print(f"{'kind':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+    for kind, s in sorted(report["summary"].items(), key=lambda item: (item[0] == "all", item[0])):
+        print(
+            f"{kind[:27]:<28}{s['count']:>7}"
+            f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['max_ms']:>10.1f}{s['errors']:>8}"
+        )
+
+
+def _change(before: float, after: float) -> str:
+    if not before:
+        return ""
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def diff(base: Dict[str, Any], head: Dict[str, Any]) -> int:
+    """Print the differences between two reports; returns 1 if head has new errors."""
+    print(f"{base['revision'] or 'base'} -> {head['revision'] or 'head'}")
+    if (base["trace"], base["speed"], base["api_ms"]) != (head["trace"], head["speed"], head["api_ms"]):
+        print("⚠️ The reports come from different traces or settings; latencies may not compare.")
+    print(f"{'kind':<28}{'p50 ms':>18}{'p95 ms':>18}{'errors':>10}")
+    kinds = sorted(set(base["summary"]) | set(head["summary"]), key=lambda k: (k == "all", k))
+    empty = {"p50_ms": 0.0, "p95_ms": 0.0, "errors": 0}
+    for kind in kinds:
+        b, h = base["summary"].get(kind, empty), head["summary"].get(kind, empty)
+        print(
+            f"{kind[:27]:<28}"
+            f"{b['p50_ms']:>7.1f} -> {h['p50_ms']:<6.1f}{_change(b['p50_ms'], h['p50_ms']):>5}"
+            f"{b['p95_ms']:>7.1f} -> {h['p95_ms']:<6.1f}{_change(b['p95_ms'], h['p95_ms']):>5}"
+            f"{b['errors']:>5} -> {h['errors']}"
+        )
+
+    regressed = 0
+    changed_calls = Counter()
+    for update_id in sorted(set(base["updates"]) & set(head["updates"]), key=int):
+        b, h = base["updates"][update_id], head["updates"][update_id]
+        if Counter(b["errors"]) != Counter(h["errors"]):
+            print(f"• update {update_id} ({h['kind']}): errors {b['errors']} -> {h['errors']}")
+            regressed += bool(set(h["errors"]) - set(b["errors"]))
+        if b["calls"] != h["calls"]:
+            changed_calls[h["kind"]] += 1
+    for kind, n in changed_calls.most_common():
+        print(f"• {n} × {kind}: different Bot API calls")
+    missing = set(base["updates"]) ^ set(head["updates"])
+    if missing:
+        print(f"⚠️ {len(missing)} updates appear in only one report")
+    if regressed:
+        print(f"❌ {regressed} updates fail that didn't before")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured updates and compare runs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run")
+    p.add_argument("trace")
+    p.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 10 = ten times faster, 0 = no pauses")
+    p.add_argument("--api-ms", type=float, default=0.0, help="simulated Bot API latency per call")
+    p.add_argument("--tenant", help="replay only this tenant's updates")
+    p.add_argument("--db", help="SQLite file to use (default: a fresh temp file)")
+    p.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the last updates")
+    p.add_argument("--out", help="write the report (JSON) here")
+    p = sub.add_parser("diff")
+    p.add_argument("base")
+    p.add_argument("head")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = run(args.trace, args.speed, args.api_ms, args.tenant, args.db, args.timeout)
+        print_summary(result)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=1)
+    else:
+        with open(args.base, encoding="utf-8") as f:
+            base_report = json.load(f)
+        with open(args.head, encoding="utf-8") as f:
+            head_report = json.load(f)
+        sys.exit(diff(base_report, head_report))
@@ -0,0 +1,166 @@
+"""
+Semester roster import for /import_roster.
+
+The uploaded CSV or XLSX is read row by row (csv.reader / openpyxl
+read-only mode, never a whole DataFrame), each row is validated as it
+streams past, and the valid rows are loaded with one bulk upsert
+(database.bulk_upsert_registered_users: COPY on Postgres, executemany on
+SQLite, single transaction either way).
+
+Expected columns (header row, any order, case-insensitive) match /export:
+User ID, Name, Block, Room.
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from database import bulk_upsert_registered_users, normalize_room
+
+# Accepted header spellings per field
+HEADER_ALIASES = {
+    "user_id": ("user id", "user_id", "userid", "telegram id", "telegram_id", "id"),
+    "name": ("name", "full name", "full_name"),
+    "block": ("block",),
+    "room": ("room", "room number", "room_no"),
+}
+MAX_NAME_LENGTH = 100
+
+
+class RosterError(ValueError):
+    """The file as a whole can't be imported (unreadable, missing columns)."""
+
+
+@dataclass
+class RosterResult:
+    inserted: List[int] = field(default_factory=list)
+    updated: List[int] = field(default_factory=list)
+    unchanged: List[int] = field(default_factory=list)
+    # (line number, raw user id cell, reason)
+    rejected: List[Tuple[int, str, str]] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.inserted) + len(self.updated) + len(self.unchanged) + len(self.rejected)
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # Excel stores ids as floats
+    return str(value).strip()
+
+
+def iter_rows(data: bytes, filename: str) -> Iterator[List[str]]:
+    """Yield each row of the file as a list of stripped strings, header included."""
+    name = filename.lower()
+    if name.endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        try:
+            workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        except Exception as e:
+            raise RosterError(f"Couldn't read the spreadsheet: {e}")
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield [_cell(v) for v in row]
+        finally:
+            workbook.close()
+    elif name.endswith(".csv"):
+        try:
+            text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+            for row in csv.reader(text):
+                yield [_cell(v) for v in row]
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise RosterError(f"Couldn't read the CSV: {e}")
+    else:
+        raise RosterError("Send a .csv or .xlsx file.")
+
+
+def _column_map(header: Sequence[str]) -> Dict[str, int]:
+    lookup = {h.strip().lower(): i for i, h in enumerate(header) if h}
+    columns = {}
+    for field_name, aliases in HEADER_ALIASES.items():
+        index = next((lookup[a] for a in aliases if a in lookup), None)
+        if index is None:
+            raise RosterError(f"Missing a '{aliases[0].title()}' column.")
+        columns[field_name] = index
+    return columns
+
+
+def validate_rows(
+    rows: Iterable[List[str]], valid_blocks: Sequence[str], result: RosterResult
+) -> List[Tuple[int, str, str, str]]:
+    """
+    Consume the row stream (header first) and return clean
+    (user_id, name, block, room) tuples; problems go to result.rejected.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise RosterError("The file is empty.")
+    columns = _column_map(header)
+    blocks = {b.lower(): b for b in valid_blocks}
+
+    valid: List[Tuple[int, str, str, str]] = []
+    seen: Dict[int, int] = {}
+    for line, row in enumerate(rows, start=2):
+        if not any(row):
+            continue
+        values = {f: (row[i] if i < len(row) else "") for f, i in columns.items()}
+        raw_id = values["user_id"]
+
+        reason: Optional[str] = None
+        user_id = 0
+        try:
+            user_id = int(raw_id)
+        except ValueError:
+            reason = "user id is not a number"
+        if reason is None and user_id <= 0:
+            reason = "user id must be positive"
+        name = " ".join(values["name"].split())
+        block = blocks.get(values["block"].lower())
+        room = normalize_room(values["room"]) if values["room"] else ""
+        if reason is None and not name:
+            reason = "name is empty"
+        if reason is None and len(name) > MAX_NAME_LENGTH:
+            reason = "name is too long"
+        if reason is None and block is None:
+            reason = f"block must be one of {', '.join(valid_blocks)}"
+        if reason is None and not room:
+            reason = "room is empty"
+        if reason is None and user_id in seen:
+            reason = f"duplicate of line {seen[user_id]}"
+
+        if reason is not None:
+            result.rejected.append((line, raw_id, reason))
+            continue
+        seen[user_id] = line
+        valid.append((user_id, name, block, room))
+    return valid
+
+
+def import_roster(data: bytes, filename: str, valid_blocks: Sequence[str]) -> RosterResult:
+    """Validate and bulk-load a roster file. Raises RosterError if nothing can be read."""
+    result = RosterResult()
+    valid = validate_rows(iter_rows(data, filename), valid_blocks, result)
+    inserted, updated = bulk_upsert_registered_users(valid)
+    changed = set(inserted) | set(updated)
+    result.inserted = inserted
+    result.updated = updated
+    result.unchanged = [row[0] for row in valid if row[0] not in changed]
+    return result
+
+
+def report_csv(result: RosterResult) -> bytes:
+    """Per-row outcome file sent back to the admin."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["Line", "User ID", "Outcome", "Reason"])
+    for line, raw_id, reason in result.rejected:
+        writer.writerow([line, raw_id, "rejected", reason])
+    for outcome, ids in (("inserted", result.inserted), ("updated", result.updated), ("unchanged", result.unchanged)):
+        for user_id in ids:
+            writer.writerow(["", user_id, outcome, ""])
+    return buf.getvalue().encode("utf-8")
@@ -0,0 +1,170 @@
+"""
+Bounded per-user state.
+
+PTB keeps conversation state and context.user_data/chat_data in process
+memory forever (user_data is a defaultdict, so even one /start creates an
+entry). This module:
+
+- gives every ConversationHandler a timeout (CONVERSATION_TIMEOUT, or
+  CONVERSATION_TIMEOUT_<NAME> per conversation; 0 disables) whose expiry
+  handler drops the conversation's keys and tells the user,
+- stamps each user's last activity,
+- tracks who is mid-conversation from what the conversations' callbacks
+  return (a state, or ConversationHandler.END), and
+- runs a periodic sweep that evicts user_data/chat_data of users idle for
+  USER_DATA_IDLE_TTL who aren't mid-conversation.
+
+gauges() reports the counts so /dbstats can show the footprint stays flat.
+Tracking is per Application, so tenants sharing a process (tenancy.py)
+never sweep each other's users.
+"""
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from weakref import WeakKeyDictionary
+
+from telegram import Update
+from telegram.ext import Application, BaseHandler, ContextTypes, ConversationHandler, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+CONVERSATION_TIMEOUT = float(os.getenv("CONVERSATION_TIMEOUT", "600"))
+USER_DATA_IDLE_TTL = float(os.getenv("USER_DATA_IDLE_TTL", "3600"))
+SWEEP_INTERVAL = float(os.getenv("USER_DATA_SWEEP_INTERVAL", "600"))
+
+
+@dataclass
+class _Activity:
+    # user_id / chat_id -> monotonic time of their last update
+    last_seen: Dict[int, float] = field(default_factory=dict)
+    chat_last_seen: Dict[int, float] = field(default_factory=dict)
+    # conversation index -> (chat_id, user_id) keys currently inside it
+    conversations: Dict[int, Set[Tuple[int, int]]] = field(default_factory=dict)
+
+
+_activity: "WeakKeyDictionary[Application, _Activity]" = WeakKeyDictionary()
+
+
+def _of(app: Application) -> _Activity:
+    activity = _activity.get(app)
+    if activity is None:
+        activity = _activity[app] = _Activity()
+    return activity
+
+
+def conversation_timeout(name: str) -> Optional[float]:
+    """Timeout in seconds for the named conversation (None = never)."""
+    value = float(os.getenv(f"CONVERSATION_TIMEOUT_{name.upper()}", CONVERSATION_TIMEOUT))
+    return value if value > 0 else None
+
+
+def timeout_handler(keys: Iterable[str], message: str) -> TypeHandler:
+    """ConversationHandler.TIMEOUT handler: drop the conversation's user_data keys and say so."""
+    keys = tuple(keys)
+
+    async def expired(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        for key in keys:
+            context.user_data.pop(key, None)
+        if update.effective_chat is not None:
+            try:
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
+            except Exception:
+                pass
+
+    return TypeHandler(Update, expired)
+
+
+async def _touch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    now = time.monotonic()
+    activity = _of(context.application)
+    if update.effective_user is not None:
+        activity.last_seen[update.effective_user.id] = now
+    if update.effective_chat is not None:
+        activity.chat_last_seen[update.effective_chat.id] = now
+
+
+def _note_state(app: Application, index: int, update: object, state: object):
+    if not isinstance(update, Update) or update.effective_chat is None or update.effective_user is None:
+        return
+    # The conversations' key with the default per_chat/per_user settings
+    key = (update.effective_chat.id, update.effective_user.id)
+    keys = _of(app).conversations.setdefault(index, set())
+    if state == ConversationHandler.END:
+        keys.discard(key)
+    elif state is not None:  # None keeps the current state
+        keys.add(key)
+
+
+def _track(index: int, handler: BaseHandler, ends: bool = False):
+    """Wrap a conversation handler's callback to record the state it moves the user to."""
+    callback = handler.callback
+
+    async def tracked(update: object, context: ContextTypes.DEFAULT_TYPE):
+        state = await callback(update, context)
+        # Once its TIMEOUT handlers have run, the conversation is over
+        _note_state(context.application, index, update, ConversationHandler.END if ends else state)
+        return state
+
+    handler.callback = tracked
+
+
+def _active_keys(activity: _Activity) -> tuple:
+    """User and chat ids that are currently inside some conversation."""
+    users, chats = set(), set()
+    for keys in activity.conversations.values():
+        for chat_id, user_id in keys:
+            chats.add(chat_id)
+            users.add(user_id)
+    return users, chats
+
+
+async def sweep(context: ContextTypes.DEFAULT_TYPE):
+    app = context.application
+    activity = _of(app)
+    last_seen, chat_last_seen = activity.last_seen, activity.chat_last_seen
+    cutoff = time.monotonic() - USER_DATA_IDLE_TTL
+    active_users, active_chats = _active_keys(activity)
+
+    dropped_users = 0
+    for user_id in list(app.user_data):
+        if user_id not in active_users and last_seen.get(user_id, 0) < cutoff:
+            app.drop_user_data(user_id)
+            dropped_users += 1
+    for user_id in [u for u, seen in last_seen.items() if seen < cutoff and u not in active_users]:
+        del last_seen[user_id]
+
+    dropped_chats = 0
+    for chat_id in list(app.chat_data):
+        if chat_id not in active_chats and chat_last_seen.get(chat_id, 0) < cutoff:
+            app.drop_chat_data(chat_id)
+            dropped_chats += 1
+    for chat_id in [c for c, seen in chat_last_seen.items() if seen < cutoff and c not in active_chats]:
+        del chat_last_seen[chat_id]
+
+    if dropped_users or dropped_chats:
+        logger.info("Swept %s user_data and %s chat_data entries; now %s", dropped_users, dropped_chats, gauges(app))
+
+
+def install(app: Application, conversations: List[ConversationHandler]):
+    """Track activity for every update and schedule the sweep."""
+    for index, conv in enumerate(conversations):
+        for state, handlers in conv.states.items():
+            for handler in handlers:
+                _track(index, handler, ends=state == ConversationHandler.TIMEOUT)
+        for handler in conv.entry_points + conv.fallbacks:
+            _track(index, handler)
+    app.add_handler(TypeHandler(Update, _touch), group=-1)
+    app.job_queue.run_repeating(sweep, interval=SWEEP_INTERVAL, first=SWEEP_INTERVAL, name="sessions.sweep")
+
+
+def gauges(app: Application) -> Dict[str, int]:
+    activity = _of(app)
+    return {
+        "user_data": len(app.user_data),
+        "chat_data": len(app.chat_data),
+        "conversations": sum(len(keys) for keys in activity.conversations.values()),
+        "tracked_users": len(activity.last_seen),
+    }
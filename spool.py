@@ -0,0 +1,194 @@
+"""
+Local write spool for degraded mode.
+
+While the database is unavailable (circuit.py), writes that residents start
+on their own, i.e. new bookings and registration requests, are saved to a
+small SQLite file on local disk (SPOOL_PATH) instead of being lost, and the
+user is told plainly that the request is saved and will sync later.
+
+A JobQueue job every SPOOL_REPLAY_INTERVAL seconds doubles as the breaker's
+recovery probe: while the breaker is open it pings the database, and once
+that succeeds it replays the spooled writes in order through the handler
+registered for their kind, which performs the write and sends the usual
+confirmations. Each entry is leased before it is replayed, so cluster
+workers sharing the spool file never replay it twice at once. Replay is
+still at-least-once (a write can commit and then fail, or its lease can run
+out before the spool delete), so every handler must be idempotent: a
+registration is an upsert by user id, and a booking carries the
+request_key generated before its first attempt, which add_booking stores
+with a unique index so a repeat inserts nothing. The confirmations a
+repeated replay sends may still go out twice.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram.ext import Application, ContextTypes
+
+import circuit
+import database
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+SPOOL_PATH = os.getenv("SPOOL_PATH", os.path.splitext(database.DB_PATH)[0] + "-spool.db")
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "10"))
+# Seconds a replaying process holds an entry before others may retry it
+SPOOL_LEASE_SECONDS = 300
+# Seconds before an entry that failed (other than by an outage) is tried again
+SPOOL_RETRY_DELAY = 60
+# A spooled write that keeps failing for reasons other than an outage is dropped after this
+SPOOL_MAX_ATTEMPTS = 5
+
+# kind -> async handler(bot, user_id, payload) that applies one spooled write
+Handler = Callable[[Any, int, Dict[str, Any]], Awaitable[None]]
+_handlers: Dict[str, Handler] = {}
+_lock = threading.Lock()
+_stats = {"spooled": 0, "replayed": 0, "dropped": 0}
+
+
+def register(kind: str, handler: Handler):
+    _handlers[kind] = handler
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(SPOOL_PATH, timeout=5)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    return conn
+
+
+def enqueue(kind: str, user_id: int, payload: Dict[str, Any]) -> int:
+    """Save a write for replay (for the bound tenant); returns how many are waiting."""
+    if kind not in _handlers:
+        raise ValueError(f"No spool handler for {kind!r}")
+    tenant_id = tenancy.current_id()
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO spool (tenant, kind, user_id, payload) VALUES (?, ?, ?, ?)",
+                    (tenant_id, kind, user_id, json.dumps(payload)),
+                )
+            waiting = conn.execute("SELECT COUNT(*) FROM spool WHERE tenant = ?", (tenant_id,)).fetchone()[0]
+        finally:
+            conn.close()
+    _stats["spooled"] += 1
+    logger.warning("Database unavailable; spooled a %s for user %s (%s waiting)", kind, user_id, waiting)
+    return waiting
+
+
+def _claim(tenant_id: str) -> Optional[Tuple[int, str, int, str, int]]:
+    """Lease the tenant's oldest unleased entry: (id, kind, user_id, payload, attempts), or None."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                return conn.execute(
+                    """
+                    UPDATE spool SET lease_until = ?
+                    WHERE id = (
+                        SELECT id FROM spool WHERE tenant = ? AND lease_until < ? ORDER BY id LIMIT 1
+                    )
+                    RETURNING id, kind, user_id, payload, attempts
+                    """,
+                    (now + SPOOL_LEASE_SECONDS, tenant_id, now),
+                ).fetchone()
+        finally:
+            conn.close()
+
+
+def _finish(spool_id: int, outcome: str):
+    """outcome: "done" (delete), "retry" (count the attempt, retry after a delay) or "later" (release now)."""
+    if outcome == "done":
+        sql, params = "DELETE FROM spool WHERE id = ?", (spool_id,)
+    elif outcome == "retry":
+        sql = "UPDATE spool SET attempts = attempts + 1, lease_until = ? WHERE id = ?"
+        params = (time.time() + SPOOL_RETRY_DELAY, spool_id)
+    else:
+        sql, params = "UPDATE spool SET lease_until = 0 WHERE id = ?", (spool_id,)
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(sql, params)
+        finally:
+            conn.close()
+
+
+def waiting(tenant_id: Optional[str] = None) -> int:
+    """Spooled writes not yet replayed (all tenants when tenant_id is None)."""
+    if not os.path.exists(SPOOL_PATH):
+        return 0
+    with _lock:
+        conn = _connect()
+        try:
+            if tenant_id is None:
+                return conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM spool WHERE tenant = ?", (tenant_id,)).fetchone()[0]
+        finally:
+            conn.close()
+
+
+# ---------------- Probe and replay ----------------
+async def replay(context: ContextTypes.DEFAULT_TYPE):
+    if circuit.db.is_open:
+        try:
+            await asyncio.to_thread(database.ping)
+        except circuit.DatabaseUnavailable:
+            return  # still down (or another call is probing)
+    if not os.path.exists(SPOOL_PATH):
+        return
+    tenant_id = tenancy.current_id()
+    while True:
+        row = await asyncio.to_thread(_claim, tenant_id)
+        if row is None:
+            return
+        spool_id, kind, user_id, payload, attempts = row
+        handler = _handlers.get(kind)
+        try:
+            if handler is None:
+                raise ValueError(f"No spool handler for {kind!r}")
+            await handler(context.bot, int(user_id), json.loads(payload))
+        except circuit.DatabaseUnavailable:
+            await asyncio.to_thread(_finish, spool_id, "later")
+            return  # down again; pick up from here next time
+        except Exception:
+            logger.exception("Replaying spooled %s %s failed", kind, spool_id)
+            if attempts + 1 >= SPOOL_MAX_ATTEMPTS:
+                _stats["dropped"] += 1
+                await asyncio.to_thread(_finish, spool_id, "done")
+            else:
+                await asyncio.to_thread(_finish, spool_id, "retry")
+            continue
+        _stats["replayed"] += 1
+        await asyncio.to_thread(_finish, spool_id, "done")
+
+
+def install(app: Application):
+    """Schedule the probe/replay job."""
+    app.job_queue.run_repeating(replay, interval=SPOOL_REPLAY_INTERVAL, first=5, name="spool.replay")
+
+
+def stats() -> Dict[str, int]:
+    return {"waiting": waiting(), **_stats}
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Single dedicated SQLite writer thread.
+
+    Callers submit `work(conn)` callables; the writer drains everything queued
+    (up to max_batch), runs each piece of work in its own SAVEPOINT inside one
+    BEGIN IMMEDIATE transaction and commits once. Futures are resolved only
+    after that COMMIT returns, so an acknowledgement is as durable as the
+    connection's synchronous setting (FULL -> fsync'd).
+    """
+
+    def __init__(self, connect: Callable[[], Any], max_batch: int = 256, window: float = 0.002):
+        self._connect = connect
+        self._max_batch = max_batch
+        self._window = window
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._lock = threading.Lock()
+        self._started = False
+        self.batches = 0
+        self.writes = 0
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self._started = True
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued writes and stop the writer thread."""
+        if self._started and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def in_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, work: Callable[[Any], Any]) -> Future:
+        self.start()
+        fut: Future = Future()
+        self._queue.put((work, fut))
+        return fut
+
+    def stats(self) -> Dict[str, float]:
+        avg = (self.writes / self.batches) if self.batches else 0.0
+        return {"batches": self.batches, "writes": self.writes, "avg_batch": round(avg, 2)}
+
+    # ---------------- writer thread ----------------
+    def _collect(self, first) -> Tuple[List[Tuple[Callable, Future]], bool]:
+        batch = [first]
+        stopping = False
+        # Take whatever is already queued, then linger up to `window` for stragglers
+        deadline = time.monotonic() + self._window
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        return batch, stopping
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect(first)
+            self._commit_batch(conn, batch)
+            if stopping:
+                break
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for work, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT hv_write")
+                try:
+                    result = work(conn)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO hv_write")
+                    conn.execute("RELEASE hv_write")
+                    outcomes.append((fut, None, e))
+                else:
+                    conn.execute("RELEASE hv_write")
+                    outcomes.append((fut, result, None))
+            conn.execute("COMMIT")
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for work, fut in batch:
+                if fut.running():
+                    fut.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(outcomes)
+        for fut, result, err in outcomes:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(result)
@@ -0,0 +1,151 @@
+"""
+Multi-tenant mode: several halls' bots served by one process.
+
+Set TENANTS_FILE to a JSON file listing the halls:
+
+    {"tenants": [
+        {"id": "hall5", "token_env": "HALL5_BOT_TOKEN", "admin_ids": [1779704544]},
+        {"id": "hall6", "token": "123:abc", "admin_ids": [42],
+         "schema": "hall6", "db_path": "/data/hall6.db",
+         "content_path": "hall6.json", "blocks": ["Red", "Gold"], "equipment": ["Football"]}
+    ]}
+
+Each tenant gets its own Application, all running in one event loop and
+sharing the per-thread database connections and one outbound scheduler.
+The tenant an update, job or thread is working for lives in a context
+variable (bound by TenantApplication/TenantJobQueue and carried into
+asyncio.to_thread). database.py uses it to pick the data:
+
+- Postgres: the tenant's schema (search_path), default: the tenant id
+- SQLite: the tenant's own file, default: <DB_PATH dir>/<id>.db
+
+Caches are keyed by tenant too. Without TENANTS_FILE nothing is bound and
+everything behaves as a single bot configured from the environment.
+"""
+import json
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from telegram.ext import JobQueue
+
+from unitofwork import UnitOfWorkApplication
+
+# ---------------- Config ----------------
+TENANTS_FILE = os.getenv("TENANTS_FILE")
+
+_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+
+@dataclass(frozen=True)
+class Tenant:
+    id: str
+    token: str
+    schema: str
+    db_path: str
+    admin_ids: FrozenSet[int]
+    content_path: Optional[str] = None
+    blocks: Tuple[str, ...] = ()
+    equipment: Tuple[str, ...] = ()
+
+
+_current: ContextVar[Optional[Tenant]] = ContextVar("tenant", default=None)
+_tenants: Dict[str, Tenant] = {}
+
+
+def current() -> Optional[Tenant]:
+    return _current.get()
+
+
+def current_id() -> str:
+    """Cache/partition key of the bound tenant ("" in single-bot mode)."""
+    tenant = _current.get()
+    return tenant.id if tenant is not None else ""
+
+
+@contextmanager
+def use(tenant: Optional[Tenant]) -> Iterator[Optional[Tenant]]:
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def all_tenants() -> List[Tenant]:
+    return list(_tenants.values())
+
+
+def by_schema(schema: Optional[str]) -> str:
+    """Tenant id owning a Postgres schema ("" for anything that isn't a tenant's)."""
+    for tenant in _tenants.values():
+        if tenant.schema == schema:
+            return tenant.id
+    return ""
+
+
+def _tenant(spec: dict, default_dir: str, base_dir: str) -> Tenant:
+    tenant_id = str(spec["id"]).lower()
+    if not _IDENTIFIER.match(tenant_id):
+        raise ValueError(f"Tenant id {tenant_id!r} must be lowercase letters, digits and underscores.")
+    token = spec.get("token") or os.getenv(spec.get("token_env", ""), "")
+    if not token:
+        raise ValueError(f"Tenant {tenant_id!r} has no token (set 'token' or 'token_env').")
+    schema = str(spec.get("schema", tenant_id)).lower()
+    if not _IDENTIFIER.match(schema):
+        raise ValueError(f"Tenant {tenant_id!r}: invalid schema name {schema!r}.")
+    admin_ids = frozenset(int(x) for x in spec.get("admin_ids", ()))
+    if not admin_ids:
+        raise ValueError(f"Tenant {tenant_id!r} needs at least one entry in admin_ids.")
+    return Tenant(
+        id=tenant_id,
+        token=token,
+        schema=schema,
+        db_path=spec.get("db_path") or os.path.join(default_dir, f"{tenant_id}.db"),
+        admin_ids=admin_ids,
+        content_path=os.path.join(base_dir, spec["content_path"]) if spec.get("content_path") else None,
+        blocks=tuple(spec.get("blocks", ())),
+        equipment=tuple(spec.get("equipment", ())),
+    )
+
+
+def load(path: str, default_dir: str) -> List[Tenant]:
+    """Read and validate the tenants file and register its tenants."""
+    with open(path, encoding="utf-8") as f:
+        specs = json.load(f)["tenants"]
+    # Relative content paths are relative to the tenants file
+    base_dir = os.path.dirname(os.path.abspath(path))
+    tenants = [_tenant(spec, default_dir, base_dir) for spec in specs]
+    for attr in ("id", "token", "schema", "db_path"):
+        values = [getattr(t, attr) for t in tenants]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Tenants must not share a {attr}.")
+    _tenants.clear()
+    _tenants.update((t.id, t) for t in tenants)
+    return tenants
+
+
+# ---------------- Binding ----------------
+class TenantApplication(UnitOfWorkApplication):
+    """Application that processes every update with its tenant bound (traced, in a unit of work)."""
+
+    def __init__(self, *, tenant: Tenant, **kwargs):
+        super().__init__(**kwargs)
+        self.tenant = tenant
+
+    async def process_update(self, update: object) -> None:
+        with use(self.tenant):
+            await super().process_update(update)
+
+
+class TenantJobQueue(JobQueue):
+    """JobQueue whose jobs run with the owning application's tenant bound."""
+
+    @staticmethod
+    async def job_callback(job_queue: JobQueue, job) -> None:
+        application = job_queue.application
+        with use(getattr(application, "tenant", None)):
+            await job.run(application)
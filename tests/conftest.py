@@ -0,0 +1,36 @@
+"""
+Run the tests against throwaway SQLite files, never the DATABASE_URL or
+DB_PATH from .env: the modules read their config at import time, so the
+environment is set here, before any test imports them.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix="hall5-tests-")
+os.environ["DATABASE_URL"] = ""
+os.environ["DB_PATH"] = os.path.join(_scratch, "test.db")
+os.environ["SPOOL_PATH"] = os.path.join(_scratch, "spool.db")
+os.environ["BACKUP_DIR"] = os.path.join(_scratch, "backups")
+os.environ["TENANTS_FILE"] = ""
+os.environ["REPLICA_DATABASE_URL"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tables emptied between tests
+TABLES = ("pending_users", "registered_users", "export_watermarks", "bookings", "aunty_reports")
+
+
+@pytest.fixture
+def db():
+    import booking
+    import database
+
+    database.init_db()
+    booking.init_booking_db()
+    yield database
+    with database.get_db_connection() as conn:
+        for table in TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
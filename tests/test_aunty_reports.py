@@ -0,0 +1,8 @@
+def test_report_is_resolved_once(db):
+    report_id = db.add_aunty_report(11, "Ann", "near the lift")
+    assert db.resolve_aunty_report(report_id, "broadcast") == (11, "Ann", "near the lift")
+    assert db.resolve_aunty_report(report_id, "rejected") is None
+
+
+def test_unknown_report_is_not_resolved(db):
+    assert db.resolve_aunty_report(12345, "rejected") is None
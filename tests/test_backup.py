@@ -0,0 +1,23 @@
+import fcntl
+import os
+
+import backup
+
+
+def test_snapshot_is_skipped_while_another_process_holds_the_lock(db):
+    os.makedirs(backup.BACKUP_DIR, exist_ok=True)
+    with open(os.path.join(backup.BACKUP_DIR, f".{backup._name()}.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            assert backup.snapshot(None, 3600) is None
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    assert backup.snapshot(None, 3600) is not None
+
+
+def test_scheduled_snapshot_skips_a_recent_one(db):
+    taken = backup.snapshot()
+    assert backup.snapshot(None, 3600) is None
+    assert backup.list_snapshots()[0] == taken.path
+    assert not [f for f in os.listdir(backup.BACKUP_DIR) if f.endswith(".tmp")]
+    backup.verify(taken.path)
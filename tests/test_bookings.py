@@ -0,0 +1,20 @@
+import booking
+
+
+def _count(db):
+    with db.get_db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+
+
+def test_same_request_key_books_once(db):
+    first = booking.add_booking(1, "A", "Projector", "2030-01-01", "2 hours", "key-1")
+    again = booking.add_booking(1, "A", "Projector", "2030-01-01", "2 hours", "key-1")
+    assert again == first
+    assert _count(db) == 1
+
+
+def test_bookings_without_a_key_are_not_deduplicated(db):
+    first = booking.add_booking(1, "A", "Projector", "2030-01-01", "2 hours")
+    second = booking.add_booking(1, "A", "Projector", "2030-01-01", "2 hours")
+    assert first != second
+    assert _count(db) == 2
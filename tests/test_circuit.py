@@ -0,0 +1,170 @@
+import sqlite3
+
+import pytest
+
+import circuit
+from circuit import CLOSED, HALF_OPEN, OPEN, Breaker, DatabaseUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit.time, "monotonic", clock)
+    return clock
+
+
+def _opened(clock, failures=2, cooldown=10):
+    breaker = Breaker(failures=failures, cooldown=cooldown)
+    for _ in range(failures):
+        breaker.allow()
+        breaker.failure(OSError("down"))
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = Breaker(failures=3, cooldown=10)
+    breaker.failure(OSError("down"))
+    breaker.failure(OSError("down"))
+    breaker.success()  # not consecutive any more
+    breaker.failure(OSError("down"))
+    breaker.failure(OSError("down"))
+    assert breaker.state == CLOSED
+    breaker.failure(OSError("down"))
+    assert breaker.state == OPEN
+    with pytest.raises(DatabaseUnavailable):
+        breaker.allow()
+    assert breaker.stats()["opened"] == 1
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = _opened(clock)
+    clock.now += 9
+    with pytest.raises(DatabaseUnavailable):
+        breaker.allow()
+    clock.now += 1
+    breaker.allow()  # the probe
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(DatabaseUnavailable):
+        breaker.allow()
+
+
+def test_probe_success_closes(clock):
+    breaker = _opened(clock)
+    clock.now += 10
+    probe = breaker.allow()
+    breaker.success(probe)
+    assert breaker.state == CLOSED
+    breaker.allow()
+    breaker.allow()
+
+
+def test_probe_failure_reopens_for_another_cooldown(clock):
+    breaker = _opened(clock)
+    clock.now += 10
+    breaker.allow()
+    breaker.failure(OSError("still down"))
+    assert breaker.state == OPEN
+    clock.now += 5
+    with pytest.raises(DatabaseUnavailable):
+        breaker.allow()
+    clock.now += 5
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+
+def test_released_probe_lets_the_next_call_probe(clock):
+    breaker = _opened(clock)
+    clock.now += 10
+    probe = breaker.allow()
+    breaker.release_probe(probe)  # e.g. a constraint error: no verdict
+    assert breaker.state == HALF_OPEN
+    breaker.allow()
+
+
+def test_probe_that_never_reports_is_taken_over(clock):
+    breaker = _opened(clock)
+    clock.now += 10
+    breaker.allow()
+    clock.now += 9
+    with pytest.raises(DatabaseUnavailable):
+        breaker.allow()
+    clock.now += 1
+    breaker.allow()
+    assert breaker.stats()["probes"] == 2
+
+
+def test_success_without_the_probe_token_does_not_close(clock):
+    breaker = _opened(clock)
+    breaker.success()  # a statement that was already in flight
+    assert breaker.state == OPEN
+    clock.now += 10
+    probe = breaker.allow()
+    breaker.success()  # a connection that never asked allow()
+    breaker.release_probe(None)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(DatabaseUnavailable):
+        breaker.allow()
+    breaker.success(probe)
+    assert breaker.state == CLOSED
+
+
+def test_superseded_probe_cannot_close(clock):
+    breaker = _opened(clock)
+    clock.now += 10
+    stale = breaker.allow()
+    clock.now += 10
+    probe = breaker.allow()
+    breaker.success(stale)
+    assert breaker.state == HALF_OPEN
+    breaker.success(probe)
+    assert breaker.state == CLOSED
+
+
+@pytest.fixture
+def half_open(db, clock, monkeypatch):
+    breaker = _opened(clock)
+    clock.now += 10
+    monkeypatch.setattr(circuit, "db", breaker)
+    return breaker
+
+
+def test_non_outage_error_releases_the_probe(half_open):
+    import booking
+
+    # Not null constraint: a bad statement, not an outage
+    with pytest.raises(sqlite3.IntegrityError):
+        booking.add_booking(1, "A", None, "2030-01-01", "2 hours")
+    assert half_open.state == HALF_OPEN
+    half_open.allow()
+
+
+def test_raw_connection_settles_the_probe(half_open):
+    import booking
+
+    booking.init_booking_db()  # schema setup, no run_query
+    assert half_open.state == CLOSED
+
+
+def test_listener_reads_do_not_report_to_the_breaker(db, clock, monkeypatch):
+    import invalidation
+
+    breaker = _opened(clock)
+    reports = []
+    monkeypatch.setattr(breaker, "success", lambda probe=None: reports.append(probe))
+    monkeypatch.setattr(circuit, "db", breaker)
+    conn = db.new_connection()
+    try:
+        invalidation.SqlitePoller()._poll(conn)
+    finally:
+        conn.close()
+    assert reports == []
+    assert breaker.state == OPEN
@@ -0,0 +1,49 @@
+def _ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_out_of_order_approval_is_exported(db):
+    # A asks first, B second; B is approved and exported before A is approved
+    db.add_pending_user(1, "A", "Purple", "01-01-001")
+    db.add_pending_user(2, "B", "Purple", "01-01-002")
+    db.approve_user(2)
+
+    rows, watermark = db.get_rows_since("registered_users", None)
+    assert _ids(rows) == [2]
+    db.set_export_watermark(9, "registered_users", watermark)
+
+    db.approve_user(1)
+    rows, watermark = db.get_rows_since("registered_users", db.get_export_watermark(9, "registered_users"))
+    assert _ids(rows) == [1]
+    db.set_export_watermark(9, "registered_users", watermark)
+
+    rows, _ = db.get_rows_since("registered_users", db.get_export_watermark(9, "registered_users"))
+    assert rows == []
+    assert sorted(_ids(db.get_registered_users())) == [1, 2]
+
+
+def test_reupserted_rows_are_exported_again(db):
+    db.bulk_upsert_registered_users([(1, "A", "Purple", "01-01-001"), (2, "B", "Purple", "01-01-002")])
+    rows, watermark = db.get_rows_since("registered_users", None)
+    assert _ids(rows) == [1, 2]
+
+    db.bulk_upsert_registered_users([(1, "A", "Orange", "01-01-001")])
+    rows, _ = db.get_rows_since("registered_users", watermark)
+    assert [(row[0], row[2]) for row in rows] == [(1, "Orange")]
+
+
+def test_export_rows_have_the_export_columns(db):
+    db.add_pending_user(3, "C", "Green", "02-02-002")
+    rows, watermark = db.get_rows_since("pending_users", None)
+    assert len(rows[0]) == 5
+    assert watermark[1] == 3
+
+
+def test_watermark_from_before_row_versions_restarts_the_export(db):
+    with db.get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO export_watermarks (admin_id, table_name, last_created_at, last_id) "
+            "VALUES (9, 'pending_users', '2030-01-01', 5)"
+        )
+        conn.commit()
+    assert db.get_export_watermark(9, "pending_users") is None
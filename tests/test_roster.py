@@ -0,0 +1,10 @@
+def test_roster_reimport_keeps_the_join_date(db):
+    db.bulk_upsert_registered_users([(1, "A", "Purple", "01-01-001")])
+    with db.get_db_connection() as conn:
+        conn.execute("UPDATE registered_users SET created_at = '2020-01-01T00:00:00' WHERE user_id = 1")
+        conn.commit()
+    _, updated = db.bulk_upsert_registered_users([(1, "A", "Orange", "01-01-001")])
+    assert updated == [1]
+    with db.get_db_connection() as conn:
+        row = conn.execute("SELECT block, created_at FROM registered_users WHERE user_id = 1").fetchone()
+    assert tuple(row) == ("Orange", "2020-01-01T00:00:00")
@@ -0,0 +1,26 @@
+def _found(db, text):
+    rows, _ = db.search_residents(text)
+    return [row[0] for row in rows]
+
+
+def test_free_text_rooms_match_by_digits(db):
+    db.bulk_upsert_registered_users([(1, "Ann", "Purple", "Rm 28_04_543"), (2, "Bob", "Purple", "28-05-111")])
+    assert _found(db, "28-04-543") == [1]
+    assert _found(db, "2804") == [1]
+    assert _found(db, "543") == [1]
+
+
+def test_search_index_follows_room_changes(db):
+    db.bulk_upsert_registered_users([(1, "Ann", "Purple", "28-04-543")])
+    db.bulk_upsert_registered_users([(1, "Ann", "Purple", "Room 12/07/999")])
+    assert _found(db, "543") == []
+    assert _found(db, "1207999") == [1]
+
+
+def test_rooms_indexed_under_an_older_key_are_reindexed(db):
+    db.bulk_upsert_registered_users([(1, "Ann", "Purple", "Rm 28_04_543")])
+    with db.get_db_connection() as conn:
+        conn.execute("UPDATE resident_search SET room_key = 'Rm28_04_543' WHERE rowid = 1")
+        conn.commit()
+    db._init_search_index()
+    assert _found(db, "2804543") == [1]
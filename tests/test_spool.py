@@ -0,0 +1,91 @@
+import asyncio
+import types
+
+import pytest
+
+import circuit
+import spool
+
+handled = []
+failures = []
+
+
+async def _handler(bot, user_id, payload):
+    if failures:
+        raise failures.pop(0)
+    handled.append((user_id, payload))
+
+
+spool.register("test", _handler)
+
+
+@pytest.fixture(autouse=True)
+def empty_spool():
+    handled.clear()
+    failures.clear()
+    conn = spool._connect()
+    with conn:
+        conn.execute("DELETE FROM spool")
+    conn.close()
+    yield
+
+
+def _replay():
+    asyncio.run(spool.replay(types.SimpleNamespace(bot=None)))
+
+
+def _attempts():
+    conn = spool._connect()
+    try:
+        return [row[0] for row in conn.execute("SELECT attempts FROM spool ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_claimed_entry_is_leased():
+    spool.enqueue("test", 1, {"n": 1})
+    spool_id = spool._claim("")[0]
+    assert spool._claim("") is None  # another worker can't take it meanwhile
+    spool._finish(spool_id, "later")
+    assert spool._claim("")[0] == spool_id
+
+
+def test_replay_applies_entries_in_order_and_deletes_them(db):
+    spool.enqueue("test", 1, {"n": 1})
+    spool.enqueue("test", 2, {"n": 2})
+    _replay()
+    assert handled == [(1, {"n": 1}), (2, {"n": 2})]
+    assert spool.waiting() == 0
+
+
+def test_failed_entry_is_retried_after_a_delay(db, monkeypatch):
+    spool.enqueue("test", 1, {"n": 1})
+    failures.append(ValueError("bad"))
+    _replay()
+    assert _attempts() == [1]
+    _replay()  # still inside SPOOL_RETRY_DELAY
+    assert handled == []
+    monkeypatch.setattr(spool.time, "time", lambda: 10 ** 10)
+    _replay()
+    assert handled == [(1, {"n": 1})]
+
+
+def test_entry_is_dropped_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(spool, "SPOOL_RETRY_DELAY", 0)
+    spool.enqueue("test", 1, {"n": 1})
+    failures.extend(ValueError("bad") for _ in range(spool.SPOOL_MAX_ATTEMPTS))
+    for _ in range(spool.SPOOL_MAX_ATTEMPTS):
+        _replay()
+    assert spool.waiting() == 0
+    assert handled == []
+
+
+def test_outage_releases_the_entry_and_stops(db):
+    spool.enqueue("test", 1, {"n": 1})
+    spool.enqueue("test", 2, {"n": 2})
+    failures.append(circuit.DatabaseUnavailable("down"))
+    _replay()
+    assert handled == []
+    assert _attempts() == [0, 0]  # an outage isn't counted against the entry
+    _replay()
+    assert handled == [(1, {"n": 1}), (2, {"n": 2})]
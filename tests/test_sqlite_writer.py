@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+
+import pytest
+
+from sqlite_writer import GroupCommitWriter
+
+
+@pytest.fixture
+def path(db):
+    path = db.db_path()
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS writer_probe (name TEXT PRIMARY KEY)")
+    yield path
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE writer_probe")
+
+
+def _insert(name):
+    return lambda conn: conn.execute("INSERT INTO writer_probe (name) VALUES (?)", (name,)).rowcount
+
+
+def _names(path):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(row[0] for row in conn.execute("SELECT name FROM writer_probe"))
+    finally:
+        conn.close()
+
+
+class _HeldCommit:
+    """Writer connection whose COMMIT waits until the test lets it through."""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._conn = None
+        self.committing = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self._conn = self._connect()
+        return self
+
+    def execute(self, sql, *args):
+        if sql == "COMMIT":
+            self.committing.set()
+            self.release.wait(5)
+        return self._conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def test_future_resolves_only_after_commit(db, path):
+    held = _HeldCommit(lambda: db._connect_writer(path))
+    writer = GroupCommitWriter(held)
+    try:
+        fut = writer.submit(_insert("alice"))
+        assert held.committing.wait(5)
+        # The work has run but the batch isn't committed: no ack, nothing visible
+        assert not fut.done()
+        assert _names(path) == []
+        held.release.set()
+        assert fut.result(5) == 1
+        assert _names(path) == ["alice"]
+    finally:
+        held.release.set()
+        writer.stop()
+
+
+def test_failed_item_rolls_back_alone(db, path):
+    def fails(conn):
+        conn.execute("INSERT INTO writer_probe (name) VALUES ('bob')")
+        raise ValueError("boom")
+
+    # A long window and max_batch=3 make the three submissions one batch
+    writer = GroupCommitWriter(lambda: db._connect_writer(path), max_batch=3, window=1.0)
+    try:
+        futures = [writer.submit(_insert("alice")), writer.submit(fails), writer.submit(_insert("carol"))]
+        assert futures[0].result(5) == 1
+        with pytest.raises(ValueError, match="boom"):
+            futures[1].result(5)
+        assert futures[2].result(5) == 1
+    finally:
+        writer.stop()
+    assert writer.stats()["batches"] == 1
+    assert writer.stats()["writes"] == 3
+    assert _names(path) == ["alice", "carol"]
+
+
+def test_nested_write_transaction_raises(db, path, monkeypatch):
+    monkeypatch.setattr(db, "SQLITE_TUNED", True)
+    monkeypatch.setattr(db, "_writers", {})
+
+    def outer(conn):
+        _insert("alice")(conn)
+        return db.write_transaction(_insert("bob"), "inner")
+
+    try:
+        with pytest.raises(RuntimeError, match="nested"):
+            db.write_transaction(outer, "outer")
+        # The writer is still usable and the failed work left nothing behind
+        assert db.write_transaction(_insert("carol"), "after") == 1
+    finally:
+        for writer in db._writers.values():
+            writer.stop()
+    assert _names(path) == ["carol"]
@@ -0,0 +1,314 @@
+"""
+Per-update tracing.
+
+Every update gets a trace: a root span for the update, one span per
+database statement and transaction (run_query, write_transaction,
+read_transaction) and one per Telegram API call, both as queued in the
+outbound scheduler and as the HTTP request itself. The trace lives in a
+context variable, so spans opened in asyncio.to_thread and in tasks the
+update spawns (notify_admins' gather) land in the same trace.
+
+- TRACE_SAMPLE_RATE of updates are exported, as JSON lines to TRACE_FILE
+  and/or as OTLP/HTTP JSON to TRACE_OTLP_URL (e.g. a collector's
+  http://localhost:4318/v1/traces), from a background thread.
+- Any update slower than TRACE_SLOW_MS is always logged with its full span
+  breakdown (and exported, if an exporter is set), sampled or not.
+
+Spans are only recorded inside an update; elsewhere span() is a no-op.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Config ----------------
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_OTLP_URL = os.getenv("TRACE_OTLP_URL", "")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "hall5-bot")
+# Traces waiting for the exporter thread; more are dropped
+EXPORT_QUEUE_SIZE = 1000
+# Spans kept per trace; a runaway update (e.g. a broadcast) keeps its first ones
+MAX_SPANS = 500
+
+ENABLED = TRACE_SLOW_MS > 0 or (TRACE_SAMPLE_RATE > 0 and bool(TRACE_FILE or TRACE_OTLP_URL))
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        # Still open: a task the update spawned outlived it
+        return ((self.end or time.time_ns()) - self.start) / 1e6
+
+
+class Trace:
+    def __init__(self, sampled: bool):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        self.truncated = 0
+
+    def add(self, span: Span) -> bool:
+        if len(self.spans) >= MAX_SPANS:
+            self.truncated += 1
+            return False
+        self.spans.append(span)
+        return True
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("trace_parent", default=None)
+_stats = {"traces": 0, "sampled": 0, "slow": 0, "exported": 0, "dropped": 0, "export_errors": 0}
+
+
+def active() -> bool:
+    return _trace.get() is not None
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Record a child span of the current one (no-op outside a traced update)."""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    s = Span(name, _parent.get(), attributes)
+    if not trace.add(s):
+        yield None
+        return
+    token = _parent.set(s.span_id)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s.end = time.time_ns()
+        _parent.reset(token)
+
+
+# ---------------- Updates ----------------
+def _describe(update: object) -> Dict[str, Any]:
+    if not isinstance(update, Update):
+        return {"name": f"update {type(update).__name__}"}
+    attrs: Dict[str, Any] = {"update_id": update.update_id}
+    if update.effective_user is not None:
+        attrs["user_id"] = update.effective_user.id
+    if update.effective_chat is not None:
+        attrs["chat_id"] = update.effective_chat.id
+    message = update.effective_message
+    if update.callback_query is not None:
+        kind = "callback " + (update.callback_query.data or "").split(":", 1)[0]
+    elif message is not None and message.text and message.text.startswith("/"):
+        kind = message.text.split()[0].split("@", 1)[0]
+    elif message is not None:
+        kind = "message"
+    else:
+        kind = "update"
+    attrs["name"] = f"update {kind}"
+    return attrs
+
+
+class TracedApplication(Application):
+    """Application that traces every update it processes."""
+
+    async def process_update(self, update: object) -> None:
+        if not ENABLED:
+            await super().process_update(update)
+            return
+        attrs = _describe(update)
+        name = attrs.pop("name")
+        tenant = getattr(self, "tenant", None)
+        if tenant is not None:
+            attrs["tenant"] = tenant.id
+        trace = Trace(sampled=random.random() < TRACE_SAMPLE_RATE)
+        trace_token = _trace.set(trace)
+        parent_token = _parent.set(None)
+        try:
+            with span(name, **attrs):
+                await super().process_update(update)
+        finally:
+            _parent.reset(parent_token)
+            _trace.reset(trace_token)
+            _finish(trace)
+
+
+def _finish(trace: Trace):
+    _stats["traces"] += 1
+    root = trace.spans[0]
+    slow = TRACE_SLOW_MS > 0 and root.duration_ms >= TRACE_SLOW_MS
+    if slow:
+        _stats["slow"] += 1
+        logger.warning(
+            "Slow update: %s took %.0f ms (trace %s)\n%s", root.name, root.duration_ms, trace.trace_id, breakdown(trace)
+        )
+    if trace.sampled:
+        _stats["sampled"] += 1
+    if trace.sampled or slow:
+        _export(trace)
+
+
+def breakdown(trace: Trace) -> str:
+    """Indented span tree: offset from the update's start, duration, name, attributes."""
+    children: Dict[Optional[str], List[Span]] = {}
+    for s in trace.spans:
+        children.setdefault(s.parent_id, []).append(s)
+    origin = trace.spans[0].start
+    lines: List[str] = []
+
+    def walk(parent_id: Optional[str], depth: int):
+        for s in sorted(children.get(parent_id, ()), key=lambda x: x.start):
+            attrs = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+            error = f" !{s.error}" if s.error else ""
+            lines.append(
+                f"  +{(s.start - origin) / 1e6:7.1f} ms {s.duration_ms:8.1f} ms  {'  ' * depth}{s.name} {attrs}{error}".rstrip()
+            )
+            walk(s.span_id, depth + 1)
+
+    walk(None, 0)
+    if trace.truncated:
+        lines.append(f"  ... {trace.truncated} more spans not recorded")
+    return "\n".join(lines)
+
+
+# ---------------- Telegram HTTP ----------------
+class TracedRequest(HTTPXRequest):
+    """HTTPXRequest that records each Bot API call as a span."""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        if _trace.get() is None:
+            return await super().do_request(url, method, request_data, **kwargs)
+        with span("http " + url.rsplit("/", 1)[-1]) as s:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+            if s is not None:
+                s.attributes["status"] = status
+            return status, payload
+
+
+# ---------------- Export ----------------
+_exports: "queue.Queue[Trace]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+_exporter: Optional[threading.Thread] = None
+_exporter_lock = threading.Lock()
+
+
+def _export(trace: Trace):
+    global _exporter
+    if not (TRACE_FILE or TRACE_OTLP_URL):
+        return
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+                _exporter.start()
+    try:
+        _exports.put_nowait(trace)
+    except queue.Full:
+        _stats["dropped"] += 1
+
+
+def _json_span(trace: Trace, s: Span) -> Dict[str, Any]:
+    return {
+        "trace_id": trace.trace_id,
+        "span_id": s.span_id,
+        "parent_id": s.parent_id,
+        "name": s.name,
+        "start_ns": s.start,
+        "duration_ms": round(s.duration_ms, 3),
+        "attributes": s.attributes,
+        "error": s.error,
+    }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp(traces: List[Trace]) -> Dict[str, Any]:
+    """OTLP/HTTP JSON body (ExportTraceServiceRequest) for a batch of traces."""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            spans.append({
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                "name": s.name,
+                "kind": 2 if s.parent_id is None else 1,  # SERVER for the update, INTERNAL below it
+                "startTimeUnixNano": str(s.start),
+                "endTimeUnixNano": str(s.end or s.start),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {},
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]
+    }
+
+
+def _export_loop():
+    import httpx
+
+    client = httpx.Client(timeout=5.0) if TRACE_OTLP_URL else None
+    while True:
+        batch = [_exports.get()]
+        while len(batch) < 100:
+            try:
+                batch.append(_exports.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if TRACE_FILE:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    for trace in batch:
+                        f.write(json.dumps({
+                            "trace_id": trace.trace_id,
+                            "sampled": trace.sampled,
+                            "spans": [_json_span(trace, s) for s in trace.spans],
+                        }, default=str) + "\n")
+            if client is not None:
+                client.post(TRACE_OTLP_URL, json=_otlp(batch)).raise_for_status()
+            _stats["exported"] += len(batch)
+        except Exception:
+            _stats["export_errors"] += 1
+            logger.exception("Trace export failed; dropped %s traces", len(batch))
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
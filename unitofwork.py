@@ -0,0 +1,43 @@
+"""
+Per-update unit of work.
+
+UnitOfWorkApplication runs every update inside database.unit_of_work(), so
+the decorators (registration gate, admin check), the handler and every
+database.py/booking.py call it makes share one pooled connection, and the
+writes of a multi-step action commit together, once. The transaction is
+committed before the update's next Telegram call (outbound.py) and at the
+end of the update; an error that reaches the error handlers rolls it back
+first. Those COMMITs and ROLLBACKs run in a worker thread, never on the
+event loop. Turn it off with UNIT_OF_WORK=0.
+"""
+import asyncio
+from typing import Optional
+
+from tracing import TracedApplication
+
+# database is imported in the methods: it imports tenancy, whose TenantApplication subclasses this
+
+
+class UnitOfWorkApplication(TracedApplication):
+    """Application that processes (and traces) every update in its own unit of work."""
+
+    async def process_update(self, update: object) -> None:
+        import database
+
+        try:
+            with database.unit_of_work():
+                await super().process_update(update)
+                # Commit here, off the loop; unit_of_work() then has nothing left to end
+                if database.unit_of_work_pending():
+                    await asyncio.to_thread(database.flush_unit_of_work)
+        except Exception as e:
+            # The final commit failed; since Telegram calls flush first, nobody was told otherwise
+            await self.process_error(update, e)
+
+    async def process_error(self, update: Optional[object], error: Exception, job=None, coroutine=None) -> bool:
+        import database
+
+        # Before the error handlers run: their replies would flush (commit) the failed update's writes
+        if database.unit_of_work_pending():
+            await asyncio.to_thread(database.rollback_unit_of_work)
+        return await super().process_error(update, error, job, coroutine)